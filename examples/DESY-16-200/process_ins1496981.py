@@ -4,27 +4,42 @@
 Write YAML files from text files linked on H1 web page, together with
 numbers given in Tables 12 and 13 of LaTeX source downloaded from arXiv.
 
-Tested with python2 and python3.  Run with: "python process_ins1496981.py".
+Tested with python3.  Run with: "python process_ins1496981.py" from a
+checkout of hepdata-submission, as the data tables and the archive are
+written with modules from its scripts directory.
 Reformatted with "black -l 79".  Code passes all checks with "flake8".
 Running "pylint -d C0330" (some indentation conflict with black) gives code
 rating of 9.80/10 (pylint suggests refactoring to make functions smaller).
 """
 
-from __future__ import print_function
-
 import os
 import re
+import sys
 
 import pandas as pd  # Install with: pip install pandas
 
 import yaml  # Install with: pip install pyyaml
 
-# We try to dump using the CSafeDumper for speed improvements.
+# We try to dump submission.yaml using the CSafeDumper for speed improvements.
 try:
     from yaml import CSafeDumper as Dumper
 except ImportError:
     from yaml import SafeDumper as Dumper
 
+# Modules from the scripts directory of hepdata-submission.
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        os.pardir,
+        os.pardir,
+        "scripts",
+    ),
+)
+from archivebuilder import ArchiveBuilder  # noqa: E402
+from emitter import write_table as write_data_table  # noqa: E402
+from frametables import frame_tables, write_table  # noqa: E402
+
 
 __author__ = "Graeme Watt"
 
@@ -307,13 +322,55 @@ def write_lowq2_tables(
 
     submission_tables = []  # list of Python dictionaries to be returned
 
+    # Columns of the variables of the data tables, independent variable
+    # first, with the P_T bin edges as numbers and the rest as in the file.
+    df_str = df_str.assign(
+        Pt_low=df_num.Pt_min.astype(float), Pt_high=df_num.Pt_max.astype(float)
+    )
+    # Keep the first row of each (Q2, P_T) bin, with the Q2 bins and the
+    # P_T bins within each in the order they first appear in the file.
+    df_str = (
+        df_str.drop_duplicates(["q2min", "Pt_min"])
+        .assign(
+            q2_bin=lambda df: pd.factorize(df.q2min)[0],
+            pt_bin=lambda df: pd.factorize(df.Pt_min)[0],
+        )
+        .sort_values(["q2_bin", "pt_bin"], kind="stable")
+    )
+    columns = []
+    columns.append({"low": "Pt_low", "high": "Pt_high"})
+    # The cross-section value, the statistical error and the individual
+    # systematic errors (symmetric ones without a sign, zero ones skipped,
+    # both compared as numbers).
+    errors = [{"symerror": "stat(%)", "label": "stat", "percent": True}]
+    for syst in syst_labels:
+        errors.append(
+            {
+                "plus": syst + "+",
+                "minus": syst + "-",
+                "label": syst,
+                "percent": True,
+            }
+        )
+    columns.append({"value": "Sigma", "errors": errors})
+    # The correction factor on the theoretical cross section.
+    columns.append(
+        {
+            "value": "HadCorr",
+            "errors": [{"symerror": "HadErr", "percent": True}],
+        }
+    )
+    # The radiative correction factor.
+    columns.append({"value": "RadCorr"})
+
     # Iterate over each Q2 bin, writing a separate data table for each one.
-    q2mins = df_str.q2min.unique()
-    q2maxs = df_str.q2max.unique()
-    for iq2, q2min in enumerate(q2mins):
+    # The rows of all tables are formatted at once, then split by Q2 bin.
+    tables = frame_tables(df_str, columns, groupby="q2min")
+    for iq2, (q2min, index, rows) in enumerate(tables):
+        q2max = df_str.q2max.iloc[index[0]]
         independent_variables = []
         independent_variables.append(
-            {"header": {"name": variable, "units": "GeV"}, "values": []}
+            {"header": {"name": variable, "units": "GeV"}}
         )
         dependent_variables = [{}]
         dependent_variables[0]["header"] = (
@@ -324,12 +381,11 @@ def write_lowq2_tables(
         dependent_variables.append({"header": {"name": r"$c^{\rm had}$"}})
         dependent_variables.append({"header": {"name": r"$c^{\rm rad}$"}})
         for dependent_variable in dependent_variables:
-            dependent_variable["values"] = []
             dependent_variable["qualifiers"] = []
             dependent_variable["qualifiers"].append(
                 {
                     "name": "$Q^2$",
-                    "value": q2mins[iq2] + "-" + q2maxs[iq2],
+                    "value": q2min + "-" + q2max,
                     "units": "GeV$^2$",
                 }
             )
@@ -366,18 +422,12 @@ def write_lowq2_tables(
                     "units": "GeV",
                 }
             )
-        # Iterate over each P_T bin.
-        for ipt, pt_min in enumerate(df_str.Pt_min.unique()):
-            row = df_str[
-                (df_str.q2min == q2min) & (df_str.Pt_min == pt_min)
-            ].iloc[0]
-            # Save the independent variable value.
-            independent_variables[0]["values"].append(
-                {"low": float(row["Pt_min"]), "high": float(row["Pt_max"])}
-            )
-            if norm:
-                # Save the bin values, used later in the correlation matrix.
-                # Avoid LaTeX encoding to reduce MathJax typesetting.
+        if norm:
+            # Save the bin values, used later in the correlation matrix.
+            # Avoid LaTeX encoding to reduce MathJax typesetting.
+            for pt_min, pt_max in zip(
+                df_str.Pt_min.iloc[index], df_str.Pt_max.iloc[index]
+            ):
                 correlation_bins.append(
                     "{} = {} {}, {} = {}-{} {}".format(
                         dependent_variables[0]["qualifiers"][0]["name"].strip(
@@ -392,60 +442,19 @@ def write_lowq2_tables(
                         .replace(r"\rm ", "")
                         .replace(r"\langle ", "<")
                         .replace(r" \rangle", ">"),
-                        row["Pt_min"],
-                        row["Pt_max"],
+                        pt_min,
+                        pt_max,
                         independent_variables[0]["header"]["units"],
                     )
                 )
-            # Save the cross-section value and the statistical error.
-            dependent_variables[0]["values"].append(
-                {
-                    "value": row["Sigma"],
-                    "errors": [
-                        {"symerror": row["stat(%)"] + "%", "label": "stat"}
-                    ],
-                }
-            )
-            # Iterate over the individual systematic errors.
-            for syst in syst_labels:
-                if row[syst + "+"] == "0.00" and row[syst + "-"] == "-0.00":
-                    # Skip systematic errors that are zero.
-                    continue
-                elif row[syst + "+"] == row[syst + "-"].replace("-", ""):
-                    # Save a symmetric error (without a sign).
-                    dependent_variables[0]["values"][ipt]["errors"].append(
-                        {"symerror": row[syst + "+"] + "%", "label": syst}
-                    )
-                else:
-                    # Save an asymmetric error (including the sign).
-                    dependent_variables[0]["values"][ipt]["errors"].append(
-                        {
-                            "asymerror": {
-                                "plus": row[syst + "+"] + "%",
-                                "minus": row[syst + "-"] + "%",
-                            },
-                            "label": syst,
-                        }
-                    )
-            # Save the correction factor on the theoretical cross section.
-            dependent_variables[1]["values"].append(
-                {
-                    "value": row["HadCorr"],
-                    "errors": [{"symerror": row["HadErr"] + "%"}],
-                }
-            )
-            # Save the radiative correction factor.
-            dependent_variables[2]["values"].append({"value": row["RadCorr"]})
 
         # Write independent_variables and dependent_variables to a YAML file.
-        data_document = {
-            "independent_variables": independent_variables,
-            "dependent_variables": dependent_variables,
-        }
         data_file = "data{}.yaml".format(num_tables + iq2 + 1)
         print("Dumping {}".format(os.path.join(output_dir, data_file)))
         with open(os.path.join(output_dir, data_file), "w") as data_stream:
-            yaml.dump(data_document, data_stream, Dumper=Dumper)
+            write_table(
+                data_stream, independent_variables, dependent_variables, rows
+            )
 
         # Define more metadata for this data table specific to this Q2 bin.
         name = "{}s for $Q^2$ = {} GeV$^2$".format(
@@ -625,7 +634,7 @@ def write_correlation_table(
     data_file = "data{}.yaml".format(num_tables + 1)
     print("Dumping {}".format(os.path.join(output_dir, data_file)))
     with open(os.path.join(output_dir, data_file), "w") as data_stream:
-        yaml.dump(data_document, data_stream, Dumper=Dumper)
+        write_data_table(data_stream, data_document)
 
     # Define metadata for this data table such as keywords.
 
@@ -970,7 +979,7 @@ def write_highq2_tables(
         data_file = "data{}.yaml".format(num_tables + (2 if norm else 1))
         print("Dumping {}".format(os.path.join(output_dir, data_file)))
         with open(os.path.join(output_dir, data_file), "w") as data_stream:
-            yaml.dump(data_document, data_stream, Dumper=Dumper)
+            write_data_table(data_stream, data_document)
 
         # Define more metadata for this data table.
         measurement = "Normalised inclusive jet" if norm else "Inclusive jet"
@@ -1102,7 +1111,7 @@ def write_alphas_table(input_dir, input_file, output_dir, num_tables):
     data_file = "data{}.yaml".format(num_tables + 1)
     print("Dumping {}".format(os.path.join(output_dir, data_file)))
     with open(os.path.join(output_dir, data_file), "w") as data_stream:
-        yaml.dump(data_document, data_stream, Dumper=Dumper)
+        write_data_table(data_stream, data_document)
 
     # Define metadata for this data table such as keywords.
 
@@ -1178,28 +1187,26 @@ def write_alphas_table(input_dir, input_file, output_dir, num_tables):
 
 
 def write_zipfile(input_dir, output_dir, submission, zipfilename):
-    """Write all YAML files and resource files to a .zip file for upload."""
-
-    # Get a list of files (possible duplicates) to be added to the .zip file.
-    zipfiles = []
-    for yamlfile in os.listdir(output_dir):
-        if yamlfile.endswith(".yaml"):
-            zipfiles.append(os.path.join(output_dir, yamlfile))
-    for submission_table in submission:
-        for resource in submission_table["additional_resources"]:
-            location = resource["location"]
-            if location == os.path.basename(__file__):
-                zipfiles.append(__file__)  # this Python script
-            elif not location.startswith("http"):
-                zipfiles.append(os.path.join(input_dir, location))
-
-    # Write all files (excluding duplicates) to the .zip file.
-    from zipfile import ZipFile
-
-    with ZipFile(zipfilename, "w") as zip_file:
-        for zfile in set(zipfiles):  # use "set" to remove duplicates
-            print("Writing {} to {}".format(zfile, zipfilename))
-            zip_file.write(zfile, os.path.basename(zfile))
+    """Write all YAML files and resource files to a .zip file for upload.
+
+    Uses the archive builder in the scripts directory of hepdata-submission,
+    which writes each file once and always gives the same .zip file.
+    """
+
+    # Add all files (possibly more than once) to the .zip file.
+    with ArchiveBuilder(zipfilename) as archive:
+        for yamlfile in sorted(os.listdir(output_dir)):
+            if yamlfile.endswith(".yaml"):
+                archive.add_file(os.path.join(output_dir, yamlfile))
+        for submission_table in submission:
+            for resource in submission_table["additional_resources"]:
+                location = resource["location"]
+                if location == os.path.basename(__file__):
+                    archive.add_file(__file__)  # this Python script
+                elif not location.startswith("http"):
+                    archive.add_file(os.path.join(input_dir, location))
+        for name in archive.names():
+            print("Writing {} to {}".format(name, zipfilename))
 
 
 if __name__ == "__main__":
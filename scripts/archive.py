@@ -0,0 +1,390 @@
+"""
+Access to the files of a submission, either in a directory or in an
+archive (.zip, .tar, .tar.gz, .tgz) as uploaded to HEPData.
+
+Members of an archive are read straight from the archive, never
+extracted to disk.  They are addressed by the path of the archive
+joined with their name inside it, e.g.
+
+  TestHEPSubmission.zip/TestHEPSubmission/data1.yaml
+
+so that locations relative to submission.yaml resolve as they would in
+an unpacked directory.
+"""
+import errno
+import gzip
+import hashlib
+import io
+import os
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+ARCHIVE_SUFFIXES = ('.zip','.tar','.tar.gz','.tgz')
+
+# ====================================================================
+def is_archive(path):
+    """Check if a path is a submission archive"""
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_SUFFIXES)
+
+# ====================================================================
+class ArchiveError(IOError):
+    """An archive that cannot be read, e.g. because it is truncated or
+    not an archive at all"""
+
+    def __init__(self,path,error):
+        super().__init__('{} cannot be read as an archive: {}'
+                         .format(path,error))
+
+# Errors of reading a broken archive
+ARCHIVE_ERRORS = (zipfile.BadZipFile,tarfile.TarError,EOFError,
+                  zlib.error,OSError)
+
+# ====================================================================
+class ForwardReader(io.RawIOBase):
+    """Wraps a stream that can only be read forward, such as a member
+    of a tar archive opened in stream mode"""
+
+    def __init__(self,raw,name):
+        self._raw = raw
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self,buf):
+        data = self._raw.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+# ====================================================================
+class LocalFiles:
+    """Files in the local file system"""
+    sequential = False
+
+    def open(self,path):
+        """Open a file for reading text, decompressing .gz files"""
+        if path.endswith('.gz'):
+            return gzip.open(path,'rt')
+        return open(path,'r')
+
+    def isfile(self,path):
+        return os.path.isfile(path)
+
+    def listdir(self,directory):
+        """Names of the files in a directory, read in one system call
+        where the file system allows it"""
+        try:
+            return [e.name for e in os.scandir(directory or os.curdir)
+                    if e.is_file()]
+        except OSError:
+            return []
+
+    def digest(self,path):
+        """Hash of the content of a file, or None if it cannot be read"""
+        from resultcache import file_digest
+        return file_digest(path)
+
+    def stat(self,path):
+        """Modification time (ns) and size of a file, or None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+# ====================================================================
+class ArchiveFiles:
+    """Files in a submission archive
+
+    The index of the archive is read once, on first use.  Derived
+    classes implement reading the members.
+    """
+    sequential = False
+
+    def __init__(self,path):
+        """Create access to an archive
+
+        :param path: Path to the archive
+        """
+        self._path    = path
+        self._archive = None
+        self._index   = None
+        self._pid     = os.getpid()
+
+    def __getstate__(self):
+        # The open archive cannot be sent to another process
+        return {'_path': self._path, '_archive': None, '_index': None,
+                '_pid': None}
+
+    def archive(self):
+        """The open archive, opened again in a forked process, as the
+        file position cannot be shared"""
+        if self._archive is None or self._pid != os.getpid():
+            try:
+                self._archive = self.open_archive()
+            except ARCHIVE_ERRORS as e:
+                raise ArchiveError(self._path,e)
+            self._pid     = os.getpid()
+        return self._archive
+
+    def member(self,path):
+        """Get the name in the archive of a path
+
+        :param path: Path below the archive path
+        :return: Member name, or None if not in the archive
+        """
+        prefix = self._path.rstrip(os.sep)+os.sep
+        if not path.startswith(prefix):
+            return None
+        name = posixpath.normpath(path[len(prefix):].replace(os.sep,'/'))
+        return None if name.startswith('..') else name
+
+    def path(self,name):
+        """Get the path of a member name"""
+        return os.path.join(self._path,*name.split('/'))
+
+    def index(self):
+        """Dictionary from member name to archive entry, for files only"""
+        if self._index is None:
+            try:
+                self._index = self.read_index()
+            except ArchiveError:
+                raise
+            except ARCHIVE_ERRORS as e:
+                raise ArchiveError(self._path,e)
+        return self._index
+
+    def names(self):
+        """Paths of all files in the archive, in archive order"""
+        return [self.path(n) for n in self.index()]
+
+    def isfile(self,path):
+        return self.member(path) in self.index()
+
+    def listdir(self,directory):
+        """Names of the files in a directory of the archive"""
+        directory = os.path.normpath(directory)
+        return [posixpath.basename(n) for n in self.index()
+                if os.path.dirname(self.path(n)) == directory]
+
+    def open(self,path):
+        """Open a member for reading text"""
+        name = self.member(path)
+        if name not in self.index():
+            raise IOError(errno.ENOENT,os.strerror(errno.ENOENT),path)
+        # Named after the path, which parse errors then give
+        raw = io.BufferedReader(ForwardReader(self.open_member(name),path))
+        if name.endswith('.gz'):
+            raw = gzip.GzipFile(fileobj=raw)
+        return io.TextIOWrapper(raw,encoding='utf-8')
+
+    def digest(self,path):
+        """Hash of the content of a member, or None if it cannot be read"""
+        h = hashlib.sha256()
+        try:
+            with self.open_member(self.member(path)) as inp:
+                for block in iter(lambda: inp.read(1<<20),b''):
+                    h.update(block)
+        except (IOError,OSError,KeyError):
+            return None
+        return h.hexdigest()
+
+    def stat(self,path):
+        """Modification time (ns) and size of the archive, for a member,
+        or None if not in the archive
+
+        Members only change with the archive, so this tells whether a
+        member may have changed.
+        """
+        if not self.isfile(path):
+            return None
+        st = os.stat(self._path)
+        return st.st_mtime_ns, st.st_size
+
+    def submission(self):
+        """Find the main file of the submission
+
+        :return: Path of the shallowest submission.yaml, or of the only
+                 YAML file (single YAML submission), or None
+        """
+        names = sorted(self.index(),key=lambda n: (n.count('/'),n))
+        for n in names:
+            if posixpath.basename(n) == 'submission.yaml':
+                return self.path(n)
+        yamls = [n for n in names if n.endswith(('.yaml','.yml'))]
+        if len(yamls) == 1:
+            return self.path(yamls[0])
+        return None
+
+# --------------------------------------------------------------------
+class ZipFiles(ArchiveFiles):
+    """Files in a .zip archive, which allows cheap random access"""
+
+    def open_archive(self):
+        return zipfile.ZipFile(self._path)
+
+    def read_index(self):
+        return dict((i.filename,i) for i in self.archive().infolist()
+                    if not i.is_dir())
+
+    def open_member(self,name):
+        return self.archive().open(self.index()[name])
+
+# --------------------------------------------------------------------
+class TarFiles(ArchiveFiles):
+    """Files in a (compressed) tar archive
+
+    Compressed tar archives can only be read efficiently from start to
+    end, so such archives are marked as sequential: rather than opening
+    members one by one, the validator collects the members it needs and
+    reads them in one pass with scan.
+    """
+    sequential = True
+
+    def read_index(self):
+        # Keep submission.yaml files while reading the index, so that
+        # they need not be looked up again
+        ret         = {}
+        self._texts = {}
+        with tarfile.open(self._path,'r|*') as tar:
+            for info in tar:
+                if info.isfile():
+                    name      = posixpath.normpath(info.name)
+                    ret[name] = info
+                    if posixpath.basename(name) == 'submission.yaml':
+                        self._texts[name] = tar.extractfile(info).read()
+        return ret
+
+    def open_archive(self):
+        return tarfile.open(self._path,'r:*')
+
+    def open_member(self,name):
+        info = self.index()[name]
+        if name in self._texts:
+            return io.BytesIO(self._texts[name])
+        tar = self.archive()
+        return tar.extractfile(tar.getmember(info.name))
+
+    def digest(self,path):
+        # Hashing a member would mean another pass over the archive
+        return None
+
+    def scan(self,paths):
+        """Read members in one pass over the archive
+
+        :param paths: Paths of the members wanted
+        :return: Generator of (path, text stream) in archive order.
+                 Each stream must be consumed before the next is taken.
+        """
+        wanted = set(self.member(p) for p in paths)
+        try:
+            with tarfile.open(self._path,'r|*') as tar:
+                for info in tar:
+                    name = posixpath.normpath(info.name)
+                    if not info.isfile() or name not in wanted:
+                        continue
+                    raw = io.BufferedReader(
+                        ForwardReader(tar.extractfile(info),self.path(name)))
+                    if name.endswith('.gz'):
+                        raw = gzip.GzipFile(fileobj=raw)
+                    yield (self.path(name),
+                           io.TextIOWrapper(raw,encoding='utf-8'))
+        except ARCHIVE_ERRORS as e:
+            raise ArchiveError(self._path,e)
+
+# ====================================================================
+class FileIndex:
+    """The files of a submission directory, listed once
+
+    Checks that referenced files exist are answered from the listing,
+    rather than by looking up each file.  The index remembers which
+    files were referenced, to find those that were not.
+    """
+
+    def __init__(self,files,directory):
+        """List a directory
+
+        :param files: Where the directory is (LocalFiles, ZipFiles or
+                      TarFiles)
+        :param directory: The directory
+        """
+        self._files      = files
+        self._dir        = os.path.normpath(directory or os.curdir)
+        self._names      = set(files.listdir(directory))
+        self._lower      = dict((n.lower(),n) for n in self._names)
+        self._referenced = set()
+
+    def name(self,path):
+        """Name of a path in the directory, or None if elsewhere"""
+        directory, name = os.path.split(os.path.normpath(path))
+        return name if os.path.normpath(directory or os.curdir) == self._dir \
+            else None
+
+    def isfile(self,path):
+        """Check if a file exists, and mark it as referenced
+
+        Files outside the directory are looked up directly.
+        """
+        name = self.name(path)
+        if name is None:
+            return self._files.isfile(path)
+        self._referenced.add(name)
+        return name in self._names
+
+    def reference(self,path):
+        """Mark a file as referenced, without checking it"""
+        name = self.name(path)
+        if name is not None:
+            self._referenced.add(name)
+
+    def case_match(self,path):
+        """Find a file whose name differs from that of path only in case
+
+        :return: Path of the file, or None
+        """
+        name = self.name(path)
+        if name is None or name in self._names:
+            return None
+        match = self._lower.get(name.lower())
+        if match is None:
+            return None
+        # Do not report it as unreferenced as well
+        self._referenced.add(match)
+        return os.path.join(os.path.dirname(path),match)
+
+    def unreferenced(self,exclude=()):
+        """Names of the files that were not referenced, in order
+
+        :param exclude: Names not to report, e.g. submission.yaml
+        """
+        return sorted(self._names-self._referenced-set(exclude))
+
+# ====================================================================
+def open_source(path):
+    """Get the files of a submission
+
+    :param path: A submission archive, a directory, or a file
+    :return: Tuple of files (LocalFiles, ZipFiles or TarFiles) and the
+             path of the main submission file (or None if not found)
+    :raises ArchiveError: If an archive cannot be read
+    """
+    if is_archive(path):
+        files = (ZipFiles(path) if path.lower().endswith('.zip') else
+                 TarFiles(path))
+        return files, files.submission()
+
+    if os.path.isdir(path):
+        return LocalFiles(), os.path.join(path,'submission.yaml')
+    return LocalFiles(), path
+
+# ====================================================================
+#
+# EOF
+#
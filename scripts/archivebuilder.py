@@ -0,0 +1,504 @@
+"""
+Building submission archives (.zip, .tar.gz, .tgz) for upload.
+
+Converters collect the YAML files they wrote and the resources they
+refer to, and pack them into one archive:
+
+  with ArchiveBuilder('submission.zip') as archive:
+      archive.add_file('Output/submission.yaml')
+      archive.add_file('Input/figure.png')
+      with archive.open_member('data1.yaml') as out:
+          ...                          # e.g. a TableWriter (tablewriter.py)
+
+Nothing is written until the archive is closed.  Then
+
+- the members are written in order of their names, with fixed times,
+  owners and permissions, so that the same files always give the same
+  bytes, whatever the order they were added in;
+- a file added more than once, or under the same name with the same
+  content, is written once, while different contents under one name
+  are an error.  A content stored under several names is compressed
+  once (in a .zip archive);
+- files are read and compressed in blocks of CHUNK bytes, so that
+  large resources are never held in memory, and the blocks are
+  compressed on a pool of threads.  Each block continues the deflate
+  stream of the one before, as pigz does, so the output does not
+  depend on the number of threads.
+"""
+import collections
+import hashlib
+import io
+import os
+import posixpath
+import struct
+import tarfile
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK  = 1<<20          # Bytes read and compressed at a time
+WINDOW = 1<<15          # Bytes of a block a deflate stream refers back to
+
+ARCHIVE_FORMATS = {'.zip': 'zip', '.tar.gz': 'tar.gz', '.tgz': 'tar.gz'}
+
+# Limit beyond which ZIP64 records are used, as in zipfile
+ZIP64_LIMIT = (1<<31)-1
+
+# ====================================================================
+def deflate(block,window,last,level):
+    """Compress a block of a raw deflate stream
+
+    :param block: Bytes to compress
+    :param window: End of the bytes before the block, which the block
+                   may refer to
+    :param last: Whether the block ends the stream
+    :param level: Compression level
+    :return: Compressed bytes, ending on a byte boundary
+    """
+    if window:
+        comp = zlib.compressobj(level,zlib.DEFLATED,-zlib.MAX_WBITS,
+                                zdict=window)
+    else:
+        comp = zlib.compressobj(level,zlib.DEFLATED,-zlib.MAX_WBITS)
+    return comp.compress(block)+comp.flush(zlib.Z_FINISH if last else
+                                           zlib.Z_SYNC_FLUSH)
+
+def blocks(chunks):
+    """Blocks of a stream with the window before each
+
+    :param chunks: Iterable of bytes
+    :return: Generator of (block, window, last).  A stream with no
+             bytes gives one empty block.
+    """
+    window = b''
+    it     = iter(chunks)
+    block  = next(it,b'')
+    for nxt in it:
+        yield block, window, False
+        window = (window+block)[-WINDOW:]
+        block  = nxt
+    yield block, window, True
+
+def rechunk(pieces):
+    """Join pieces of bytes into chunks of CHUNK bytes (but the last)"""
+    buf = bytearray()
+    for piece in pieces:
+        buf += piece
+        while len(buf) >= CHUNK:
+            yield bytes(buf[:CHUNK])
+            del buf[:CHUNK]
+    if buf:
+        yield bytes(buf)
+
+def lookahead(items,n):
+    """Iterate n items ahead of the consumer, so that the futures made
+    by the producer run while earlier ones are consumed"""
+    window = collections.deque()
+    for item in items:
+        window.append(item)
+        if len(window) > n:
+            yield window.popleft()
+    while window:
+        yield window.popleft()
+
+# ====================================================================
+class Member:
+    """A file to put in the archive"""
+
+    def __init__(self,name,source,size):
+        """Create a member
+
+        :param name: Name in the archive
+        :param source: Path of a file, bytes, or a binary file object
+        :param size: Size in bytes
+        """
+        self.name    = name
+        self.source  = source
+        self.size    = size
+        self.digest  = None
+        self.copy_of = None
+
+    def chunks(self):
+        """The content in chunks of CHUNK bytes"""
+        if isinstance(self.source,bytes):
+            for i in range(0,len(self.source),CHUNK):
+                yield self.source[i:i+CHUNK]
+            return
+
+        size = 0
+        inp  = (open(self.source,'rb') if isinstance(self.source,str) else
+                self.source)
+        try:
+            inp.seek(0)
+            for chunk in iter(lambda: inp.read(CHUNK),b''):
+                size += len(chunk)
+                yield chunk
+        finally:
+            if inp is not self.source:
+                inp.close()
+        if size != self.size:
+            raise ValueError('{} changed while being archived'
+                             .format(self.name))
+
+    def hash(self):
+        """Hash the content"""
+        h = hashlib.sha256()
+        for chunk in self.chunks():
+            h.update(chunk)
+        self.digest = h.hexdigest()
+
+# --------------------------------------------------------------------
+class MemberStream(io.TextIOWrapper):
+    """Text stream to a member of an archive, kept in a temporary file
+    until the stream is closed"""
+
+    def __init__(self,builder,name):
+        super().__init__(tempfile.TemporaryFile('w+b'),encoding='utf-8')
+        self._builder = builder
+        self._name    = name
+
+    def __exit__(self,exc_type,exc,tb):
+        if exc_type is not None:
+            self._builder = None
+        self.close()
+
+    def close(self):
+        if self._name is None:
+            return
+        name, self._name = self._name, None
+        self.flush()
+        spool = self.detach()
+        if self._builder is None:
+            spool.close()
+        else:
+            self._builder.add_spool(name,spool)
+
+# ====================================================================
+class ArchiveBuilder:
+    """Builds a .zip or .tar.gz archive"""
+
+    def __init__(self,path,jobs=None,level=6):
+        """Start an archive
+
+        :param path: Path of the archive, ending in .zip, .tar.gz or .tgz
+        :param jobs: Number of threads compressing, by default the
+                     number of CPUs
+        :param level: Compression level, 1 (fastest) to 9 (smallest)
+        """
+        fmt = [f for s,f in ARCHIVE_FORMATS.items()
+               if path.lower().endswith(s)]
+        if not fmt:
+            raise ValueError('Cannot write an archive named {}, only {}'
+                             .format(path,', '.join(ARCHIVE_FORMATS)))
+        self._path    = path
+        self._format  = fmt[0]
+        self._jobs    = jobs or os.cpu_count() or 1
+        self._level   = level
+        self._members = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc,tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    # ----------------------------------------------------------------
+    def add(self,member):
+        if self._members is None:
+            raise ValueError('Archive is already closed')
+        name = posixpath.normpath(member.name.replace(os.sep,'/'))
+        if name.startswith(('/','../')) or name in ('.','..'):
+            raise ValueError('Cannot add {} outside the archive'
+                             .format(member.name))
+        member.name = name
+        self._members.append(member)
+
+    def add_file(self,path,name=None):
+        """Add a file, read when the archive is written
+
+        :param path: Path of the file
+        :param name: Name in the archive, by default that of the file
+        """
+        self.add(Member(name or os.path.basename(path),path,
+                        os.path.getsize(path)))
+
+    def add_bytes(self,name,data):
+        """Add a member with the given content"""
+        if isinstance(data,str):
+            data = data.encode('utf-8')
+        self.add(Member(name,bytes(data),len(data)))
+
+    def add_spool(self,name,spool):
+        """Add a member with the content of a binary file object, which
+        the archive closes"""
+        spool.seek(0,os.SEEK_END)
+        self.add(Member(name,spool,spool.tell()))
+
+    def open_member(self,name):
+        """Open a member for writing text
+
+        The member is added when the stream is closed, unless a with
+        block on the stream ends with an exception.
+        """
+        if self._members is None:
+            raise ValueError('Archive is already closed')
+        return MemberStream(self,name)
+
+    def names(self):
+        """Names of the members, in the order they are written"""
+        return sorted(set(m.name for m in self._members or []))
+
+    # ----------------------------------------------------------------
+    def plan(self,pool):
+        """Sort the members and find duplicates
+
+        :param pool: Executor to hash members on
+        :return: Members to write, in order
+        """
+        members = sorted(self._members,key=lambda m: m.name)
+
+        # Only contents of the same size can be the same
+        sizes = collections.Counter(m.size for m in members)
+        list(pool.map(Member.hash,[m for m in members if sizes[m.size] > 1]))
+
+        ret     = []
+        names   = {}
+        digests = {}
+        for m in members:
+            other = names.get(m.name)
+            if other is not None:
+                if other.size != m.size or other.digest != m.digest:
+                    raise ValueError('Different files are added as {}'
+                                     .format(m.name))
+                continue
+            names[m.name] = m
+            if m.digest is not None:
+                m.copy_of = digests.setdefault(m.digest,m)
+                if m.copy_of is m:
+                    m.copy_of = None
+            ret.append(m)
+        return ret
+
+    def close(self):
+        """Write the archive"""
+        if self._members is None:
+            raise ValueError('Archive is already closed')
+        try:
+            with ThreadPoolExecutor(self._jobs) as pool:
+                members = self.plan(pool)
+                with open(self._path,'w+b') as out:
+                    if self._format == 'zip':
+                        self.write_zip(out,members,pool)
+                    else:
+                        self.write_tgz(out,members,pool)
+        except BaseException:
+            if os.path.exists(self._path):
+                os.remove(self._path)
+            raise
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Drop the archive without writing it"""
+        for m in self._members or []:
+            if hasattr(m.source,'close'):
+                m.source.close()
+        self._members = None
+
+    def compressed(self,chunks,pool):
+        """Compress a stream on the pool
+
+        :return: Generator of futures of the compressed blocks, in order
+        """
+        for block,window,last in blocks(chunks):
+            yield pool.submit(deflate,block,window,last,self._level)
+
+    # ----------------------------------------------------------------
+    def write_zip(self,out,members,pool):
+        """Write a .zip archive"""
+        def items():
+            for m in members:
+                if m.copy_of is not None:
+                    yield 'copy', m
+                    continue
+                crc = [0]
+                def chunks():
+                    for chunk in m.chunks():
+                        crc[0] = zlib.crc32(chunk,crc[0])
+                        yield chunk
+                yield 'begin', m
+                for future in self.compressed(chunks(),pool):
+                    yield 'data', future
+                yield 'end', crc
+
+        central = []
+        written = {}
+        for kind,item in lookahead(items(),2*self._jobs):
+            if kind == 'begin':
+                m      = item
+                zip64  = m.size*1.05 > ZIP64_LIMIT
+                offset = out.tell()
+                out.write(zip_header(m.name,0,0,m.size,zip64))
+                start  = out.tell()
+            elif kind == 'data':
+                out.write(item.result())
+            elif kind == 'end':
+                crc   = item[0]
+                csize = out.tell()-start
+                out.seek(offset)
+                out.write(zip_header(m.name,crc,csize,m.size,zip64))
+                out.seek(0,os.SEEK_END)
+                written[m.name] = (start,crc,csize)
+                central.append((m,offset,crc,csize,zip64))
+            else:
+                # Same content as a member written before: copy the
+                # compressed data
+                m      = item
+                src, crc, csize = written[m.copy_of.name]
+                zip64  = m.size*1.05 > ZIP64_LIMIT
+                offset = out.tell()
+                out.write(zip_header(m.name,crc,csize,m.size,zip64))
+                for pos in range(src,src+csize,CHUNK):
+                    out.seek(pos)
+                    data = out.read(min(CHUNK,src+csize-pos))
+                    out.seek(0,os.SEEK_END)
+                    out.write(data)
+                central.append((m,offset,crc,csize,zip64))
+
+        start = out.tell()
+        for entry in central:
+            out.write(zip_central(*entry))
+        zip_end(out,len(central),start,out.tell()-start)
+
+    # ----------------------------------------------------------------
+    def write_tgz(self,out,members,pool):
+        """Write a .tar.gz archive"""
+        state = {'crc': 0, 'size': 0}
+
+        def tar():
+            for m in members:
+                info       = tarfile.TarInfo(m.name)
+                info.size  = m.size
+                info.mode  = 0o644
+                info.mtime = 0
+                yield info.tobuf(tarfile.PAX_FORMAT,'utf-8','surrogateescape')
+                for chunk in m.chunks():
+                    yield chunk
+                yield b'\0'*(-m.size % tarfile.BLOCKSIZE)
+            yield b'\0'*(2*tarfile.BLOCKSIZE)
+
+        def chunks():
+            for piece in tar():
+                state['crc']   = zlib.crc32(piece,state['crc'])
+                state['size'] += len(piece)
+                yield piece
+            # Pad to whole records, as tarfile does
+            pad = -state['size'] % tarfile.RECORDSIZE
+            state['crc']   = zlib.crc32(b'\0'*pad,state['crc'])
+            state['size'] += pad
+            yield b'\0'*pad
+
+        # Header as written by gzip with mtime 0 and no file name
+        xfl = {9: 2, 1: 4}.get(self._level,0)
+        out.write(struct.pack('<4BLBB',0x1f,0x8b,8,0,0,xfl,255))
+        for future in lookahead(self.compressed(rechunk(chunks()),pool),
+                                2*self._jobs):
+            out.write(future.result())
+        out.write(struct.pack('<LL',state['crc'],state['size'] & 0xffffffff))
+
+# ====================================================================
+# Records of a .zip archive, with the fields zipfile writes for a
+# file dated 1980-01-01 with permissions 0644
+ZIP_DEFLATED = 8
+ZIP_DATE     = (0 << 9) | (1 << 5) | 1
+ZIP_ATTR     = 0o100644 << 16
+
+def zip_flags(name):
+    """Encoded name and flags of a member: UTF-8 names are marked"""
+    try:
+        return name.encode('ascii'), 0
+    except UnicodeEncodeError:
+        return name.encode('utf-8'), 0x800
+
+def zip_header(name,crc,csize,size,zip64):
+    """Local header of a deflated member"""
+    name, flags = zip_flags(name)
+    if zip64:
+        extra = struct.pack('<HHQQ',1,16,size,csize)
+        csize = size = 0xffffffff
+    else:
+        extra = b''
+    return struct.pack('<4s2B4HL2L2H',b'PK\003\004',45 if zip64 else 20,0,
+                       flags,ZIP_DEFLATED,0,ZIP_DATE,crc,csize,size,
+                       len(name),len(extra))+name+extra
+
+def zip_central(m,offset,crc,csize,zip64):
+    """Central directory entry of a member"""
+    name, flags = zip_flags(m.name)
+    size   = m.size
+    fields = []
+    if size > ZIP64_LIMIT or csize > ZIP64_LIMIT:
+        fields += [size,csize]
+        size = csize = 0xffffffff
+    if offset > ZIP64_LIMIT:
+        fields.append(offset)
+        offset = 0xffffffff
+    extra   = (struct.pack('<HH{}Q'.format(len(fields)),1,8*len(fields),
+                           *fields) if fields else b'')
+    version = 45 if zip64 or fields else 20
+    return struct.pack('<4s4B4HL2L5H2L',b'PK\001\002',version,3,version,0,
+                       flags,ZIP_DEFLATED,0,ZIP_DATE,crc,csize,size,
+                       len(name),len(extra),0,0,0,ZIP_ATTR,offset)+name+extra
+
+def zip_end(out,count,start,size):
+    """Write the end of the central directory"""
+    if count >= 0xffff or start > ZIP64_LIMIT or size > ZIP64_LIMIT:
+        end64 = out.tell()
+        out.write(struct.pack('<4sQ2H2L4Q',b'PK\006\006',44,45,45,0,0,
+                              count,count,size,start))
+        out.write(struct.pack('<4sLQL',b'PK\006\007',0,end64,1))
+        count = min(count,0xffff)
+        start = min(start,0xffffffff)
+        size  = min(size,0xffffffff)
+    out.write(struct.pack('<4s4H2LH',b'PK\005\006',0,0,count,count,size,
+                          start,0))
+
+# ====================================================================
+if __name__ == "__main__":
+    import argparse as ap
+
+    parser = ap.ArgumentParser(description="Build a submission archive")
+    parser.add_argument('archive',
+                        help='Archive to write (.zip, .tar.gz or .tgz)')
+    parser.add_argument('files',
+                        nargs='+',
+                        help='Files to put in the archive, or directories '
+                        'whose files to put in it')
+    parser.add_argument('-j','--jobs',
+                        type=int,
+                        help='Number of threads compressing')
+    parser.add_argument('--level',
+                        type=int,
+                        default=6,
+                        help='Compression level, 1 to 9')
+    args = parser.parse_args()
+
+    try:
+        with ArchiveBuilder(args.archive,args.jobs,args.level) as archive:
+            for path in args.files:
+                if os.path.isdir(path):
+                    for e in os.scandir(path):
+                        if e.is_file():
+                            archive.add_file(e.path)
+                else:
+                    archive.add_file(path)
+    except (ValueError,IOError,OSError) as e:
+        parser.error(str(e))
+
+# ====================================================================
+#
+# EOF
+#
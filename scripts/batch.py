@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+"""
+Validate many submissions in one go.
+
+  ./batch.py -s SCHEMADIR [-j JOBS] [-m MANIFEST] [-o REPORT] [INPUT ...]
+
+Each input is a submission directory, submission.yaml file or archive
+(.zip, .tar, .tar.gz, .tgz).  Inputs may also be listed in manifest
+files, one per line; blank lines and lines starting with # are
+ignored, and relative paths are relative to the manifest.
+
+The schemas are loaded once per process, and the submissions are
+validated by a pool of JOBS processes.  One JSON record per
+submission is written to REPORT (default: standard output), in the
+order of the inputs:
+
+  {"input": ..., "submission": ..., "valid": ..., "errors": ...,
+   "warnings": ..., "seconds": ..., "messages": {file: [[level, message],
+   ...]}}
+
+where level is "Error", "Warning" or "Info".  The exit status is 1 if
+any submission is invalid.
+"""
+import os
+import sys
+import json
+import time
+
+from validate import Validator, Message, validator_arguments, \
+    validator_options
+from archive import LocalFiles, ArchiveError, open_source
+
+# ====================================================================
+def read_manifest(filename):
+    """Read the inputs listed in a manifest file
+
+    :param filename: Path to the manifest
+    :return: List of paths
+    """
+    top = os.path.dirname(filename)
+    ret = []
+    with open(filename,'r') as inp:
+        for line in inp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            ret.append(os.path.join(top,os.path.expanduser(line)))
+    return ret
+
+# --------------------------------------------------------------------
+def validate_input(v,path,least=Message.INFO):
+    """Validate one submission
+
+    :param v: Validator to use, with the schemas already loaded
+    :param path: Submission directory, file or archive
+    :param least: Least level of messages to report
+    :return: Report record of the submission
+    """
+    start = time.perf_counter()
+    try:
+        files, filename = open_source(path)
+    except ArchiveError as e:
+        files, filename, broken = LocalFiles(), None, e
+    else:
+        broken = None
+    v.reset(files)
+    if broken is not None:
+        v.add_error(path,str(broken))
+    elif filename is None:
+        v.add_error(path,'No submission.yaml found in {}'.format(path))
+    else:
+        v.validate(file_path=filename,data=None)
+
+    messages = dict((f,[[Message.levelStr(m._level),m._message]
+                        for m in msgs if m._level >= least])
+                    for f,msgs in v.get_messages().items())
+    return {'input':      path,
+            'submission': filename,
+            'valid':      not v.has_errors(),
+            'errors':     v.count_messages(None,Message.ERROR),
+            'warnings':   v.count_messages(None,Message.WARNING),
+            'seconds':    time.perf_counter()-start,
+            'messages':   dict((f,m) for f,m in messages.items() if m)}
+
+def safe_validate_input(v,path,least=Message.INFO):
+    """Validate one submission, turning a failure into an error of the
+    submission so that the other inputs are still validated
+
+    :return: Report record of the submission
+    """
+    start = time.perf_counter()
+    try:
+        return validate_input(v,path,least)
+    except Exception as e:
+        return failure_record(path,'Validation failed: {}: {}'
+                              .format(type(e).__name__,e),
+                              time.perf_counter()-start)
+
+def failure_record(path,message,seconds=0.0):
+    """Report record of a submission that could not be validated
+
+    :param path: Submission directory, file or archive
+    :param message: Why it could not be validated
+    :param seconds: Time spent on it
+    """
+    return {'input':      path,
+            'submission': None,
+            'valid':      False,
+            'errors':     1,
+            'warnings':   0,
+            'seconds':    seconds,
+            'messages':   {path: [[Message.levelStr(Message.ERROR),message]]}}
+
+# --------------------------------------------------------------------
+def validate_all(inputs,jobs=1,least=Message.INFO,**options):
+    """Validate many submissions
+
+    :param inputs: Paths of submissions
+    :param jobs: Number of processes
+    :param least: Least level of messages to report
+    :param options: Arguments of Validator
+    :return: Generator of report records, in the order of the inputs
+    """
+    if jobs <= 1 or len(inputs) <= 1:
+        v = Validator(**options)
+        for path in inputs:
+            yield safe_validate_input(v,path,least)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_worker,
+                             initargs=(options,least)) as pool:
+        for rec in pool.map(_validate_worker,inputs):
+            yield rec
+
+# ====================================================================
+# Validator of each worker process, created once and reused for all
+# the submissions the process is given
+_worker = None
+_least  = Message.INFO
+
+def _init_worker(options,least):
+    global _worker, _least
+    _worker = Validator(**options)
+    _least  = least
+
+def _validate_worker(path):
+    return safe_validate_input(_worker,path,_least)
+
+# ====================================================================
+if __name__ == "__main__":
+    import argparse as ap
+
+    parser = ap.ArgumentParser(description="Validates many HepData "
+                               "submissions")
+    parser.add_argument('inputs',
+                        nargs='*',
+                        help='Submission directories, files or archives')
+    parser.add_argument('-m',
+                        '--manifest',
+                        action='append',
+                        default=[],
+                        help='File listing inputs, one per line (may be '
+                        'repeated)')
+    parser.add_argument('-o',
+                        '--output',
+                        help='Write the report to this file (default: '
+                        'standard output)')
+    parser.add_argument('-l',
+                        '--level',
+                        default='WARNING',
+                        choices=['INFO','WARNING','ERROR'],
+                        help='Least level of messages in the report')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Number of processes (default: number of CPUs)')
+    validator_arguments(parser)
+    args = parser.parse_args()
+
+    inputs = list(args.inputs)
+    for manifest in args.manifest:
+        inputs.extend(read_manifest(manifest))
+    if not inputs:
+        parser.error('No submissions given')
+
+    out     = open(args.output,'w') if args.output else sys.stdout
+    invalid = 0
+    try:
+        for rec in validate_all(inputs,args.jobs,getattr(Message,args.level),
+                                **validator_options(args)):
+            invalid += not rec['valid']
+            out.write(json.dumps(rec)+'\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print('Validated {} submissions, {} invalid'
+          .format(len(inputs),invalid),file=sys.stderr)
+    sys.exit(1 if invalid else 0)
+
+# ====================================================================
+#
+# EOF
+#
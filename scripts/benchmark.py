@@ -0,0 +1,828 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks of the validation scripts.
+
+  ./benchmark.py [schema] -s SCHEMADIR [-t TABLES] [-r ROWS]
+
+Compares building a new validator and checking the schema for every
+document, as jsonschema.validate does, to the validators precompiled
+once by the Validator class, on a synthetic submission with many
+tables.
+
+  ./benchmark.py backends [-x SCALE] [SUBMISSION ...]
+
+Compares the YAML parser backends (see yamlbackend.py) on the data
+files of the given submissions (default: those in examples/), with
+the values of each table repeated SCALE times.
+
+  ./benchmark.py scaling -s SCHEMADIR [-t TABLES] [-r ROWS] [-d DEPENDENT]
+                 [-e ERRORS] [-c SIZE] [-o RESULTS] [--compare BASELINE]
+
+Times the phases of validating synthetic submissions (parsing the
+YAML, checking the schemas, and the semantic checks of data tables)
+and records the peak memory of each.  Each of the sizes may be a comma
+separated list, e.g. -r 10,100,1000, and every combination is run.
+The results are appended to RESULTS as JSON lines, so that runs on
+different commits can be compared: with --compare, phases slower than
+in the matching records of BASELINE are reported, and the exit status
+is 1 if any are.
+
+  ./benchmark.py emitter [-r ROWS] [-d DEPENDENT] [-e ERRORS] [-n REPEAT]
+
+Compares writing synthetic data tables with yaml.dump (fastest safe
+dumper) and with the data table emitter (see emitter.py), and checks
+that both read back as the same table.  It also checks that tables of
+random strings, and every document of the YAML files in examples/,
+read back as the same document (with the keys in the same order) when
+written with the emitter; the exit status is 1 if any does not.
+
+  ./benchmark.py stream -s SCHEMADIR [-r ROWS]
+
+Times validating a synthetic data file of ROWS rows when reading it
+whole and from the YAML event stream (--stream of validate.py), and
+checks that both give the same messages, also for synthetic tables
+with schema errors and with semantic problems, and for every YAML file
+in examples/, each given directly.  The exit status is 1 if any file
+gives different messages, or is not streamed.
+
+  ./benchmark.py startup [-n REPEAT] [--budget SECONDS]
+
+Times starting validate.py (printing its help, so that nothing is
+validated) and importing its module, each in a new interpreter, and
+lists the slowest imports.  The exit status is 1 if the fastest start
+takes longer than SECONDS, or if importing validate.py imports any of
+the modules only needed to validate (see LAZY_MODULES).
+"""
+import os
+import sys
+import json
+import tempfile
+import time
+import tracemalloc
+import glob
+import itertools
+import platform
+import subprocess
+import yaml
+
+# ====================================================================
+def make_table(rows,scale=1.0,dependent=1,errors=2):
+    """Make a data table document
+
+    :param rows: Number of rows (bins) in the table
+    :param scale: Scale of the values, to make tables differ
+    :param dependent: Number of dependent variables
+    :param errors: Number of errors (labels) of each value, alternately
+                   symmetric and asymmetric
+    :return: Data table document
+    """
+    def errs(i):
+        ret = []
+        for e in range(errors):
+            label = ('stat' if e == 0 else 'sys' if e == 1 else
+                     'sys,{}'.format(e))
+            if e % 2 == 0:
+                ret.append({'symerror': 0.1*(e+1), 'label': label})
+            else:
+                ret.append({'asymerror': {'plus': 0.2*e, 'minus': -0.1*e},
+                            'label': label})
+        return ret
+
+    return {
+        'independent_variables': [
+            {'header': {'name': 'PT', 'units': 'GeV'},
+             'values': [{'low': float(i), 'high': float(i+1)}
+                        for i in range(rows)]}],
+        'dependent_variables': [
+            {'header': {'name': 'SIG' if d == 0 else 'SIG{}'.format(d+1),
+                        'units': 'pb'},
+             'qualifiers': [{'name': 'SQRT(S)', 'units': 'GeV',
+                             'value': 13000}],
+             'values': [{'value': scale*(d+1)/(i+1), 'errors': errs(i)}
+                        for i in range(rows)]}
+            for d in range(dependent)]}
+
+# --------------------------------------------------------------------
+def make_correlation(size):
+    """Make a correlation matrix table, stored as one row per element
+
+    :param size: Number of bins along each axis
+    :return: Data table document
+    """
+    bins = [(i,j) for i in range(size) for j in range(size)]
+    return {
+        'independent_variables': [
+            {'header': {'name': axis, 'units': 'GeV'},
+             'values': [{'low': float(b[k]), 'high': float(b[k]+1)}
+                        for b in bins]}
+            for k,axis in enumerate(['PT','PT'])],
+        'dependent_variables': [
+            {'header': {'name': 'Correlation'},
+             'qualifiers': [],
+             'values': [{'value': 0.5**abs(i-j)} for i,j in bins]}]}
+
+# --------------------------------------------------------------------
+def make_submission(directory,tables=100,rows=20,dependent=1,errors=2,
+                    correlation=0):
+    """Write a synthetic submission to a directory
+
+    :param directory: Output directory
+    :param tables: Number of tables
+    :param rows: Number of rows per table
+    :param dependent: Number of dependent variables per table
+    :param errors: Number of errors of each value
+    :param correlation: Size of an additional correlation matrix table,
+                        or 0 for none
+    :return: Path to the submission.yaml file
+    """
+    docs   = [{'comment': 'Synthetic submission for benchmarking',
+               'additional_resources': []}]
+    tables = [make_table(rows,t+1.0,dependent,errors)
+              for t in range(tables)]
+    if correlation:
+        tables.append(make_correlation(correlation))
+
+    for t,table in enumerate(tables):
+        data_file = 'data{}.yaml'.format(t+1)
+        with open(os.path.join(directory,data_file),'w') as out:
+            yaml.dump(table,out,Dumper=yaml.SafeDumper)
+
+        docs.append({'name': 'Table {}'.format(t+1),
+                     'description': 'Synthetic table {}'.format(t+1),
+                     'keywords': [{'name': 'observables',
+                                   'values': ['SIG']}],
+                     'data_file': data_file})
+
+    submission = os.path.join(directory,'submission.yaml')
+    with open(submission,'w') as out:
+        yaml.dump_all(docs,out,Dumper=yaml.SafeDumper)
+    return submission
+
+# --------------------------------------------------------------------
+def load_documents(submission):
+    """Read all documents of a submission, sorted by schema
+
+    :param submission: Path to submission.yaml
+    :return: Lists of submission, data, and additional documents
+    """
+    subs, dats, adds = [], [], []
+    directory = os.path.dirname(submission)
+    with open(submission,'r') as inp:
+        for doc in yaml.load_all(inp,Loader=yaml.SafeLoader):
+            if doc is None:
+                continue
+            if 'data_file' in doc:
+                subs.append(doc)
+                with open(os.path.join(directory,doc['data_file'])) as dat:
+                    dats.append(yaml.load(dat,Loader=yaml.SafeLoader))
+            else:
+                adds.append(doc)
+    return subs, dats, adds
+
+# --------------------------------------------------------------------
+def timed(func):
+    """Time a call to func
+
+    :return: Elapsed wall time in seconds
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+# --------------------------------------------------------------------
+def bench_schema(validator,submission):
+    """Compare per-document and precompiled schema validation
+
+    :param validator: A validate.Validator instance
+    :param submission: Path to submission.yaml
+    :return: Dictionary of timings in seconds
+    """
+    from validate import compile_schema
+
+    subs, dats, adds = load_documents(submission)
+    pairs = ([(d,validator._sub_schema,validator._sub_validator)
+              for d in subs] +
+             [(d,validator._dat_schema,validator._dat_validator)
+              for d in dats] +
+             [(d,validator._add_schema,validator._add_validator)
+              for d in adds])
+
+    # What jsonschema.validate does: check the schema and build a new
+    # validator for every document
+    def per_document():
+        for doc,schema,compiled in pairs:
+            compile_schema(schema,validator._store).validate(doc)
+
+    def precompiled():
+        for doc,schema,compiled in pairs:
+            compiled.validate(doc)
+
+    return {'documents':    len(pairs),
+            'per_document': timed(per_document),
+            'precompiled':  timed(precompiled)}
+
+# --------------------------------------------------------------------
+def scale_table(doc,factor):
+    """Make a data table larger by repeating its values
+
+    :param doc: Data table document
+    :param factor: Number of times to repeat the values
+    :return: The scaled document
+    """
+    for kind in ('independent_variables','dependent_variables'):
+        for var in doc.get(kind,[]):
+            var['values'] = var.get('values',[]) * factor
+    return doc
+
+# --------------------------------------------------------------------
+def example_submissions():
+    """Find the unpacked submissions in examples/"""
+    top = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..','examples')
+    return sorted(glob.glob(os.path.join(top,'**','submission.yaml'),
+                            recursive=True))
+
+# --------------------------------------------------------------------
+def bench_backends(submissions,factor=100,backends=None):
+    """Time parsing the scaled data files of submissions
+
+    :param submissions: Paths to submission.yaml files
+    :param factor: Number of times to repeat the values of each table
+    :param backends: Names of backends, or None for all available
+    :return: Dictionary from backend name to timing in seconds, and
+             the number of bytes parsed
+    """
+    from yamlbackend import get_backend, available_backends, safe_dumper
+
+    texts = []
+    for submission in submissions:
+        subs, dats, adds = load_documents(submission)
+        for dat in dats:
+            texts.append(yaml.dump(scale_table(dat,factor),
+                                   Dumper=safe_dumper()))
+
+    def parse(backend):
+        for text in texts:
+            list(backend.load_all(text))
+
+    res = {}
+    for name in backends or available_backends():
+        res[name] = timed(lambda: parse(get_backend(name)))
+    return res, sum(len(t) for t in texts)
+
+# --------------------------------------------------------------------
+def measured(func):
+    """Time a call to func, and trace its memory in a second call
+
+    Tracing memory slows Python down, so the time is taken from a call
+    without tracing.
+
+    :return: Elapsed wall time in seconds, and peak of memory
+             allocated during the call in bytes
+    """
+    seconds = timed(func)
+    tracemalloc.start()
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+# --------------------------------------------------------------------
+def bench_phases(validator,submission,repeat=1):
+    """Time the phases of validating a submission
+
+    :param validator: A validate.Validator instance
+    :param submission: Path to submission.yaml
+    :param repeat: Number of times to time each phase, the fastest
+                   time is kept
+    :return: Dictionary from phase to dictionary of seconds and
+             peak_bytes, None for phases that cannot be run
+    """
+    directory = os.path.dirname(submission)
+    backend   = validator._backend
+    docs      = {}
+
+    def parse():
+        with open(submission,'r') as inp:
+            subs = [d for d in backend.load_all(inp) if d is not None]
+        docs['sub'] = subs
+        docs['dat'] = []
+        for doc in subs:
+            if 'data_file' in doc:
+                with open(os.path.join(directory,doc['data_file'])) as inp:
+                    docs['dat'].append(backend.load(inp))
+
+    def schema():
+        for doc in docs['sub']:
+            if 'data_file' in doc:
+                validator._sub_validator.validate(doc)
+            else:
+                validator._add_validator.validate(doc)
+        for doc in docs['dat']:
+            validator._dat_validator.validate(doc)
+
+    def semantic():
+        for doc in docs['dat']:
+            checks(doc)
+
+    # The validators and the semantic checks are loaded on first use,
+    # which is not to be timed
+    compiled = (validator._sub_validator,validator._dat_validator,
+                validator._add_validator)
+    checks   = validator.load_semantic() if validator._semantic else None
+    phases = [('parse',parse),('schema',schema),
+              ('semantic',semantic if validator._semantic else None)]
+
+    res = {}
+    for name,func in phases:
+        if func is None:
+            # The semantic checks need NumPy
+            res[name] = None
+            continue
+        runs = [measured(func) for r in range(repeat)]
+        res[name] = {'seconds':    min(t for t,m in runs),
+                     'peak_bytes': max(m for t,m in runs)}
+    return res
+
+# --------------------------------------------------------------------
+def git_commit():
+    """The commit of the working tree, or None if not known"""
+    try:
+        out = subprocess.run(['git','rev-parse','--short','HEAD'],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True,text=True,check=True)
+    except (OSError,subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+# --------------------------------------------------------------------
+def bench_emitter(rows,dependent=1,errors=2,repeat=3):
+    """Compare yaml.dump and the data table emitter
+
+    :param rows: Number of rows of the table
+    :param dependent: Number of dependent variables
+    :param errors: Number of errors of each value
+    :param repeat: Number of runs, the fastest is kept
+    :return: Dictionary of seconds of each, the size of the output, and
+             whether the outputs read back the same
+    """
+    from yamlbackend import get_backend, safe_dumper
+    from emitter import dump_table
+
+    table  = make_table(rows,1.0,dependent,errors)
+    dumper = safe_dumper()
+    res    = {}
+    for name,func in (('yaml.dump',lambda: yaml.dump(table,Dumper=dumper)),
+                      ('emitter',lambda: dump_table(table))):
+        res[name] = min(timed(func) for r in range(repeat))
+
+    backend      = get_backend()
+    text         = dump_table(table)
+    res['bytes'] = len(text)
+    res['same']  = (backend.load(text) == table and
+                    backend.load(yaml.dump(table,Dumper=dumper)) == table and
+                    dump_table(table) == text)
+    return res
+
+# Pieces of the random strings of check_emitter: characters and words
+# that YAML treats specially somewhere
+STRING_PIECES = (list('aZ09 _.$\\()/+^<>=|~%*-:#?&!\'"{}[],@`\n\t\r') +
+                 ['\u00e9','\x85','\u2028','\ufeff','yes','No','null','~',
+                  '1e5','0x1f','.inf','1_000','12:30','2001-01-01','<<',
+                  '- ','? ',': ',' #'])
+
+def check_emitter(count=10000,seed=1):
+    """Check that documents written with the data table emitter read
+    back the same, with the keys in the same order
+
+    :param count: Number of tables of random strings to check
+    :param seed: Seed of the random strings
+    :return: List of the documents that do not, each described by a
+             string
+    """
+    import random
+    from emitter import dump_table
+
+    loader = getattr(yaml,'CSafeLoader',yaml.SafeLoader)
+    def same(doc):
+        # Also in the order of the keys
+        try:
+            back = yaml.load(dump_table(doc),Loader=loader)
+        except yaml.YAMLError:
+            return False
+        return back == doc and \
+            json.dumps(back,default=repr) == json.dumps(doc,default=repr)
+
+    failed = []
+    rnd    = random.Random(seed)
+    for i in range(count):
+        s   = ''.join(rnd.choice(STRING_PIECES)
+                      for j in range(rnd.randint(0,6)))
+        doc = {s: s,
+               'independent_variables':
+               [{'values': [{'low': s, 'high': s}],
+                 'header': {'name': s}}],
+               'dependent_variables':
+               [{'header': {'name': s},
+                 'qualifiers': [{'name': s, 'value': s}],
+                 'values': [{'value': s, 'errors': [{'symerror': s,
+                                                     'label': s}]}]}]}
+        if not same(doc):
+            failed.append('string {!r}'.format(s))
+
+    top = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..','examples')
+    for filename in sorted(glob.glob(os.path.join(top,'**','*.yaml'),
+                                     recursive=True)):
+        with open(filename,'r') as inp:
+            docs = list(yaml.load_all(inp,Loader=loader))
+        for k,doc in enumerate(docs):
+            if isinstance(doc,dict) and not same(doc):
+                failed.append('document {} of {}'
+                              .format(k,os.path.relpath(filename,top)))
+    return failed
+
+# ====================================================================
+def stream_tables(rows):
+    """Make synthetic data tables that validate.py should report the
+    same whether it streams them or not
+
+    :param rows: Number of rows of the tables
+    :return: Dictionary from name to data table document
+    """
+    good = make_table(rows,dependent=2,errors=3)
+
+    # Bins out of order, and errors that are negative or infinite
+    odd = make_table(rows,errors=3)
+    odd['independent_variables'][0]['values'][rows//2]['high'] = -1.0
+    for i,v in enumerate(odd['dependent_variables'][0]['values']):
+        if i % 3 == 0:
+            v['errors'][0]['symerror'] = -0.1
+        if i % 5 == 0:
+            v['errors'][1]['asymerror']['plus'] = float('inf')
+
+    # More schema errors than are reported
+    bad = make_table(rows)
+    for v in bad['dependent_variables'][0]['values'][::max(rows//50,1)]:
+        v['value'] = [v['value']]
+    return {'good': good,'semantic': odd,'schema': bad}
+
+def check_stream(schemadir,rows=1000):
+    """Check that validating data files from the YAML event stream gives
+    the same messages as reading them whole
+
+    :param schemadir: Location of schema files
+    :param rows: Number of rows of the synthetic tables
+    :return: Tuple of the list of files that do not, or that are not
+             streamed, and a dictionary of the seconds to validate the
+             first synthetic table either way
+    """
+    from validate import Validator
+
+    class Phases:
+        def __init__(self):
+            self.phases = set()
+        def span(self,phase,name,start,duration,pid):
+            self.phases.add(phase)
+
+    def validate(filename,stream):
+        v = Validator(schemadir,stream=stream)
+        o = Phases()
+        v.add_observer(o)
+        start = time.perf_counter()
+        ok    = v.validate(file_path=filename)
+        return (time.perf_counter()-start,
+                (ok,[(f,[(m._level,m._message) for m in msgs])
+                     for f,msgs in v.get_messages().items()]),
+                'stream' in o.phases)
+
+    top = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..','examples')
+    failed = []
+    times  = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        filenames = []
+        for name,table in stream_tables(rows).items():
+            filenames.append(os.path.join(tmp,name+'.yaml'))
+            with open(filenames[-1],'w') as out:
+                yaml.dump(table,out,Dumper=getattr(yaml,'CSafeDumper',
+                                                   yaml.SafeDumper))
+        filenames += sorted(glob.glob(os.path.join(top,'**','*.yaml'),
+                                      recursive=True))
+
+        for filename in filenames:
+            t, whole, x = validate(filename,False)
+            s, streamed, used = validate(filename,True)
+            if not times:
+                times = {'whole': t,'stream': s}
+            if whole != streamed:
+                failed.append('{} gives different messages'
+                              .format(filename))
+            elif not used and os.path.basename(filename) != \
+                 'submission.yaml':
+                failed.append('{} is not streamed'.format(filename))
+    return failed, times
+
+# ====================================================================
+# Modules that validate.py imports only when it validates something
+LAZY_MODULES = ['jsonschema','numpy','hepdata_validator','pprint']
+
+def bench_startup(repeat=5):
+    """Time the start of validate.py in new interpreters
+
+    :param repeat: Number of runs, the fastest is kept
+    :return: Dictionary of the seconds to print the help and to import
+             the module, the lazy modules imported anyway, and the
+             slowest imports as (microseconds, module)
+    """
+    here   = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here,'validate.py')
+    check  = ('import sys; sys.path.insert(0,{!r}); import validate; '
+              'print(" ".join(m for m in {!r} if m in sys.modules))'
+              .format(here,LAZY_MODULES))
+
+    def run(args):
+        start = time.perf_counter()
+        out   = subprocess.run([sys.executable]+args,capture_output=True,
+                               text=True,check=True)
+        return time.perf_counter()-start, out
+
+    res = {'help':   min(run([script,'-h'])[0] for r in range(repeat)),
+           'import': min(run(['-c',check])[0] for r in range(repeat))}
+
+    # Cumulative microseconds of the imports, and of those of the
+    # modules imported directly
+    t, out  = run(['-X','importtime','-c',check])
+    imports = []
+    for line in out.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name  = fields[2].rstrip()
+        depth = (len(name)-len(name.lstrip()))//2
+        if depth <= 1:
+            imports.append((int(fields[1]),name.strip()))
+    res['eager']   = out.stdout.split()
+    res['imports'] = sorted(imports,reverse=True)[:10]
+    return res
+
+# --------------------------------------------------------------------
+def bench_scaling(schemadir,params,repeat=1,backend=None):
+    """Time the phases of validating synthetic submissions
+
+    :param schemadir: Location of schema files
+    :param params: List of dictionaries of make_submission arguments
+    :param repeat: Number of times to time each phase
+    :param backend: Name of the YAML parser backend
+    :return: Generator of result records, one per parameter set
+    """
+    from validate import Validator
+
+    validator = Validator(schemadir,backend=backend)
+    common    = {'commit':  git_commit(),
+                 'python':  platform.python_version(),
+                 'backend': validator._backend.name,
+                 'time':    time.strftime('%Y-%m-%dT%H:%M:%S')}
+    for p in params:
+        with tempfile.TemporaryDirectory() as tmp:
+            submission = make_submission(tmp,**p)
+            size       = sum(os.path.getsize(f) for f in
+                             glob.glob(os.path.join(tmp,'*.yaml')))
+            phases     = bench_phases(validator,submission,repeat)
+
+        rec = dict(common)
+        rec.update(params=p,bytes=size,phases=phases)
+        yield rec
+
+# --------------------------------------------------------------------
+def compare(records,baseline,tolerance=0.2):
+    """Find phases that got slower than in a baseline
+
+    Records are matched on their parameters and backend; the latest
+    baseline record of each is used.
+
+    :param records: Result records, as from bench_scaling
+    :param baseline: Baseline result records
+    :param tolerance: Allowed relative increase of time
+    :return: List of (params, phase, baseline seconds, seconds)
+    """
+    def match(r):
+        return json.dumps([r['params'],r['backend']],sort_keys=True)
+
+    base = dict((match(r),r) for r in baseline)
+    ret  = []
+    for r in records:
+        b = base.get(match(r))
+        if b is None:
+            continue
+        for phase,res in r['phases'].items():
+            old = b['phases'].get(phase)
+            if res is None or old is None:
+                continue
+            if res['seconds'] > old['seconds']*(1+tolerance):
+                ret.append((r['params'],phase,old['seconds'],res['seconds']))
+    return ret
+
+# --------------------------------------------------------------------
+def read_results(filename):
+    """Read result records written as JSON lines"""
+    with open(filename,'r') as inp:
+        return [json.loads(l) for l in inp if l.strip()]
+
+# ====================================================================
+if __name__ == "__main__":
+    import argparse as ap
+
+    def sizes(val):
+        try:
+            return [int(v) for v in val.split(',')]
+        except ValueError:
+            raise ap.ArgumentTypeError('{} is not a comma separated list '
+                                       'of numbers'.format(val))
+
+    parser = ap.ArgumentParser(description="Benchmark HepData validation")
+    parser.add_argument('what',
+                        nargs='?',
+                        default='schema',
+                        choices=['schema','backends','scaling','emitter',
+                                 'stream','startup'],
+                        help='What to benchmark')
+    parser.add_argument('submissions',
+                        nargs='*',
+                        help='Submissions to parse (backends only)')
+    parser.add_argument('-s',
+                        '--schema',
+                        help='Location of schema files')
+    parser.add_argument('-t',
+                        '--tables',
+                        type=sizes,
+                        help='Number of tables (default: 300, or 10 for '
+                        'scaling)')
+    parser.add_argument('-r',
+                        '--rows',
+                        type=sizes,
+                        help='Number of rows per table (default: 20, or '
+                        '10,100,1000 for scaling, or 2000 for stream)')
+    parser.add_argument('-d',
+                        '--dependent',
+                        type=sizes,
+                        default=[1],
+                        help='Number of dependent variables per table '
+                        '(scaling only)')
+    parser.add_argument('-e',
+                        '--errors',
+                        type=sizes,
+                        default=[2],
+                        help='Number of error labels per value (scaling '
+                        'only)')
+    parser.add_argument('-c',
+                        '--correlation',
+                        type=sizes,
+                        default=[0],
+                        help='Size of an additional correlation matrix '
+                        'table (scaling only)')
+    parser.add_argument('-n',
+                        '--repeat',
+                        type=int,
+                        default=3,
+                        help='Times to run each phase, the fastest is kept '
+                        '(scaling and startup only)')
+    parser.add_argument('-o',
+                        '--output',
+                        help='Append results to this file as JSON lines '
+                        '(scaling only)')
+    parser.add_argument('--compare',
+                        metavar='BASELINE',
+                        help='Report phases slower than in these results '
+                        '(scaling only)')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.2,
+                        help='Allowed relative slowdown with --compare')
+    parser.add_argument('--budget',
+                        type=float,
+                        default=0.25,
+                        help='Longest allowed start of validate.py in seconds '
+                        '(startup only)')
+    parser.add_argument('-x',
+                        '--scale',
+                        type=int,
+                        default=100,
+                        help='Times to repeat the values of each table '
+                        '(backends only)')
+    parser.add_argument('-y',
+                        '--yaml-backend',
+                        dest='backends',
+                        action='append',
+                        help='Backend to compare (backends only, may be '
+                        'repeated, default: all)')
+    args = parser.parse_args()
+
+    sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+    if args.what == 'backends':
+        res, size = bench_backends(args.submissions or example_submissions(),
+                                   args.scale,args.backends)
+        print('Parsed {:.1f} MB of data files'.format(size/1e6))
+        fastest = min(res.values())
+        for name,t in res.items():
+            print('  {:20s} {:8.3f}s {:8.1f}x'.format(name+':',t,t/fastest))
+        sys.exit(0)
+
+    if args.what == 'emitter':
+        for r in args.rows or [100,10000]:
+            res = bench_emitter(r,args.dependent[0],args.errors[0],
+                                args.repeat)
+            print('Wrote {} rows, {:.1f} MB{}'
+                  .format(r,res['bytes']/1e6,'' if res['same'] else
+                          ', OUTPUT DIFFERS'))
+            for name in ('yaml.dump','emitter'):
+                print('  {:20s} {:8.3f}s {:8.1f}x'
+                      .format(name+':',res[name],
+                              res['yaml.dump']/res[name]))
+        failed = check_emitter()
+        for f in failed:
+            print('Does not read back the same: {}'.format(f))
+        print('Checked reading back written documents: {} failed'
+              .format(len(failed)))
+        sys.exit(1 if failed else 0)
+
+    if args.what == 'stream':
+        rows = (args.rows or [2000])[0]
+        failed, times = check_stream(args.schema,rows)
+        print('Validated {} rows in {:.3f}s, streamed in {:.3f}s'
+              .format(rows,times['whole'],times['stream']))
+        for f in failed:
+            print(f)
+        print('Checked streaming files: {} failed'.format(len(failed)))
+        sys.exit(1 if failed else 0)
+
+    if args.what == 'startup':
+        res = bench_startup(args.repeat)
+        print('Started validate.py in {:.3f}s, imported it in {:.3f}s'
+              .format(res['help'],res['import']))
+        print('Slowest imports:')
+        for us,name in res['imports']:
+            print('  {:30s} {:8.3f}s'.format(name+':',us/1e6))
+        failed = False
+        if res['eager']:
+            print('Imported without need: {}'.format(', '.join(res['eager'])))
+            failed = True
+        if res['help'] > args.budget:
+            print('Start takes longer than {:.3f}s'.format(args.budget))
+            failed = True
+        sys.exit(1 if failed else 0)
+
+    if args.what == 'scaling':
+        params = [dict(tables=t,rows=r,dependent=d,errors=e,correlation=c)
+                  for t,r,d,e,c in itertools.product(args.tables or [10],
+                                                     args.rows or [10,100,1000],
+                                                     args.dependent,
+                                                     args.errors,
+                                                     args.correlation)]
+        backend = args.backends[0] if args.backends else None
+        records = []
+        for rec in bench_scaling(args.schema,params,args.repeat,backend):
+            records.append(rec)
+            print(' '.join('{}={}'.format(k,v)
+                           for k,v in rec['params'].items()))
+            for phase,res in rec['phases'].items():
+                if res is not None:
+                    print('  {:20s} {:8.3f}s {:8.1f} MB'
+                          .format(phase+':',res['seconds'],
+                                  res['peak_bytes']/1e6))
+            if args.output:
+                with open(args.output,'a') as out:
+                    out.write(json.dumps(rec,sort_keys=True)+'\n')
+
+        if args.compare:
+            slower = compare(records,read_results(args.compare),
+                             args.tolerance)
+            for p,phase,old,new in slower:
+                print('Slower: {} {} {:.3f}s -> {:.3f}s'
+                      .format(' '.join('{}={}'.format(k,v)
+                                       for k,v in p.items()),
+                              phase,old,new))
+            sys.exit(1 if slower else 0)
+        sys.exit(0)
+
+    from validate import Validator
+
+    with tempfile.TemporaryDirectory() as tmp:
+        submission = make_submission(tmp,(args.tables or [300])[0],
+                                     (args.rows or [20])[0])
+        res = bench_schema(Validator(args.schema),submission)
+
+    print('Validated {} documents'.format(res['documents']))
+    print('  per document:        {:8.3f}s'.format(res['per_document']))
+    print('  precompiled:         {:8.3f}s'.format(res['precompiled']))
+    print('  speedup:             {:8.1f}x'
+          .format(res['per_document']/res['precompiled']))
+
+# ====================================================================
+#
+# EOF
+#
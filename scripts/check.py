@@ -11,17 +11,43 @@ Or specify the directory as an additional argument:
   ./check.py directory
 Or specify a single YAML file to validate:
   ./check.py single_yaml_file
+Or specify a submission archive (.zip, .tar, .tar.gz, .tgz), which is read
+without extracting it:
+  ./check.py archive
+Data files are checked by HEPDATA_CHECK_JOBS processes (default 1), e.g.
+  HEPDATA_CHECK_JOBS=4 ./check.py directory
+with the output in the same order as when checked one by one.
 """
 
+import io
 import sys
 import os.path
+from concurrent.futures import Future
 
-# Get directory or single YAML file as optional command-line argument.
+from archive import LocalFiles, FileIndex, ArchiveError, is_archive, open_source
+
+# Get directory, archive or single YAML file as optional command-line argument.
 directory = ''
 single_yaml_file = ''
+files = LocalFiles()
 if len(sys.argv) == 2:
     argument = sys.argv[1]
-    if os.path.isdir(argument):
+    if is_archive(argument):
+        try:
+            files, submission_file_path = open_source(argument)
+        except ArchiveError as e:
+            print(e)
+            quit()
+        if submission_file_path is None:
+            print('Archive %s contains no submission.yaml.' % argument)
+            quit()
+        elif os.path.basename(submission_file_path) == 'submission.yaml':
+            directory = os.path.dirname(submission_file_path)
+            print('Checking YAML files in archive %s.' % argument)
+        else:
+            single_yaml_file = submission_file_path
+            print('Checking single YAML file %s.' % single_yaml_file)
+    elif os.path.isdir(argument):
         directory = argument
         print('Checking YAML files in directory %s.' % directory)
     elif os.path.isfile(argument):
@@ -35,20 +61,17 @@ elif len(sys.argv) > 2:
 else:
     print('Checking YAML files in current directory.')
 
-# Import a YAML parser if available.
-try:
-    import yaml
-    # We try to load using the CSafeLoader for speed improvements.
-    try:
-        from yaml import CSafeLoader as Loader
-        from yaml import CSafeDumper as Dumper
-    except ImportError:
-        from yaml import SafeLoader as Loader
-        from yaml import SafeDumper as Dumper
-except ImportError:
+# Check that a YAML parser is available.
+import importlib.util
+if importlib.util.find_spec('yaml') is None:
     print('ImportError: please install a YAML implementation for Python.')
     quit()
 
+# We load using the fastest available parser backend (libyaml if possible),
+# unless another one is chosen with the HEPDATA_YAML_BACKEND variable.
+from yamlbackend import get_backend
+backend = get_backend()
+
 # Import the hepdata-validator package if installed.
 # If not, the script will only try to parse the YAML without validating the schema.
 try:
@@ -60,25 +83,126 @@ except ImportError:
     print('See https://github.com/HEPData/hepdata-validator to install.')
     validator_imported = False
 
+# One data file validator for all data files (and per process when parallel).
+if validator_imported:
+    data_file_validator = DataFileValidator()
+
+
+def check_data_file(data_file_path, contents):
+    """Check the parsed contents of a data file.
+
+    Returns the lines to print rather than printing them, so that data files
+    checked in parallel can be reported in the order of submission.yaml.
+    """
+    if not validator_imported:
+        return ['%s is valid YAML.' % data_file_path]
+
+    data_file_validator.clear_messages()
+    if not data_file_validator.validate(file_path=data_file_path, data=contents):
+        return (['%s is invalid HEPData YAML.' % data_file_path] +
+                ['\t %s' % error.__unicode__() for error in data_file_validator.get_messages(data_file_path)])
+
+    # Check that the length of the 'values' list is consistent for
+    # each of the independent_variables and dependent_variables.
+    indep_count = [len(indep['values']) for indep in contents['independent_variables']]
+    dep_count = [len(dep['values']) for dep in contents['dependent_variables']]
+    if len(set(indep_count + dep_count)) > 1: # if more than one unique count
+        return ["%s has inconsistent length of 'values' list: " % data_file_path +
+                "independent_variables%s, dependent_variables%s." % (str(indep_count), str(dep_count))]
+    return ['%s is valid HEPData YAML.' % data_file_path]
+
+
+def check_data_text(data_file_path, text):
+    """Parse and check the text of a data file.
+
+    The text is parsed from a stream named after the file, so that parse errors
+    give its path as when parsed from the file itself.
+    """
+    stream = io.StringIO(text)
+    stream.name = data_file_path
+    return check_data_file(data_file_path, backend.load(stream))
+
+
+# Output of the loop over documents below, in order: lists of lines, or futures
+# of the lines of data files still being checked in parallel.
+pending = []
+
+
+def flush(wait=False):
+    """Print the output up to the first data file still being checked."""
+    while pending and (wait or isinstance(pending[0], list) or pending[0].done()):
+        item = pending.pop(0)
+        for line in item if isinstance(item, list) else item.result():
+            print(line)
+
+
+def report(*lines):
+    pending.append(list(lines))
+    flush()
+
+
+# Data files of a compressed tar archive, which are read in one pass after the
+# loop below rather than one by one: (path, placeholder in pending).
+scanned = []
+
+
+def scan():
+    """Check the data files of a compressed tar archive in one pass."""
+    left = {}
+    for data_file_path, placeholder in scanned:
+        left.setdefault(data_file_path, []).append(placeholder)
+    try:
+        for data_file_path, data_file in files.scan(list(left)):
+            if data_file_path not in left:
+                continue
+            if pool:
+                result = pool.submit(check_data_text, data_file_path, data_file.read())
+            else:
+                result = check_data_file(data_file_path, backend.load(data_file))
+            # A data file referenced more than once is reported each time.
+            for placeholder in left.pop(data_file_path):
+                pending[pending.index(placeholder)] = result
+            flush()
+    except ArchiveError as e:
+        for placeholders in left.values():
+            for placeholder in placeholders:
+                pending[pending.index(placeholder)] = [str(e)]
+
 # Give location of the submission.yaml file or the single YAML file.
 if single_yaml_file:
     submission_file_path = single_yaml_file
 else:
     submission_file_path = os.path.join(directory, 'submission.yaml')
 
+# List the directory once: files referenced from submission.yaml are looked up
+# in this index rather than one by one, which is slow on network file systems.
+index = FileIndex(files, directory)
+
+
+def missing(path):
+    """Report a referenced file that does not exist."""
+    match = index.case_match(path)
+    if match:
+        report('%s is missing, but %s differs only in case.' % (path, match))
+    else:
+        report('%s is missing.' % path)
+
+
 # Open the submission.yaml file and load all YAML documents.
-with open(submission_file_path, 'r') as stream:
-    docs = list(yaml.load_all(stream, Loader=Loader))
+with files.open(submission_file_path) as stream:
+    docs = list(backend.load_all(stream))
 
     # Need to remove independent_variables and dependent_variables from single YAML file.
+    # They are kept in memory as the contents of a data file named after the table.
+    single_yaml_tables = {}
     if single_yaml_file:
         for doc in docs:
             if 'name' in doc:
                 file_name = doc['name'].replace(' ', '_').replace('/', '-') + '.yaml'
                 doc['data_file'] = file_name
-                with open(file_name, 'w') as data_file:
-                    yaml.dump({'independent_variables': doc.pop('independent_variables', None),
-                               'dependent_variables': doc.pop('dependent_variables', None)}, data_file, Dumper=Dumper)
+                single_yaml_tables[file_name] = {
+                    'independent_variables': doc.pop('independent_variables', None),
+                    'dependent_variables': doc.pop('dependent_variables', None)}
 
     # Validate the submission.yaml file if validator imported.
     if validator_imported:
@@ -91,6 +215,16 @@ with open(submission_file_path, 'r') as stream:
         else:
             print('%s is valid HEPData YAML.' % submission_file_path)
 
+    # Check data files in parallel if asked to.  The workers are forked, so
+    # that they start with the parser and data file validator of this process.
+    pool = None
+    jobs = int(os.environ.get('HEPDATA_CHECK_JOBS') or 1)
+    if jobs > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        if 'fork' in multiprocessing.get_all_start_methods():
+            pool = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('fork'))
+
     # Loop over all YAML documents in the submission.yaml file.
     for doc in docs:
 
@@ -103,17 +237,17 @@ with open(submission_file_path, 'r') as stream:
             for resource in doc['additional_resources']:
                 if not resource['location'].startswith('http'):
                     location = os.path.join(directory, resource['location'])
-                    if not os.path.isfile(location):
-                        print('%s is missing.' % location)
+                    if not index.isfile(location):
+                        missing(location)
                     elif '/' in resource['location']:
-                        print('%s should not contain "/".' % resource['location'])
+                        report('%s should not contain "/".' % resource['location'])
 
         # Check for non-empty YAML documents with a 'data_file' key.
         if 'data_file' in doc:
 
             # Check for presence of '/' in data_file value.
             if '/' in doc['data_file']:
-                print('%s should not contain "/".' % doc['data_file'])
+                report('%s should not contain "/".' % doc['data_file'])
                 continue
 
             # Extract data file from YAML document.
@@ -121,29 +255,35 @@ with open(submission_file_path, 'r') as stream:
 
             # Just try to load YAML data file without validating schema.
             # Script will terminate with an exception if there is a problem.
-            contents = yaml.load(open(data_file_path, 'r'), Loader=Loader)
-
-            # Validate the YAML data file if validator imported.
-            if not validator_imported:
-                print('%s is valid YAML.' % data_file_path)
-            else:
-                data_file_validator = DataFileValidator()
-                is_valid_data_file = data_file_validator.validate(file_path=data_file_path, data=contents)
-                if not is_valid_data_file:
-                    print('%s is invalid HEPData YAML.' % data_file_path)
-                    data_file_validator.print_errors(data_file_path)
-                else:
-                    # Check that the length of the 'values' list is consistent for
-                    # each of the independent_variables and dependent_variables.
-                    indep_count = [len(indep['values']) for indep in contents['independent_variables']]
-                    dep_count = [len(dep['values']) for dep in contents['dependent_variables']]
-                    if len(set(indep_count + dep_count)) > 1: # if more than one unique count
-                        print("%s has inconsistent length of 'values' list: " % data_file_path +
-                              "independent_variables%s, dependent_variables%s." % (str(indep_count), str(dep_count)))
-                    else:
-                        print('%s is valid HEPData YAML.' % data_file_path)
-
-            # For single YAML file, clean up by removing temporary data_file created above.
+            # Each data file is parsed once, then validated and checked.
             if single_yaml_file:
-                print('Removing %s.' % doc['data_file'])
-                os.remove(doc['data_file'])
+                contents = single_yaml_tables[doc['data_file']]
+                if pool:
+                    pending.append(pool.submit(check_data_file, data_file_path, contents))
+                else:
+                    report(*check_data_file(data_file_path, contents))
+            elif not index.isfile(data_file_path):
+                missing(data_file_path)
+            elif files.sequential:
+                # Output is held back from here until the archive is scanned.
+                scanned.append((data_file_path, Future()))
+                pending.append(scanned[-1][1])
+            elif pool:
+                with files.open(data_file_path) as data_file:
+                    pending.append(pool.submit(check_data_text, data_file_path, data_file.read()))
+            else:
+                with files.open(data_file_path) as data_file:
+                    contents = backend.load(data_file)
+                report(*check_data_file(data_file_path, contents))
+
+if scanned:
+    scan()
+flush(wait=True)
+if pool:
+    pool.shutdown()
+
+# Report files in the directory not referenced from submission.yaml.
+if not single_yaml_file:
+    for name in index.unreferenced(['submission.yaml']):
+        if not name.startswith('.'):
+            print('%s is not referenced from submission.yaml.' % os.path.join(directory, name))
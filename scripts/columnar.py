@@ -0,0 +1,299 @@
+"""
+Columnar representation of HEPData data tables, and semantic checks
+on it.
+
+A data table document (independent_variables and dependent_variables,
+see docs/data_yaml.rst) is turned into NumPy arrays: per variable the
+value, low and high of each row, and for dependent variables the plus
+and minus of each error label.  Checks that would otherwise be Python
+loops over dictionaries then become a few array operations.
+
+Requires NumPy.
+"""
+import numpy as np
+
+# ====================================================================
+def number(x):
+    """Convert a value of a data table to a number
+
+    :param x: Number, string like "1.5" or "5%", or None
+    :return: Tuple of the number (NaN if not a number) and whether it
+             is a percentage
+    """
+    if isinstance(x,bool) or x is None:
+        return np.nan, False
+    if isinstance(x,(int,float)):
+        return float(x), False
+    if isinstance(x,str):
+        s   = x.strip()
+        pct = s.endswith('%')
+        try:
+            return float(s[:-1] if pct else s), pct
+        except ValueError:
+            pass
+    return np.nan, False
+
+def to_array(raw):
+    """Convert values of a data table to an array
+
+    Lists of plain numbers (the common case) are converted in one go;
+    only lists with strings are converted value by value.
+
+    :param raw: List of numbers, strings or None
+    :return: Tuple of the array, and masks of where the values are
+             percentages, non-numeric strings, and infinity or NaN
+    """
+    n = len(raw)
+    try:
+        arr   = np.array(raw,dtype=float).reshape(n)
+        pct   = np.zeros(n,dtype=bool)
+        text  = pct
+    except (ValueError,TypeError):
+        vals  = [number(x) for x in raw]
+        arr   = np.array([x for x,p in vals],dtype=float).reshape(n)
+        pct   = np.array([p for x,p in vals],dtype=bool).reshape(n)
+        text  = np.array([isinstance(x,str) for x in raw],
+                         dtype=bool).reshape(n) & np.isnan(arr)
+
+    bad = ~np.isfinite(arr)
+    if bad.any():
+        # Missing values and text are NaN too, but not given as such
+        bad &= np.array([isinstance(x,float) for x in raw],
+                        dtype=bool).reshape(n)
+    return arr, pct, text, bad
+
+# ====================================================================
+class Column:
+    """A variable of a data table as arrays
+
+    :ivar name: Name of the variable (from the header)
+    :ivar units: Units of the variable, or ''
+    :ivar value: Values, NaN where absent or not a number
+    :ivar text: True where the value is a non-numeric string
+    :ivar low: Lower bin edges, NaN where absent
+    :ivar high: Upper bin edges, NaN where absent
+    :ivar errors: Dictionary from label to (plus, minus) arrays, with
+                  percentages converted to absolute errors
+    :ivar symerror: Dictionary from label to symmetric errors as given
+    :ivar nonfinite: True where a value, bin edge or error is given as
+                     infinity or NaN
+    """
+
+    def __init__(self,var):
+        """Convert a variable
+
+        :param var: Variable of a data table (header and values)
+        """
+        header     = var.get('header',{})
+        self.name  = header.get('name','')
+        self.units = header.get('units','')
+
+        values = var.get('values',[])
+        n      = len(values)
+        self.value, pct, self.text, bad1 = to_array([v.get('value')
+                                                     for v in values])
+        self.low, pct, text, bad2  = to_array([v.get('low') for v in values])
+        self.high, pct, text, bad3 = to_array([v.get('high') for v in values])
+        self.nonfinite = bad1 | bad2 | bad3
+
+        # Gather the rows and numbers of each error label, then convert
+        # them label by label
+        gathered = {}
+        for row,v in enumerate(values):
+            seen = {}
+            for i,e in enumerate(v.get('errors') or []):
+                label = e.get('label','error {}'.format(i+1))
+                # The same label twice in a row counts as another error
+                seen[label] = seen.get(label,0) + 1
+                if seen[label] > 1:
+                    label = '{} ({})'.format(label,seen[label])
+                if 'symerror' in e:
+                    plus, minus, sym = e['symerror'], None, True
+                else:
+                    asym  = e.get('asymerror') or {}
+                    plus, minus, sym = asym.get('plus'), asym.get('minus'), False
+                gathered.setdefault(label,[]).append((row,plus,minus,sym))
+
+        self.errors   = {}
+        self.symerror = {}
+        for label,entries in gathered.items():
+            self.add_error(n,label,entries)
+
+    def add_error(self,n,label,entries):
+        """Store the errors of a label
+
+        :param n: Number of rows
+        :param label: Label of the error
+        :param entries: List of (row, plus, minus, symmetric)
+        """
+        rows = np.array([e[0] for e in entries],dtype=int)
+        sym  = np.array([e[3] for e in entries],dtype=bool)
+        p, ppct, t, pbad = to_array([e[1] for e in entries])
+        m, mpct, t, mbad = to_array([e[2] for e in entries])
+        self.nonfinite[rows] |= pbad | mbad
+
+        # Percentages are relative to the value of the row
+        scale = np.abs(self.value[rows])/100
+        p     = np.where(ppct,p*scale,p)
+        m     = np.where(mpct,m*scale,m)
+        m     = np.where(sym,-p,m)
+
+        plus, minus = np.full(n,np.nan), np.full(n,np.nan)
+        plus[rows], minus[rows] = p, m
+        self.errors[label] = (plus,minus)
+
+        if sym.any():
+            given = np.full(n,np.nan)
+            s, spct, t, sbad = to_array([e[1] for e in entries if e[3]])
+            given[rows[sym]] = s
+            self.symerror[label] = given
+
+    @classmethod
+    def join(cls,header,parts):
+        """Join the columns of consecutive parts of the values of a
+        variable, e.g. converted as they were read
+
+        :param header: Header of the variable
+        :param parts: Columns of the parts, in order
+        :return: Column of all the values
+        """
+        col = cls({'header': header,'values': []})
+        if not parts:
+            return col
+
+        for name in ('value','text','low','high','nonfinite'):
+            setattr(col,name,np.concatenate([getattr(p,name)
+                                             for p in parts]))
+
+        # A label missing from a part has no error in its rows
+        none = [np.full(len(p),np.nan) for p in parts]
+        for p in parts:
+            for label in p.errors:
+                if label not in col.errors:
+                    col.errors[label] = tuple(
+                        np.concatenate([q.errors[label][k] if label in
+                                        q.errors else n
+                                        for q,n in zip(parts,none)])
+                        for k in (0,1))
+            for label in p.symerror:
+                if label not in col.symerror:
+                    col.symerror[label] = np.concatenate(
+                        [q.symerror.get(label,n) for q,n in zip(parts,none)])
+        return col
+
+    def __len__(self):
+        return len(self.value)
+
+    def binned(self):
+        """Mask of rows given as bins"""
+        return ~np.isnan(self.low) | ~np.isnan(self.high)
+
+# ====================================================================
+class ColumnTable:
+    """A data table as columns"""
+
+    def __init__(self,doc,columns=None):
+        """Convert a data table
+
+        :param doc: Data table document
+        :param columns: Dictionary from independent_variables and
+                        dependent_variables to lists of Columns already
+                        converted, used instead of those of doc
+        """
+        columns = columns or {}
+        self.independent = columns.get('independent_variables') or \
+            [Column(v) for v in doc.get('independent_variables',[]) or []]
+        self.dependent   = columns.get('dependent_variables') or \
+            [Column(v) for v in doc.get('dependent_variables',[]) or []]
+
+    def columns(self):
+        """All variables, as (kind, index, column)"""
+        return ([('Independent',i,c) for i,c in enumerate(self.independent)]+
+                [('Dependent',i,c) for i,c in enumerate(self.dependent)])
+
+# ====================================================================
+def rows(mask,limit=5):
+    """Describe the rows selected by a mask, e.g. "3 rows: 4, 7, 9" """
+    idx = np.flatnonzero(mask)
+    txt = ', '.join(str(i) for i in idx[:limit])
+    if len(idx) > limit:
+        txt += ', ...'
+    return '{} row{}: {}'.format(len(idx),'' if len(idx) == 1 else 's',txt)
+
+def describe(kind,index,col):
+    return '{} variable {} ({})'.format(kind,index,col.name)
+
+# --------------------------------------------------------------------
+def check_bins(table):
+    """Bins must have low <= high, and contain their value"""
+    for kind,i,col in table.columns():
+        bad = col.low > col.high
+        if bad.any():
+            yield '{}: low > high in {}'.format(describe(kind,i,col),
+                                                rows(bad))
+        out = (col.value < col.low) | (col.value > col.high)
+        if out.any():
+            yield '{}: value outside bin in {}'.format(describe(kind,i,col),
+                                                       rows(out))
+
+def check_monotonic(table):
+    """The bins of a one-dimensional table must be ordered and must not
+    overlap"""
+    if len(table.independent) != 1:
+        return
+    col = table.independent[0]
+    if len(col) < 2 or not col.binned().all():
+        return
+
+    dlow = np.diff(col.low)
+    if not ((dlow >= 0).all() or (dlow <= 0).all()):
+        yield '{}: bin edges are not monotonic'.format(describe(
+            'Independent',0,col))
+        return
+
+    # Order as increasing, then compare each bin to the next
+    low, high = ((col.low,col.high) if (dlow >= 0).all() else
+                 (col.low[::-1],col.high[::-1]))
+    overlap = low[1:] < high[:-1]
+    if overlap.any():
+        yield '{}: bins overlap the next in {}'.format(describe(
+            'Independent',0,col),rows(overlap))
+
+def check_finite(table):
+    """Numbers must be finite"""
+    for kind,i,col in table.columns():
+        if col.nonfinite.any():
+            yield '{}: non-finite numbers in {}'.format(describe(kind,i,col),
+                                                       rows(col.nonfinite))
+
+def check_errors(table):
+    """Symmetric errors must not be negative"""
+    for kind,i,col in table.columns():
+        for label,sym in col.symerror.items():
+            bad = sym < 0
+            if bad.any():
+                yield '{}: negative symerror "{}" in {}'.format(
+                    describe(kind,i,col),label,rows(bad))
+
+SEMANTIC_CHECKS = [check_bins,check_monotonic,check_finite,check_errors]
+
+# --------------------------------------------------------------------
+def semantic_checks(doc,checks=None,columns=None):
+    """Run semantic checks on a data table
+
+    :param doc: Data table document (already valid against the schema)
+    :param checks: Check functions, by default SEMANTIC_CHECKS
+    :param columns: Columns of the variables already converted (see
+                    ColumnTable)
+    :return: List of problems found
+    """
+    table = ColumnTable(doc,columns)
+    ret   = []
+    for check in checks or SEMANTIC_CHECKS:
+        ret.extend(check(table))
+    return ret
+
+# ====================================================================
+#
+# EOF
+#
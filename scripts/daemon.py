@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+"""
+Validation server, keeping schemas, parsers and the result cache warm
+between requests.
+
+  ./daemon.py serve -s SCHEMADIR [--socket PATH]
+
+Serves HTTP on a Unix socket (default: see default_socket), which only
+the user can connect to.  Requests:
+
+  POST /validate  with a JSON body {"path": ...}, the path of a
+                  submission directory, file or archive, or with the
+                  bytes of an archive as body and its file name in the
+                  X-Filename header
+  GET  /status    process id, uptime, number of validations and options
+  POST /shutdown  stop the server
+
+/validate returns the report record of the submission (see batch.py).
+If the request has the options of the client's validator as JSON in
+the X-Validator-Options header (see validate.validator_settings), it is
+refused with status 409 unless they are those of the server.  Other
+failures are replied with status 500.  Error replies have a JSON body
+{"error": ...}.
+
+  ./daemon.py client [--socket PATH] [--upload] INPUT ...
+
+Validates inputs with the server and prints the messages as
+validate.py does.  If no server is running, or it runs with other
+options than given to the client, the inputs are validated in this
+process instead.
+
+  ./daemon.py stop [--socket PATH]
+
+Stops the server.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import traceback
+import http.client
+import http.server
+import socketserver
+
+from validate import Validator, Message, validator_arguments, \
+    validator_options, validator_settings
+from batch import validate_input, safe_validate_input, failure_record
+
+# ====================================================================
+def default_socket():
+    """Default path of the server socket, private to the user"""
+    top = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(top,'hepdata-validate-{}.sock'.format(os.getuid()))
+
+# ====================================================================
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Handles requests to the validation server"""
+
+    def address_string(self):
+        # Clients on a Unix socket have no address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self,format,*args):
+        if self.server.verbose:
+            super().log_message(format,*args)
+
+    def reply(self,code,obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self.reply(404,{'error': 'Unknown request '+self.path})
+        self.reply(200,{'pid':     os.getpid(),
+                        'uptime':  time.time()-self.server.started,
+                        'served':  self.server.served,
+                        'options': self.server.settings})
+
+    def do_POST(self):
+        if self.path == '/shutdown':
+            self.reply(200,{'stopping': True})
+            self.server.stopping = True
+            return
+        if self.path != '/validate':
+            return self.reply(404,{'error': 'Unknown request '+self.path})
+
+        body = self.rfile.read(int(self.headers.get('Content-Length',0)))
+        try:
+            settings = self.headers.get('X-Validator-Options')
+            differ   = (self.server.differ(json.loads(settings))
+                        if settings is not None else [])
+            name     = self.headers.get('X-Filename')
+            path     = json.loads(body)['path'] if name is None else None
+        except (ValueError,KeyError,TypeError) as e:
+            return self.reply(400,{'error': 'Bad request: {}'.format(e)})
+        if differ:
+            return self.reply(409,{'error': 'The server was started with '
+                                   'other options ({})'
+                                   .format(', '.join(differ))})
+        try:
+            if name is None:
+                rec = self.server.validate(path)
+            else:
+                rec = self.server.validate_upload(name,body)
+        except Exception as e:
+            self.log_error('Validation failed: %s',traceback.format_exc())
+            return self.reply(500,{'error': 'Validation failed: {}: {}'
+                                   .format(type(e).__name__,e)})
+        self.reply(200,rec)
+
+# --------------------------------------------------------------------
+class ServerMixin:
+    """Validation state of the server, shared by all requests"""
+
+    def setup_validator(self,options,settings,verbose=False):
+        self.validator = Validator(**options)
+        self.settings  = settings
+        self.verbose   = verbose
+        self.started   = time.time()
+        self.served    = 0
+        self.stopping  = False
+
+    def differ(self,settings):
+        """Names of the options that differ from those of the server"""
+        return sorted(k for k in set(settings)|set(self.settings)
+                      if settings.get(k) != self.settings.get(k))
+
+    def validate(self,path):
+        self.served += 1
+        return validate_input(self.validator,path)
+
+    def validate_upload(self,name,data):
+        """Validate an uploaded archive
+
+        :param name: File name of the archive
+        :param data: Content of the archive
+        :return: Report record, with the paths given relative to name
+        """
+        name = os.path.basename(name)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp,name)
+            with open(path,'wb') as out:
+                out.write(data)
+            rec = self.validate(path)
+
+        # Do not leak the temporary location to the client
+        prefix = os.path.join(tmp,'')
+        def strip(p):
+            return p[len(prefix):] if p and p.startswith(prefix) else p
+        rec['input']      = name
+        rec['submission'] = strip(rec['submission'])
+        rec['messages']   = dict((strip(f),[[l,m.replace(prefix,'')]
+                                            for l,m in msgs])
+                                 for f,msgs in rec['messages'].items())
+        return rec
+
+    def serve(self):
+        while not self.stopping:
+            self.handle_request()
+
+class UnixServer(ServerMixin,socketserver.UnixStreamServer):
+    pass
+
+# --------------------------------------------------------------------
+def serve(options,settings,path=None,verbose=False):
+    """Run the validation server until it is shut down
+
+    :param options: Arguments of Validator
+    :param settings: The same options as JSON values (see
+                     validate.validator_settings), to compare with
+                     those of clients
+    :param path: Path of the Unix socket
+    """
+    path = path or default_socket()
+    if os.path.exists(path):
+        if connect(path) is not None:
+            raise RuntimeError('A server is already running on {}'
+                               .format(path))
+        # Left behind by a server that did not stop cleanly
+        os.remove(path)
+    # Create the socket accessible to the user only, rather than
+    # restricting it after it is bound
+    umask = os.umask(0o077)
+    try:
+        server = UnixServer(path,Handler)
+    finally:
+        os.umask(umask)
+
+    server.setup_validator(options,settings,verbose)
+    print('Serving on {}'.format(path))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+# ====================================================================
+class UnixConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket"""
+
+    def __init__(self,path,timeout=None):
+        super().__init__('localhost',timeout=timeout)
+        self._socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+# --------------------------------------------------------------------
+def connect(path=None):
+    """Connect to a running server
+
+    :param path: Path of the Unix socket of the server
+    :return: The connection, or None if no server is running
+    """
+    conn = UnixConnection(path or default_socket())
+    try:
+        conn.request('GET','/status')
+        resp = conn.getresponse()
+        resp.read()
+    except (OSError,http.client.HTTPException):
+        conn.close()
+        return None
+    return conn
+
+# --------------------------------------------------------------------
+class ServerError(RuntimeError):
+    """Error reply of the server"""
+
+    def __init__(self,status,message):
+        super().__init__(message)
+        self.status = status
+
+def request(conn,method,url,body=None,headers={}):
+    """Send a request to the server and decode the JSON reply
+
+    :raises ServerError: If the server replies with an error
+    """
+    conn.request(method,url,body,headers)
+    resp = conn.getresponse()
+    data = resp.read()
+    try:
+        ret = json.loads(data)
+    except ValueError:
+        ret = {}
+    if resp.status != 200:
+        raise ServerError(resp.status,
+                          ret.get('error','Server error {}'
+                                  .format(resp.status)))
+    return ret
+
+# --------------------------------------------------------------------
+def client(inputs,options,settings,path=None,upload=False):
+    """Validate inputs with a server, or in this process if no server
+    is running or it runs with other options
+
+    :param inputs: Submission directories, files or archives
+    :param options: Arguments of Validator, used without a server
+    :param settings: The same options as JSON values (see
+                     validate.validator_settings), which the server
+                     must have been started with
+    :param path: Path of the Unix socket of the server
+    :param upload: Send archives to the server rather than their paths
+    :return: Generator of report records
+    """
+    conn    = connect(path)
+    v       = None
+    headers = {'X-Validator-Options': json.dumps(settings)}
+    try:
+        for inp in inputs:
+            if conn is not None:
+                try:
+                    if upload and os.path.isfile(inp):
+                        with open(inp,'rb') as f:
+                            data = f.read()
+                        rec = request(conn,'POST','/validate',data,
+                                      dict(headers,**{'X-Filename':
+                                                      os.path.basename(inp)}))
+                    else:
+                        rec = request(conn,'POST','/validate',
+                                      json.dumps({'path':
+                                                  os.path.abspath(inp)}),
+                                      dict(headers,**{'Content-Type':
+                                                      'application/json'}))
+                except ServerError as e:
+                    if e.status != 409:
+                        rec = failure_record(inp,'Server error: {}'
+                                             .format(e))
+                    else:
+                        print('{}: validating in this process'.format(e),
+                              file=sys.stderr)
+                        conn.close()
+                        conn = None
+                except (OSError,http.client.HTTPException) as e:
+                    rec = failure_record(inp,'Server error: {}: {}'
+                                         .format(type(e).__name__,e))
+                if conn is not None:
+                    yield rec
+                    continue
+
+            if v is None:
+                v = Validator(**options)
+            yield safe_validate_input(v,inp)
+    finally:
+        if conn is not None:
+            conn.close()
+
+# --------------------------------------------------------------------
+def print_record(rec,least=Message.WARNING):
+    """Print the messages of a report record as validate.py does"""
+    levels = dict((Message.levelStr(l),l) for l in (Message.ERROR,
+                                                    Message.WARNING,
+                                                    Message.INFO))
+    for f,msgs in rec['messages'].items():
+        msgs = [(l,m) for l,m in msgs if levels.get(l,Message.ERROR) >= least]
+        if not msgs:
+            continue
+        print(f)
+        for l,m in msgs:
+            print('\t{:10s} - {}'.format(l,m))
+    if not rec['valid']:
+        print('There was a problem')
+
+# ====================================================================
+if __name__ == "__main__":
+    import argparse as ap
+
+    parser = ap.ArgumentParser(description="Validation server for HepData "
+                               "submissions")
+    parser.add_argument('command',
+                        choices=['serve','client','stop'],
+                        help='Run the server, validate with it, or stop it')
+    parser.add_argument('inputs',
+                        nargs='*',
+                        help='Submission directories, files or archives '
+                        '(client only)')
+    parser.add_argument('--socket',
+                        help='Path of the Unix socket (default: {})'
+                        .format(default_socket()))
+    parser.add_argument('--upload',
+                        action='store_true',
+                        help='Send archives to the server rather than their '
+                        'paths (client only)')
+    parser.add_argument('-l',
+                        '--level',
+                        default='WARNING',
+                        choices=['INFO','WARNING','ERROR'],
+                        help='Least level of messages to print (client only)')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='Print report records as JSON lines (client only)')
+    parser.add_argument('-v',
+                        '--verbose',
+                        action='store_true',
+                        help='Log requests (serve only)')
+    validator_arguments(parser)
+    args = parser.parse_intermixed_args()
+
+    if args.command == 'serve':
+        serve(validator_options(args),validator_settings(args),args.socket,
+              args.verbose)
+        sys.exit(0)
+
+    if args.command == 'stop':
+        conn = connect(args.socket)
+        if conn is None:
+            print('No server running')
+            sys.exit(1)
+        request(conn,'POST','/shutdown')
+        sys.exit(0)
+
+    if not args.inputs:
+        parser.error('No submissions given')
+
+    invalid = 0
+    for rec in client(args.inputs,validator_options(args),
+                      validator_settings(args),args.socket,args.upload):
+        invalid += not rec['valid']
+        if args.json:
+            print(json.dumps(rec))
+        else:
+            print_record(rec,getattr(Message,args.level))
+    sys.exit(1 if invalid else 0)
+
+# ====================================================================
+#
+# EOF
+#
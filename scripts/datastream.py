@@ -0,0 +1,366 @@
+"""
+Event-driven validation of (possibly huge) YAML data files.
+
+Instead of building the whole document, the PyYAML event stream is
+walked, and only small parts of it are turned into Python objects: the
+header and qualifiers of each variable, and one entry of "values" at a
+time.  Each entry is checked against the schema of the entry as soon as
+it has been read, and then thrown away.  For the semantic checks, only
+the numbers of the entries are kept, as NumPy arrays (see columnar.py),
+so a table takes a fraction of the memory of its document.
+
+Used by the Validator of validate.py when streaming is enabled.
+"""
+import yaml
+from yaml.events import (AliasEvent, ScalarEvent,
+                         SequenceStartEvent, SequenceEndEvent,
+                         MappingStartEvent, MappingEndEvent,
+                         StreamStartEvent, StreamEndEvent)
+import reprlib
+
+VARIABLES = ('independent_variables','dependent_variables')
+
+# ====================================================================
+class EventReader:
+    """Builds Python objects from parts of a YAML event stream"""
+
+    def __init__(self,loader):
+        """Create reader
+
+        :param loader: A PyYAML loader (pure Python or libyaml based)
+        """
+        self._loader  = loader
+        self._anchors = {}
+
+    def peek(self):
+        """Get the next event without consuming it"""
+        return self._loader.peek_event()
+
+    def next(self):
+        """Consume the next event"""
+        return self._loader.get_event()
+
+    def at(self,cls):
+        """Check if the next event is of a given type"""
+        return isinstance(self._loader.peek_event(),cls)
+
+    def build(self):
+        """Consume the events of the next node, and build its object
+
+        :return: The Python object of the node
+        """
+        ev = self.next()
+        if isinstance(ev,AliasEvent):
+            if ev.anchor not in self._anchors:
+                raise yaml.composer.ComposerError(
+                    None,None,'found undefined alias {}'.format(ev.anchor),
+                    ev.start_mark)
+            return self._anchors[ev.anchor]
+
+        if isinstance(ev,ScalarEvent):
+            tag = ev.tag
+            if tag is None or tag == '!':
+                tag = self._loader.resolve(yaml.ScalarNode,ev.value,
+                                           ev.implicit)
+            node = yaml.ScalarNode(tag,ev.value,ev.start_mark,ev.end_mark,
+                                   style=ev.style)
+            obj = self._loader.construct_object(node)
+            # Do not let the constructor remember every scalar
+            self._loader.constructed_objects.pop(node,None)
+
+        elif isinstance(ev,SequenceStartEvent):
+            obj = []
+            while not self.at(SequenceEndEvent):
+                obj.append(self.build())
+            self.next()
+
+        elif isinstance(ev,MappingStartEvent):
+            obj = {}
+            while not self.at(MappingEndEvent):
+                key      = self.build()
+                obj[key] = self.build()
+            self.next()
+
+        else:
+            raise yaml.composer.ComposerError(
+                None,None,'unexpected {}'.format(type(ev).__name__),
+                ev.start_mark)
+
+        if ev.anchor is not None:
+            self._anchors[ev.anchor] = obj
+        return obj
+
+# ====================================================================
+def json_path(prefix,path):
+    """Format a path into a document
+
+    :param prefix: Path of the part of the document validated
+    :param path: Sequence of keys and indices below prefix
+    :return: String like dependent_variables[2].values[1034].errors[0]
+    """
+    ret = prefix
+    for p in path:
+        ret += ('[{}]'.format(p) if isinstance(p,int) else
+                '.{}'.format(p) if ret else str(p))
+    return ret
+
+# --------------------------------------------------------------------
+_preview = reprlib.Repr()
+_preview.maxlevel  = 3
+_preview.maxdict   = 6
+_preview.maxlist   = 6
+_preview.maxstring = 60
+_preview.maxother  = 60
+
+def preview(instance,width=300):
+    """Show the start of a part of a document
+
+    Only the first few keys and entries at each level are looked at,
+    so this is cheap even for a whole table.
+
+    :param instance: Part of a document
+    :param width: Most characters shown
+    :return: String
+    """
+    ret = _preview.repr(instance)
+    return ret if len(ret) <= width else ret[:width-3]+'...'
+
+# ====================================================================
+class DataStream:
+    """Validates data file documents from a YAML event stream"""
+
+    # Entries of the values of a variable converted to arrays at a time
+    CHUNK = 10000
+
+    def __init__(self,validator,filename,verb=False):
+        """Create the streaming validator
+
+        Errors are counted with those of the validator, so that at most
+        its limit of errors per file is reported.
+
+        :param validator: The validate.Validator to report to
+        :param filename: Name of the file validated
+        :param verb: Be verbose
+        """
+        self._validator = validator
+        self._filename  = filename
+        self._verb      = verb
+        self._columns   = None
+
+        # The numbers of the values are kept as arrays for the semantic
+        # checks, if those are done
+        self._semantic = None
+        if validator._semantic:
+            import columnar
+            self._semantic = columnar
+
+        # Validators of the parts of the data schema
+        dat = validator._dat_validator
+        cls = type(dat)
+        sch = dat.schema
+        self._doc = dat
+        self._var = {}
+        self._val = {}
+        for kind in VARIABLES:
+            var = sch['properties'][kind]['items']
+            self._var[kind] = cls(var,format_checker=dat.format_checker)
+            self._val[kind] = cls(var['properties']['values']['items'],
+                                  format_checker=dat.format_checker)
+
+    @property
+    def errors(self):
+        """Number of errors of the file found so far"""
+        return self._validator._errcount.get(self._filename,0)
+
+    def check(self,validator,instance,prefix):
+        """Check part of a document, reporting a bounded number of errors
+
+        :param validator: Validator of this part of the schema
+        :param instance: Part of the document
+        :param prefix: Path of the part in the document
+        :return: True if valid
+        """
+        ok = True
+        for ve in validator.iter_errors(instance):
+            ok    = False
+            count = self.errors+1
+            self._validator._errcount[self._filename] = count
+            if count > self._validator._maxerrors:
+                continue
+            self._validator.add_error(self._filename,
+                                      '{} at {} in\n{}'
+                                      .format(ve.message,
+                                              json_path(prefix,
+                                                        ve.absolute_path)
+                                              or '<document>',
+                                              preview(ve.instance)))
+        return ok
+
+    def validate(self,stream,loader):
+        """Validate all documents in a stream
+
+        :param stream: Open file or string
+        :param loader: PyYAML loader class
+        :return: True if valid
+        """
+        ld = loader(stream)
+        try:
+            reader = EventReader(ld)
+            if reader.at(StreamStartEvent):
+                reader.next()
+            while not reader.at(StreamEndEvent):
+                reader.next()           # Document start
+                self.document(reader)
+                reader.next()           # Document end
+        finally:
+            ld.dispose()
+
+        return not self._validator.has_errors(self._filename)
+
+    def document(self,reader):
+        """Validate one document of the stream
+
+        Only the variables are read as they come.  The rest of a
+        document of a single YAML file is a submission entry, and a
+        document without variables (e.g. additional information) is
+        small, so these are validated as when reading the whole file.
+        """
+        errors = self.errors
+        if not reader.at(MappingStartEvent):
+            doc = reader.build()
+            if doc is not None:
+                self.check(self._doc,doc,'')
+            return
+
+        # The document without the variables, which are checked as
+        # they are read
+        reader.next()
+        skeleton = {}
+        lengths  = {}
+        self._columns = {} if self._semantic else None
+        while not reader.at(MappingEndEvent):
+            key = reader.build()
+            if key in VARIABLES and reader.at(SequenceStartEvent):
+                skeleton[key] = []
+                lengths[key]  = self.variables(reader,key)
+            else:
+                skeleton[key] = reader.build()
+        reader.next()
+
+        if not lengths:
+            self._validator.validate_document(self._filename,skeleton,
+                                              self._verb)
+            return
+
+        entry = None
+        if 'description' in skeleton:
+            # The table of a single YAML file, with its submission entry
+            # (checked after the table, as when reading the whole file)
+            entry = {k: v for k,v in skeleton.items() if k not in VARIABLES}
+            entry['data_file'] = ''
+            skeleton = {k: v for k,v in skeleton.items() if k in VARIABLES}
+            if 'name' in entry:
+                self._validator._tables[entry['name']] = entry
+
+        self.check(self._doc,skeleton,'')
+
+        if len(lengths) == len(VARIABLES) and self.errors == errors:
+            len_indep = lengths[VARIABLES[0]]
+            len_dep   = lengths[VARIABLES[1]]
+            if len(set(len_indep+len_dep)) > 1:
+                self._validator.add_warning(self._filename,
+                                            "Inconsistent lengths of "
+                                            "independent variables {} and "
+                                            "dependent variables {}"
+                                            .format(str(len_indep),
+                                                    str(len_dep)))
+            elif self._semantic:
+                # Bins, errors and numbers, checked column by column
+                with self._validator.span('semantic',self._filename):
+                    problems = self._semantic.semantic_checks(
+                        skeleton,columns=self._columns)
+                for problem in problems:
+                    self._validator.add_warning(self._filename,problem)
+
+        if self.errors == errors:
+            self._validator.add_info(self._filename,
+                                     "Contains a valid data table {}"
+                                     .format(skeleton.get('name','')))
+
+        if entry is not None:
+            self._validator.validate_document(self._filename,entry,
+                                              self._verb)
+
+    def variables(self,reader,kind):
+        """Validate a sequence of variables
+
+        If semantic checks are done, the values of each valid variable
+        are converted to a columnar.Column, a chunk of entries at a
+        time.
+
+        :param reader: Event reader positioned at the sequence
+        :param kind: independent_variables or dependent_variables
+        :return: The number of values of each variable
+        """
+        lengths = []
+        columns = []
+        reader.next()
+        while not reader.at(SequenceEndEvent):
+            prefix = '{}[{}]'.format(kind,len(lengths))
+            if not reader.at(MappingStartEvent):
+                self.check(self._var[kind],reader.build(),prefix)
+                lengths.append(0)
+                continue
+
+            reader.next()
+            var   = {}
+            count = 0
+            parts = [] if self._semantic else None
+            chunk = []
+            while not reader.at(MappingEndEvent):
+                key = reader.build()
+                if key == 'values' and reader.at(SequenceStartEvent):
+                    # Check each entry as it arrives, keeping only a count
+                    # and the numbers
+                    reader.next()
+                    var[key] = []
+                    while not reader.at(SequenceEndEvent):
+                        value = reader.build()
+                        ok    = self.check(self._val[kind],value,
+                                           '{}.values[{}]'.format(prefix,
+                                                                  count))
+                        count += 1
+                        if parts is None:
+                            continue
+                        if not ok:
+                            parts = None
+                            continue
+                        chunk.append(value)
+                        if len(chunk) == self.CHUNK:
+                            parts.append(self._semantic.Column(
+                                {'values': chunk}))
+                            chunk = []
+                    reader.next()
+                else:
+                    var[key] = reader.build()
+                    if key == 'values' and isinstance(var[key],list):
+                        count = len(var[key])
+                        chunk = list(var[key])
+            reader.next()
+
+            if self.check(self._var[kind],var,prefix) and parts is not None:
+                if chunk:
+                    parts.append(self._semantic.Column({'values': chunk}))
+                columns.append(self._semantic.Column.join(
+                    var.get('header',{}),parts))
+            lengths.append(count)
+        reader.next()
+
+        if self._columns is not None:
+            self._columns[kind] = columns
+        return lengths
+
+# ====================================================================
+#
+# EOF
+#
@@ -0,0 +1,226 @@
+"""
+Fast YAML output of HEPData data tables.
+
+yaml.dump spends most of its time finding out the type and style of
+every node of a table.  Here the layout of a data table (see
+docs/data_yaml.rst) is fixed instead: the variables are written in
+block style, and their headers, qualifiers and each of their values in
+flow style, one row per line:
+
+  independent_variables:
+  - header: {name: PT, units: GeV}
+    values:
+    - {low: 0.0, high: 1.0}
+  dependent_variables:
+  - header: {name: SIG, units: pb}
+    qualifiers:
+    - {name: SQRT(S), units: GeV, value: 13000}
+    values:
+    - {value: 1.0, errors: [{symerror: 0.1, label: stat}]}
+
+Keys are written in the order of the document, also those of the
+variables (values need not come last), so the same document always
+gives the same bytes, and the output reads back as the same document.  Rows can also be written straight from columns, see
+column_rows.
+"""
+import functools
+import re
+
+import yaml
+
+from yamlbackend import safe_dumper
+
+# ====================================================================
+# Strings that may be written without quotes, if YAML does not read
+# them as another type
+_plain = re.compile(r'[A-Za-z0-9_.$\\()/+^<=~][A-Za-z0-9_.$\\()/+^<>=|~%* -]*'
+                    r'(?<! )')
+_resolver = yaml.resolver.Resolver()
+
+@functools.lru_cache(maxsize=4096)
+def string(s):
+    """Format a string as a YAML flow scalar"""
+    if (_plain.fullmatch(s) and
+        _resolver.resolve(yaml.ScalarNode,s,(True,False)) ==
+        'tag:yaml.org,2002:str'):
+        return s
+    # Anything else is quoted as yaml.dump would
+    ret = yaml.dump(s,Dumper=safe_dumper(),default_style='"',width=1<<30)
+    return ret[:ret.rindex('"')+1]
+
+def floating(x):
+    """Format a float as yaml.dump does"""
+    ret = repr(x)
+    if '.' in ret:
+        return ret
+    if x != x:
+        return '.nan'
+    if x == _inf:
+        return '.inf'
+    if x == -_inf:
+        return '-.inf'
+    # YAML 1.1 needs a '.' to read "1e-05" as a number
+    return ret.replace('e','.0e',1)
+
+_inf = float('inf')
+
+_scalars = {str:            string,
+            float:          floating,
+            int:            str,
+            bool:           lambda x: 'true' if x else 'false',
+            type(None):     lambda x: 'null'}
+
+def scalar(x):
+    """Format a number, string, boolean or None as a YAML flow scalar"""
+    fmt = _scalars.get(type(x))
+    if fmt is not None:
+        return fmt(x)
+    if isinstance(x,str):
+        return string(str(x))
+    if isinstance(x,bool):
+        return _scalars[bool](x)
+    if isinstance(x,float):
+        return floating(float(x))
+    if isinstance(x,int):
+        return str(int(x))
+    if hasattr(x,'item'):
+        # NumPy scalars
+        return scalar(x.item())
+    raise TypeError('Cannot write {!r} as a YAML scalar'.format(x))
+
+def key(k):
+    """Format a key of a mapping"""
+    return string(k) if type(k) is str else scalar(k)
+
+def flow(obj):
+    """Format a value in YAML flow style"""
+    t = type(obj)
+    if t is dict:
+        # Most keys are strings and most values scalars, which are
+        # formatted here rather than by recursion
+        parts = []
+        for k,v in obj.items():
+            fmt = _scalars.get(type(v))
+            parts.append((string(k) if type(k) is str else scalar(k))+': '+
+                         (fmt(v) if fmt is not None else flow(v)))
+        return '{'+', '.join(parts)+'}'
+    if t is list or t is tuple:
+        return '['+', '.join([flow(v) for v in obj])+']'
+    fmt = _scalars.get(t)
+    if fmt is not None:
+        return fmt(obj)
+    if isinstance(obj,dict):
+        return flow(dict(obj))
+    if isinstance(obj,(list,tuple)):
+        return flow(list(obj))
+    return scalar(obj)
+
+# ====================================================================
+def column_rows(value=None,low=None,high=None,errors=()):
+    """Values of a variable from columns
+
+    :param value: Sequence of values, or None
+    :param low: Sequence of lower bin edges, or None
+    :param high: Sequence of upper bin edges, or None
+    :param errors: Sequence of (label, plus, minus) where plus and minus
+                   are sequences, minus None for symmetric errors, and
+                   label None for no label
+    :return: Generator of the rows in flow style.  A value, bin edge
+             or error that is None or NaN is left out of its row.
+    """
+    cols = [(name,[scalar(x) if x is not None and x == x else None
+                   for x in tolist(col)])
+            for name,col in (('value',value),('low',low),('high',high))
+            if col is not None]
+    errs = [(', label: '+string(label) if label is not None else '',
+             [scalar(x) if x is not None and x == x else None
+              for x in tolist(plus)],
+             minus is not None and
+             [scalar(x) if x is not None and x == x else None
+              for x in tolist(minus)])
+            for label,plus,minus in errors]
+    n = max([len(c) for n,c in cols]+[len(e[1]) for e in errs]+[0])
+
+    for i in range(n):
+        parts = [name+': '+c[i] for name,c in cols if c[i] is not None]
+        row   = []
+        for label,plus,minus in errs:
+            if plus[i] is None:
+                continue
+            if minus is False:
+                row.append('{symerror: '+plus[i]+label+'}')
+            elif minus[i] is not None:
+                row.append('{asymerror: {plus: '+plus[i]+', minus: '+
+                           minus[i]+'}'+label+'}')
+        if row:
+            parts.append('errors: ['+', '.join(row)+']')
+        yield '{'+', '.join(parts)+'}'
+
+def tolist(col):
+    """Python values of a sequence or array"""
+    return col.tolist() if hasattr(col,'tolist') else list(col)
+
+# --------------------------------------------------------------------
+def write_variable(out,var,rows=None):
+    """Write a variable of a data table
+
+    :param out: Text stream
+    :param var: Variable, with header, qualifiers and values
+    :param rows: Iterable of the values already in flow style (see
+                 column_rows), instead of the values of var, written in
+                 their place or, if var has none, last
+    """
+    def write_values(first,rows):
+        empty = True
+        for row in rows:
+            if empty:
+                out.write(first+'values:\n')
+                empty = False
+            out.write('  - '+row+'\n')
+        if empty:
+            out.write(first+'values: []\n')
+
+    first = '- '
+    for k,v in var.items():
+        if k == 'values' and rows is not None:
+            write_values(first,rows)
+            rows = None
+        elif k == 'values' and isinstance(v,list):
+            write_values(first,(flow(x) for x in v))
+        elif k == 'qualifiers' and v:
+            out.write(first+'qualifiers:\n')
+            out.write(''.join(['  - '+flow(q)+'\n' for q in v]))
+        else:
+            out.write(first+key(k)+': '+flow(v)+'\n')
+        first = '  '
+
+    if rows is not None:
+        write_values(first,rows)
+
+def write_table(out,doc):
+    """Write a data table
+
+    :param out: Text stream
+    :param doc: Data table document
+    """
+    for k,v in doc.items():
+        if (k in ('independent_variables','dependent_variables') and v and
+            all(type(var) is dict and var for var in v)):
+            out.write(key(k)+':\n')
+            for var in v:
+                write_variable(out,var)
+        else:
+            out.write(key(k)+': '+flow(v)+'\n')
+
+def dump_table(doc):
+    """The YAML text of a data table"""
+    import io
+
+    out = io.StringIO()
+    write_table(out,doc)
+    return out.getvalue()
+
+# ====================================================================
+#
+# EOF
+#
@@ -0,0 +1,215 @@
+"""
+Data tables from the columns of a pandas DataFrame.
+
+Converters often read a text file into a DataFrame with one row per
+bin, and write one data table per value of some columns (e.g. a table
+of a cross section against PT for each bin of Q2).  Here the rows of
+all tables are formatted at once, as whole-column string operations,
+and then split into tables by the grouping columns in one pass, so
+that the time grows linearly with the number of rows.
+
+Which columns make up each variable is given by a list of dictionaries,
+one per variable, independent variables first (as in tablewriter.py):
+
+  columns = [{'low': 'PT_LOW', 'high': 'PT_HIGH'},
+             {'value': 'SIG',
+              'errors': [{'symerror': 'STAT', 'label': 'stat'},
+                         {'plus': 'JES+', 'minus': 'JES-',
+                          'label': 'JES', 'percent': True}]}]
+
+  for key, index, rows in frame_tables(df, columns, groupby='Q2'):
+      with open(...) as out:
+          write_table(out, independent, dependent, rows)
+
+An error given by 'plus' and 'minus' columns is written as a symerror
+if plus is positive and minus is -plus, and left out if both are zero
+(compared as numbers, so '0.0' and '-0.00' are zero too).  With
+'percent' the error is written as a string ending in '%'.  A missing
+(NaN or None) value is written as '-', as HEPData expects for a value
+that is not given, while missing bin edges and errors are left out of
+their row.  Text columns, e.g. read with dtype=str to keep the digits
+of the input, are written as strings, and error texts as given (so
+' 0.50' stays '0.50%').  Every row must have values of the grouping
+columns.
+"""
+import numpy as np
+import pandas as pd
+
+from emitter import floating, scalar, string, write_variable
+
+# ====================================================================
+# Columns are formatted as NumPy arrays of str objects, on which + and
+# comparisons work element by element without the overhead of pandas
+# string columns
+
+def scalars(col):
+    """Format a column as YAML flow scalars
+
+    :param col: pandas Series
+    :return: Array of str, '' where the value is missing
+    """
+    missing = col.isna().to_numpy()
+    values  = col.to_numpy()
+    if values.dtype.kind in 'iu':
+        ret = np.array(list(map(str,values.tolist())),dtype=object)
+    elif values.dtype.kind == 'b':
+        ret = np.where(values,'true','false').astype(object)
+    elif values.dtype.kind == 'f':
+        ret = np.array(list(map(floating,values.tolist())),dtype=object)
+    else:
+        # Format each distinct value once
+        codes, uniques = pd.factorize(values)
+        ret = np.array([scalar(u) for u in uniques]+[''],dtype=object)[codes]
+    ret[missing] = ''
+    return ret
+
+def texts(col,suffix=''):
+    """Format a column as YAML strings, with a suffix added
+
+    :return: Array of str, '' where the value is missing
+    """
+    missing = col.isna().to_numpy()
+    codes, uniques = pd.factorize(col.to_numpy())
+    ret = np.array([string(str(u).strip()+suffix) for u in uniques]+[''],
+                   dtype=object)[codes]
+    ret[missing] = ''
+    return ret
+
+def join(parts,n):
+    """Join arrays of ', key: value' parts (or '') into flow mappings"""
+    body = np.full(n,'',dtype=object)
+    for part in parts:
+        body = body+part
+    return np.array(['{'+b[2:]+'}' for b in body.tolist()],dtype=object)
+
+def where(cond,part):
+    """The part where cond holds, else ''"""
+    return np.where(cond,part,'')
+
+# --------------------------------------------------------------------
+def error_parts(df,error):
+    """Format one error of a variable
+
+    :param df: The DataFrame
+    :param error: Dictionary with a 'symerror' column, or 'plus' and
+                  'minus' columns, and optionally a 'label' and
+                  'percent'
+    :return: Array of ', {...}', or '' where there is no error
+    """
+    fmt   = ((lambda c: texts(c,'%')) if error.get('percent') else
+             scalars)
+    label = error.get('label')
+    label = ', label: '+string(label) if label is not None else ''
+
+    if 'symerror' in error:
+        sym = fmt(df[error['symerror']])
+        return where(sym != '',', {symerror: '+sym+label+'}')
+
+    plus, minus = df[error['plus']], df[error['minus']]
+    nplus  = pd.to_numeric(plus,errors='coerce').to_numpy(dtype=float)
+    nminus = pd.to_numeric(minus,errors='coerce').to_numpy(dtype=float)
+    plus, minus = fmt(plus), fmt(minus)
+    ret = np.where((nplus == -nminus) & (nplus > 0),
+                   ', {symerror: '+plus+label+'}',
+                   ', {asymerror: {plus: '+plus+', minus: '+minus+'}'+
+                   label+'}')
+    return where(((nplus != 0) | (nminus != 0)) &
+                 (plus != '') & (minus != ''),ret)
+
+def variable_rows(df,column):
+    """Format the values of a variable
+
+    :param df: The DataFrame
+    :param column: Dictionary of the columns of the variable: 'value',
+                   'low', 'high' and 'errors' (see error_parts), each
+                   optional
+    :return: Array of the values in flow style, with value '-' where
+             the value is missing
+    """
+    parts = []
+    if column.get('value') is not None:
+        text = scalars(df[column['value']])
+        parts.append(', value: '+np.where(text != '',text,string('-')))
+    for name in ('low','high'):
+        if column.get(name) is not None:
+            text = scalars(df[column[name]])
+            parts.append(where(text != '',', '+name+': '+text))
+    if column.get('errors'):
+        errors = np.full(len(df),'',dtype=object)
+        for e in column['errors']:
+            errors = errors+error_parts(df,e)
+        parts.append(where(errors != '',', errors: ['+
+                           np.array([e[2:] for e in errors.tolist()],
+                                    dtype=object)+']'))
+    return join(parts,len(df))
+
+# ====================================================================
+def frame_tables(df,columns,groupby=None):
+    """Format the rows of the tables of a DataFrame
+
+    :param df: The DataFrame
+    :param columns: Columns of each variable (see variable_rows),
+                    independent variables first
+    :param groupby: Column or list of columns with one table per
+                    distinct value, in order of first appearance, or
+                    None for one table
+    :return: Generator of (key, index, rows): the value(s) of the
+             grouping column(s), the positions of the rows of the table
+             in the DataFrame, and a list per variable of its values in
+             flow style
+    :raises ValueError: If a row has a missing value (NaN or None) of a
+                        grouping column, as it would be in no table
+    """
+    keys = [] if groupby is None else \
+        [groupby] if isinstance(groupby,str) else list(groupby)
+    missing = np.flatnonzero(df[keys].isna().any(axis=1).to_numpy())
+    if len(missing):
+        raise ValueError('{} rows have no value of {}, first at position {}'
+                         .format(len(missing),', '.join(map(str,keys)),
+                                 int(missing[0])))
+
+    rows = [variable_rows(df,c) for c in columns]
+    if groupby is None:
+        yield None, np.arange(len(df)), [r.tolist() for r in rows]
+        return
+
+    if len(keys) == 1:
+        codes, uniques = pd.factorize(df[keys[0]])
+        uniques = list(uniques)
+    else:
+        codes, uniques = pd.factorize(pd.MultiIndex.from_frame(df[keys]))
+        uniques = [tuple(u) for u in uniques]
+
+    # Positions of the rows of each group, in order, by one sort
+    order  = np.argsort(codes,kind='stable')
+    bounds = np.cumsum(np.bincount(codes,minlength=len(uniques)))
+    start  = 0
+    for key,end in zip(uniques,bounds):
+        index = order[start:end]
+        start = end
+        yield key, index, [r[index].tolist() for r in rows]
+
+def write_table(out,independent,dependent,rows):
+    """Write a data table of rows from frame_tables
+
+    :param out: Text stream
+    :param independent: Independent variables, with their header
+    :param dependent: Dependent variables, with their header and
+                      optionally qualifiers
+    :param rows: List per variable of its values in flow style,
+                 independent variables first
+    """
+    rows = iter(rows)
+    for key,variables in (('independent_variables',independent),
+                          ('dependent_variables',dependent)):
+        if not variables:
+            out.write(key+': []\n')
+            continue
+        out.write(key+':\n')
+        for var in variables:
+            write_variable(out,var,next(rows))
+
+# ====================================================================
+#
+# EOF
+#
@@ -0,0 +1,628 @@
+#!/usr/bin/env python3
+
+"""
+Columnar binary forms of data tables, for reading them back quickly.
+
+A data table (see docs/data_yaml.rst) is stored as a set of equally
+long arrays, one per field of the values of each variable, plus the
+rest of the table (headers, qualifiers, ...) as YAML text.  Variable k
+of the independent (i) or dependent (d) variables has the columns
+
+  ik.value, ik.low, ik.high      the value and bin edges of each row
+  ik.errors                      number of errors of each row, -1 if
+                                 the row has no errors
+  ik.eJ.type                     1 for symerror, 2 for asymerror as
+                                 error J of each row, 0 for none
+  ik.eJ.label, ik.eJ.plus,       label, symerror or plus, and minus of
+  ik.eJ.minus                    error J of each row
+  ik.keys                        order of the keys of each row and of
+                                 its errors (see key_order)
+
+where each of value, low, high, label, plus and minus is given as three
+arrays: FIELD.num (the number, also of strings like "5%"), FIELD.kind
+(one of KINDS) and FIELD.text (strings as given).  Pipelines can use
+the .num arrays directly; the other arrays make the conversion back to
+YAML lossless, down to the order of keys.  Rows that do not fit these
+columns are kept in the YAML text as they are.  The variables may have
+different numbers of rows: shorter ones are padded to the longest, and
+the real number of rows is kept with the rest of the table.
+
+The arrays are stored as NumPy .npz, or with pyarrow (if installed) as
+Parquet (.parquet) or Arrow IPC (.arrow) files.
+
+  ./interchange.py convert [-f FORMAT] [-o DIRECTORY] INPUT ...
+  ./interchange.py yaml [-o DIRECTORY] TABLE ...
+  ./interchange.py roundtrip [-f FORMAT] INPUT ...
+  ./interchange.py check
+
+convert stores the data tables of the inputs (data files, or
+submissions as accepted by validate.py) in FORMAT, yaml writes stored
+tables back as YAML, and roundtrip checks that converting gives back
+the same YAML as the original, exiting with 1 if not.  check does the
+same for the tables of CHECK_TABLES (missing values, asymmetric
+errors, qualifiers, ...), converted in memory and stored in each
+format (those needing pyarrow only if it is installed).
+
+Requires NumPy.
+"""
+import os
+import yaml
+
+import numpy as np
+
+from yamlbackend import get_backend, safe_dumper
+
+FORMATS = ['npz','parquet','arrow']
+
+# Kinds of cells
+ABSENT, FLOAT, INT, STR, NULL, BOOL, OTHER = range(7)
+KINDS = ['absent','float','int','str','null','bool','other']
+
+# Fields of a row, and of an error
+ROW_FIELDS   = ['value','low','high']
+ERROR_FIELDS = ['label','plus','minus']
+
+# Key of the rest of the table in the stored files
+META = '__meta__'
+
+# Letters of the keys of a row, of an error and of an asymerror, which
+# give the order of the keys of each row (see key_order)
+ROW_KEYS    = {'value': 'v', 'low': 'l', 'high': 'h', 'errors': 'e'}
+ERROR_KEYS  = {'label': 'l', 'symerror': 's', 'asymerror': 'a'}
+ASYM_KEYS   = {'plus': 'p', 'minus': 'm'}
+ROW_NAMES   = dict((v,k) for k,v in ROW_KEYS.items())
+ERROR_NAMES = dict((v,k) for k,v in ERROR_KEYS.items())
+ASYM_NAMES  = dict((v,k) for k,v in ASYM_KEYS.items())
+
+# ====================================================================
+def dump(obj):
+    """Dump as YAML the way the tables are compared, with the fastest
+    safe dumper, keeping the order of keys"""
+    return yaml.dump(obj,Dumper=safe_dumper(),sort_keys=False)
+
+def encode_cell(x):
+    """Encode a value of a table
+
+    :return: Tuple of number, kind and text
+    """
+    from columnar import number
+
+    if isinstance(x,bool):
+        return float(x), BOOL, ''
+    if x is None:
+        return np.nan, NULL, ''
+    if isinstance(x,int) and abs(x) < 2**53:
+        return float(x), INT, ''
+    if isinstance(x,float):
+        return x, FLOAT, ''
+    # NumPy strings drop trailing NUL characters
+    if isinstance(x,str) and not x.endswith('\0'):
+        return number(x)[0], STR, x
+    return np.nan, OTHER, dump(x)
+
+def decode_cell(num,kind,text):
+    """Decode a value of a table (see encode_cell)"""
+    if kind == FLOAT:
+        return float(num)
+    if kind == INT:
+        return int(num)
+    if kind == STR:
+        return str(text)
+    if kind == BOOL:
+        return bool(num)
+    if kind == NULL:
+        return None
+    return yaml.load(str(text),Loader=get_backend().event_loader())
+
+# --------------------------------------------------------------------
+def key_order(row):
+    """Encode the order of the keys of a regular row
+
+    :return: Letters of the keys of the row, then for each error a '|'
+             and the letters of its keys, those of an asymerror
+             following its 'a', e.g. 'vle|lapm'
+    """
+    ret = ''.join(ROW_KEYS[k] for k in row)
+    for e in row.get('errors',[]):
+        ret += '|'
+        for k in e:
+            ret += ERROR_KEYS[k]
+            if k == 'asymerror':
+                ret += ''.join(ASYM_KEYS[f] for f in e[k])
+    return ret
+
+def reorder(row,order):
+    """Put the keys of a decoded row in the order given by key_order"""
+    if not order:
+        return row
+    parts = order.split('|')
+    row   = ordered(row,[ROW_NAMES[c] for c in parts[0]])
+    for j,(e,keys) in enumerate(zip(row.get('errors',[]),parts[1:])):
+        e = ordered(e,[ERROR_NAMES[c] for c in keys if c in ERROR_NAMES])
+        if 'asymerror' in e:
+            e['asymerror'] = ordered(e['asymerror'],
+                                     [ASYM_NAMES[c] for c in keys
+                                      if c in ASYM_NAMES])
+        row['errors'][j] = e
+    return row
+
+def ordered(d,keys):
+    """Copy of a dictionary with the given keys first, in that order"""
+    ret = dict((k,d[k]) for k in keys if k in d)
+    ret.update(d)
+    return ret
+
+def regular(row):
+    """Check if a row of a variable fits the columns"""
+    if not isinstance(row,dict) or set(row)-set(ROW_FIELDS+['errors']):
+        return False
+    errors = row.get('errors',[])
+    if not isinstance(errors,list):
+        return False
+    for e in errors:
+        if not isinstance(e,dict) or set(e)-{'label','symerror','asymerror'}:
+            return False
+        if ('symerror' in e) == ('asymerror' in e):
+            return False
+        asym = e.get('asymerror',{})
+        if not isinstance(asym,dict) or set(asym)-{'plus','minus'}:
+            return False
+    return True
+
+class VariableEncoder:
+    """Collects the columns of the values of a variable"""
+
+    def __init__(self,prefix):
+        self.prefix = prefix
+        self.cells  = {}
+        self.types  = {}
+        self.errors = []
+        self.keys   = []
+        self.slots  = 0
+
+    def cell(self,field,row,x):
+        num, kind, text = encode_cell(x)
+        cells = self.cells.setdefault(field,{})
+        cells[row] = (num,kind,text)
+
+    def add(self,row,values):
+        """Add the values of a row
+
+        :return: False if the row does not fit the columns
+        """
+        if not regular(values):
+            self.errors.append(-1)
+            self.keys.append('')
+            return False
+        self.keys.append(key_order(values))
+        for field in ROW_FIELDS:
+            if field in values:
+                self.cell(field,row,values[field])
+
+        if 'errors' not in values:
+            self.errors.append(-1)
+            return True
+        self.errors.append(len(values['errors']))
+        self.slots = max(self.slots,len(values['errors']))
+        for j,e in enumerate(values['errors']):
+            pre = 'e{}.'.format(j)
+            self.types.setdefault(j,{})[row] = 1 if 'symerror' in e else 2
+            if 'label' in e:
+                self.cell(pre+'label',row,e['label'])
+            if 'symerror' in e:
+                self.cell(pre+'plus',row,e['symerror'])
+            else:
+                for f in ('plus','minus'):
+                    if f in e['asymerror']:
+                        self.cell(pre+f,row,e['asymerror'][f])
+        return True
+
+    def columns(self,n):
+        """The columns, padded to n rows"""
+        ret = {self.prefix+'errors':
+               np.array(self.errors+[-1]*(n-len(self.errors)),dtype=np.int32),
+               self.prefix+'keys':
+               np.array(self.keys+['']*(n-len(self.keys)),dtype=str)}
+        fields = (ROW_FIELDS+
+                  ['e{}.{}'.format(j,f) for j in range(self.slots)
+                   for f in ERROR_FIELDS])
+        for field in fields:
+            cells = self.cells.get(field,{})
+            num   = np.full(n,np.nan)
+            kind  = np.zeros(n,dtype=np.uint8)
+            text  = ['']*n
+            for row,(x,k,t) in cells.items():
+                num[row], kind[row], text[row] = x, k, t
+            name = self.prefix+field
+            ret[name+'.num']  = num
+            ret[name+'.kind'] = kind
+            ret[name+'.text'] = np.array(text,dtype=str)
+        for j in range(self.slots):
+            typ = np.zeros(n,dtype=np.uint8)
+            for row,t in self.types.get(j,{}).items():
+                typ[row] = t
+            ret['{}e{}.type'.format(self.prefix,j)] = typ
+        return ret
+
+# ====================================================================
+def variables(doc):
+    """The variables of a table with their column prefixes, or None if
+    the table does not have the usual structure"""
+    if not isinstance(doc,dict):
+        return None
+    ret = []
+    for key,short in (('independent_variables','i'),
+                      ('dependent_variables','d')):
+        vars = doc.get(key,[])
+        if not isinstance(vars,list):
+            return None
+        for k,var in enumerate(vars):
+            if not isinstance(var,dict):
+                return None
+            ret.append((key,k,'{}{}.'.format(short,k),var))
+    return ret
+
+def encode_table(doc):
+    """Convert a data table to columns
+
+    :param doc: Data table document
+    :return: Tuple of a dictionary of equally long arrays, and the rest
+             of the table as YAML text
+    """
+    vars = variables(doc)
+    if vars is None:
+        return {}, dump({'table': doc})
+
+    rest      = dict(doc)
+    overrides = {}
+    encoders  = []
+    n         = 0
+    for key,k,prefix,var in vars:
+        if not isinstance(var.get('values'),list):
+            continue
+        enc = VariableEncoder(prefix)
+        for row,values in enumerate(var['values']):
+            if not enc.add(row,values):
+                overrides.setdefault(prefix,{})[row] = values
+        encoders.append(enc)
+        n = max(n,len(var['values']))
+
+        # The rest of the variable, with the number of rows instead of
+        # the values
+        rest[key] = list(rest[key])
+        rest[key][k] = dict(var,values=len(var['values']))
+
+    columns = {}
+    for enc in encoders:
+        columns.update(enc.columns(n))
+    return columns, dump({'table': rest, 'overrides': overrides})
+
+def decode_table(columns,meta):
+    """Convert columns back to a data table (see encode_table)"""
+    meta      = yaml.load(meta,Loader=get_backend().event_loader())
+    doc       = meta['table']
+    overrides = meta.get('overrides') or {}
+    vars      = variables(doc)
+    if vars is None or not columns:
+        return doc
+
+    missing = object()
+    def cell(name,row):
+        kind = int(columns[name+'.kind'][row])
+        if kind == ABSENT:
+            return missing
+        return decode_cell(columns[name+'.num'][row],kind,
+                           columns[name+'.text'][row])
+
+    for key,k,prefix,var in vars:
+        if not isinstance(var.get('values'),int):
+            continue
+        values = []
+        for row in range(var['values']):
+            if row in overrides.get(prefix,{}):
+                values.append(overrides[prefix][row])
+                continue
+            val = {}
+            for field in ROW_FIELDS:
+                x = cell(prefix+field,row)
+                if x is not missing:
+                    val[field] = x
+            nerr = int(columns[prefix+'errors'][row])
+            if nerr >= 0:
+                val['errors'] = []
+            for j in range(nerr):
+                pre   = '{}e{}.'.format(prefix,j)
+                error = {}
+                label = cell(pre+'label',row)
+                if columns[pre+'type'][row] == 1:
+                    error['symerror'] = cell(pre+'plus',row)
+                else:
+                    error['asymerror'] = dict((f,x) for f,x in
+                                              (('plus',cell(pre+'plus',row)),
+                                               ('minus',cell(pre+'minus',row)))
+                                              if x is not missing)
+                if label is not missing:
+                    error['label'] = label
+                val['errors'].append(error)
+            values.append(reorder(val,str(columns[prefix+'keys'][row])))
+        doc[key][k] = dict(var,values=values)
+    return doc
+
+# ====================================================================
+def table_format(filename):
+    """Format of a stored table, from the file name"""
+    ext = os.path.splitext(filename)[1].lstrip('.').lower()
+    if ext not in FORMATS:
+        raise ValueError('Unknown table format {}, use one of {}'
+                         .format(ext or filename,', '.join(FORMATS)))
+    return ext
+
+def write_columns(filename,columns,meta):
+    """Store columns and the rest of a table
+
+    :param filename: Path ending in .npz, .parquet or .arrow
+    :param columns: Dictionary of equally long arrays
+    :param meta: Rest of the table as text
+    """
+    fmt = table_format(filename)
+    if fmt == 'npz':
+        np.savez_compressed(filename,**dict(columns,**{META: np.array(meta)}))
+        return
+
+    import pyarrow as pa
+    table = pa.table(dict((k,pa.array(v)) for k,v in columns.items()),
+                     metadata={META: meta.encode('utf-8')})
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table,filename)
+    else:
+        with pa.OSFile(filename,'wb') as out:
+            with pa.ipc.new_file(out,table.schema) as writer:
+                writer.write_table(table)
+
+def read_columns(filename):
+    """Read stored columns and the rest of a table
+
+    :param filename: Path ending in .npz, .parquet or .arrow
+    :return: Tuple of dictionary of arrays and the rest of the table
+             as text
+    """
+    fmt = table_format(filename)
+    if fmt == 'npz':
+        with np.load(filename,allow_pickle=False) as data:
+            columns = dict((k,data[k]) for k in data.files)
+        return columns, str(columns.pop(META))
+
+    import pyarrow as pa
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(filename)
+    else:
+        with pa.memory_map(filename,'r') as inp:
+            table = pa.ipc.open_file(inp).read_all()
+    columns = dict((name,table.column(name).to_numpy())
+                   for name in table.column_names)
+    return columns, table.schema.metadata[META.encode()].decode('utf-8')
+
+# --------------------------------------------------------------------
+def save_table(filename,doc):
+    """Store a data table in the format given by the file name"""
+    write_columns(filename,*encode_table(doc))
+
+def load_table(filename):
+    """Read a stored data table back as a document"""
+    return decode_table(*read_columns(filename))
+
+def roundtrip(doc,fmt='npz'):
+    """Check that a data table is stored losslessly
+
+    :param doc: Data table document
+    :param fmt: Format to store in
+    :return: True if the stored table gives back the same YAML
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp,'table.'+fmt)
+        save_table(filename,doc)
+        return dump(load_table(filename)) == dump(doc)
+
+# --------------------------------------------------------------------
+# Tables that must round trip, with the cells and rows that are hard
+# to store in columns
+CHECK_TABLES = {
+    'missing': {
+        'independent_variables': [
+            {'header': {'name': 'PT', 'units': 'GeV'},
+             'values': [{'low': 0.0, 'high': 1.0},
+                        {'value': 1.5},
+                        {'high': 3},
+                        {'value': None},
+                        {'value': '-'}]}],
+        'dependent_variables': [
+            {'header': {'name': 'SIG', 'units': 'pb'},
+             'values': [{'value': 1.0},
+                        {'value': '-'},
+                        {'value': None,'errors': []},
+                        {'errors': [{'symerror': 0.1}],'value': 2},
+                        {}]}]},
+    'errors': {
+        'dependent_variables': [
+            {'header': {'name': 'SIG'},
+             'qualifiers': [{'name': 'SQRT(S)', 'units': 'GeV',
+                             'value': 13000},
+                            {'name': 'RE', 'value': 'P P --> Z X'},
+                            {'name': 'ABS(ETA)', 'value': '< 2.5'}],
+             'values': [{'value': 1.0,
+                         'errors': [{'symerror': 0.1,'label': 'stat'},
+                                    {'asymerror': {'plus': 0.2,
+                                                   'minus': -0.3},
+                                     'label': 'sys'}]},
+                        {'value': '2.50',
+                         'errors': [{'label': 'stat','symerror': '5%'},
+                                    {'asymerror': {'minus': '-1.5%',
+                                                   'plus': '+2%'}}]},
+                        {'value': 3,
+                         'errors': [{'asymerror': {'plus': None,
+                                                   'minus': -0.1},
+                                     'label': 'sys'},
+                                    {'symerror': 0}]},
+                        {'value': 4.0,'errors': [{'symerror': True,
+                                                  'label': ''}]}]}],
+        'independent_variables': [
+            {'header': {'name': 'YRAP'},
+             'values': [{'value': 'central'},{'value': -0.5},
+                        {'low': -1,'high': 1.0},{'value': 1e300}]}]},
+    'lengths': {
+        'independent_variables': [
+            {'header': {'name': 'X'},
+             'values': [{'value': 1},{'value': 2},{'value': 3}]}],
+        'dependent_variables': [
+            {'header': {'name': 'Y'},'values': [{'value': 1}]},
+            {'header': {'name': 'Z'},'values': []}]},
+    'odd': {
+        'independent_variables': [
+            {'header': {'name': 'X'},
+             'values': [{'value': 1,'extra': 'kept'},
+                        {'value': [1,2]},
+                        5]}],
+        'dependent_variables': [
+            {'header': {'name': 'Y'},
+             'values': [{'value': 1.0,'errors': [{'symerror': 0.1,
+                                                  'note': 'kept'}]},
+                        {'value': 2.0,'errors': 'none'},
+                        {'value': {'nested': 1}}]}]},
+}
+
+def check_roundtrip(formats=None):
+    """Check that the tables of CHECK_TABLES round trip, converted in
+    memory and stored in each format
+
+    :param formats: Formats to store in, by default npz and, if pyarrow
+                    is installed, the others
+    :return: List of the conversions that do not, each described by a
+             string
+    """
+    if formats is None:
+        import importlib.util
+        formats = FORMATS if importlib.util.find_spec('pyarrow') else \
+            ['npz']
+
+    failed = []
+    for name,doc in CHECK_TABLES.items():
+        if dump(decode_table(*encode_table(doc))) != dump(doc):
+            failed.append('{} in memory'.format(name))
+        for fmt in formats:
+            if not roundtrip(doc,fmt):
+                failed.append('{} as {}'.format(name,fmt))
+    return failed
+
+# ====================================================================
+def data_files(path):
+    """The data files of an input
+
+    :param path: A data file, or a submission as accepted by
+                 archive.open_source
+    :return: Generator of (path, document) of the data files
+    """
+    from archive import LocalFiles, open_source
+
+    backend = get_backend()
+    if path.endswith(('.yaml','.yml','.json')) and \
+       os.path.basename(path) != 'submission.yaml':
+        with LocalFiles().open(path) as inp:
+            yield path, backend.load(inp)
+        return
+
+    files, submission = open_source(path)
+    if submission is None:
+        raise IOError('No submission.yaml found in {}'.format(path))
+    with files.open(submission) as inp:
+        docs = list(backend.load_all(inp))
+    for doc in docs:
+        if doc and 'data_file' in doc:
+            df = os.path.join(os.path.dirname(submission),doc['data_file'])
+            with files.open(df) as inp:
+                yield df, backend.load(inp)
+
+# ====================================================================
+if __name__ == "__main__":
+    import argparse as ap
+    import sys
+
+    from emitter import write_table
+
+    parser = ap.ArgumentParser(description="Convert data tables to and "
+                               "from columnar binary formats")
+    parser.add_argument('command',
+                        choices=['convert','yaml','roundtrip','check'],
+                        help='Store data tables, write stored tables as '
+                        'YAML, or check that storing is lossless (for '
+                        'the inputs, or for tables made to check it)')
+    parser.add_argument('inputs',
+                        nargs='*',
+                        help='Data files or submissions (convert, '
+                        'roundtrip), or stored tables (yaml)')
+    parser.add_argument('-f',
+                        '--format',
+                        default='npz',
+                        choices=FORMATS,
+                        help='Format to store in (Parquet and Arrow need '
+                        'pyarrow)')
+    parser.add_argument('-o',
+                        '--output',
+                        default='.',
+                        help='Directory to write to')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        failed = check_roundtrip()
+        for f in failed:
+            print('Does not round trip: {}'.format(f))
+        print('Checked {} tables: {} conversions failed'
+              .format(len(CHECK_TABLES),len(failed)))
+        sys.exit(1 if failed else 0)
+    if not args.inputs:
+        parser.error('{} needs inputs'.format(args.command))
+
+    needed = [table_format(p) for p in args.inputs] if args.command == 'yaml' \
+        else [args.format]
+    if set(needed)-{'npz'}:
+        import importlib.util
+        if importlib.util.find_spec('pyarrow') is None:
+            parser.error('Parquet and Arrow files need pyarrow')
+
+    def output(path,ext):
+        name = os.path.splitext(os.path.basename(path))[0]+'.'+ext
+        return os.path.join(args.output,name)
+
+    if args.command == 'yaml':
+        for path in args.inputs:
+            out = output(path,'yaml')
+            doc = load_table(path)
+            with open(out,'w') as stream:
+                if isinstance(doc,dict):
+                    write_table(stream,doc)
+                else:
+                    stream.write(dump(doc))
+            print('Wrote {}'.format(out))
+        sys.exit(0)
+
+    failed = 0
+    for inp in args.inputs:
+        for path,doc in data_files(inp):
+            if args.command == 'convert':
+                out = output(path,args.format)
+                save_table(out,doc)
+                print('Wrote {}'.format(out))
+            elif roundtrip(doc,args.format):
+                print('{} round trips'.format(path))
+            else:
+                print('{} does not round trip'.format(path))
+                failed += 1
+    sys.exit(1 if failed else 0)
+
+# ====================================================================
+#
+# EOF
+#
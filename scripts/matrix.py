@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+"""
+Correlation and covariance matrices stored as dense binary sidecars.
+
+In a HEPData data table an N x N matrix takes N*N rows: two
+independent variables giving the bins of the row and column, and one
+dependent variable giving the element (see write_correlation_table in
+examples/DESY-16-200).  For N in the thousands that is millions of
+values to write, parse and validate.  Here the matrix is kept instead
+as a NumPy .npy file, with a small JSON file next to it
+(MATRIX.npy -> MATRIX.json) holding everything else of the table:
+
+  {"bins":       [...],             labels of the rows and columns
+   "headers":    [{...}, {...}],    headers of the two independent
+                                    variables
+   "header":     {...},             header of the dependent variable
+   "qualifiers": [...]}             qualifiers of the dependent variable
+
+The checks of a matrix are whole-array operations, and the data table
+for upload is written row by row from the (memory mapped) sidecar.
+
+  ./matrix.py check [--covariance] MATRIX.npy|TABLE.yaml ...
+  ./matrix.py sidecar TABLE.yaml MATRIX.npy
+  ./matrix.py yaml MATRIX.npy TABLE.yaml
+
+Requires NumPy.
+"""
+import json
+import os
+
+import numpy as np
+
+from emitter import scalar, floating, write_variable
+
+# ====================================================================
+def meta_filename(filename):
+    """The JSON file of a sidecar, MATRIX.json for MATRIX.npy"""
+    return os.path.splitext(filename)[0]+'.json'
+
+def save_matrix(filename,matrix,meta=None):
+    """Store a matrix as a sidecar
+
+    :param filename: Path of the .npy file
+    :param matrix: Square matrix
+    :param meta: Rest of the table (see the module documentation), or
+                 None for bins 0 to N-1 and default headers
+    """
+    matrix = np.asarray(matrix,dtype=float)
+    np.save(filename,matrix)
+    meta = dict(meta or {})
+    meta.setdefault('bins',list(range(len(matrix))))
+    with open(meta_filename(filename),'w') as out:
+        json.dump(meta,out,indent=1)
+
+def load_matrix(filename,mmap=True):
+    """Read a matrix stored as a sidecar
+
+    :param filename: Path of the .npy file
+    :param mmap: Map the file to memory rather than reading it in
+    :return: Tuple of the matrix and the rest of the table
+    """
+    matrix = np.load(filename,mmap_mode='r' if mmap else None)
+    try:
+        with open(meta_filename(filename),'r') as inp:
+            meta = json.load(inp)
+    except (IOError,OSError):
+        meta = {}
+    meta.setdefault('bins',list(range(len(matrix))))
+    return matrix, meta
+
+# --------------------------------------------------------------------
+def bin_key(value):
+    """Label of a bin of an independent variable"""
+    if 'value' in value:
+        return value['value']
+    return [value.get('low'),value.get('high')]
+
+def matrix_from_table(doc):
+    """Convert a data table of a matrix to the dense matrix
+
+    :param doc: Data table with two independent variables (row and
+                column bins) and one dependent variable (the elements)
+    :return: Tuple of the matrix, NaN where an element is not given,
+             and the rest of the table
+    :raises ValueError: If the table is not of a matrix, or its rows
+                        and columns have different bins
+    """
+    from columnar import to_array
+
+    indep = doc.get('independent_variables') or []
+    dep   = doc.get('dependent_variables') or []
+    if len(indep) != 2 or len(dep) != 1:
+        raise ValueError('A matrix table has 2 independent and 1 dependent '
+                         'variables, not {} and {}'.format(len(indep),
+                                                          len(dep)))
+
+    # The bins of the rows and of the columns, in order of first
+    # appearance
+    axes = []
+    for var in indep:
+        keys  = [json.dumps(bin_key(v)) for v in var.get('values',[])]
+        index = {}
+        for k in keys:
+            index.setdefault(k,len(index))
+        axes.append((keys,index))
+    (rkeys,rows), (ckeys,cols) = axes
+    if set(rows) != set(cols):
+        raise ValueError('Rows and columns of a matrix table have '
+                         'different bins: {} rows, {} columns, {} in both'
+                         .format(len(rows),len(cols),
+                                 len(set(rows) & set(cols))))
+
+    # The columns in the order of the rows
+    bins  = [json.loads(k) for k in rows]
+    cells = [np.array([rows[k] for k in rkeys],dtype=int),
+             np.array([rows[k] for k in ckeys],dtype=int)]
+
+    values = dep[0].get('values',[])
+    if not (len(cells[0]) == len(cells[1]) == len(values)):
+        raise ValueError('Variables of a matrix table have different '
+                         'lengths')
+    elem, pct, text, bad = to_array([v.get('value') for v in values])
+
+    matrix = np.full((len(bins),len(bins)),np.nan)
+    matrix[cells[0],cells[1]] = elem
+    meta = {'bins':       bins,
+            'headers':    [v.get('header',{}) for v in indep],
+            'header':     dep[0].get('header',{}),
+            'qualifiers': dep[0].get('qualifiers',[])}
+    return matrix, meta
+
+# ====================================================================
+def check_matrix(matrix,covariance=False,tolerance=1e-6):
+    """Check a correlation or covariance matrix
+
+    The matrix must be square, complete and finite, and symmetric,
+    with no eigenvalue below -tolerance times the largest.  The
+    diagonal of a correlation matrix must be 1, and all elements
+    within [-1,1]; that of a covariance matrix must not be negative.
+
+    :param matrix: The matrix
+    :param covariance: Check as a covariance rather than a correlation
+                       matrix
+    :param tolerance: Allowed difference from the exact properties,
+                      relative to the largest element
+    :return: List of problems found
+    """
+    m = np.asarray(matrix,dtype=float)
+    if m.ndim != 2 or m.shape[0] != m.shape[1]:
+        return ['Matrix is not square but of shape {}'.format(m.shape)]
+    if m.size == 0:
+        # Nothing to check, and no largest element to scale by
+        return []
+
+    ret = []
+    bad = ~np.isfinite(m)
+    if bad.any():
+        ret.append('{} elements are missing or not finite, first at {}'
+                   .format(int(bad.sum()),cell(bad)))
+        return ret
+
+    scale = max(float(np.abs(m).max()),1.) * tolerance
+    asym  = np.abs(m-m.T) > scale
+    if asym.any():
+        ret.append('Matrix is not symmetric in {} elements, first at {}'
+                   .format(int(asym.sum())//2,cell(np.triu(asym))))
+
+    diag = np.diagonal(m)
+    if covariance:
+        neg = diag < -scale
+        if neg.any():
+            ret.append('Negative variance in {} rows, first in row {}'
+                       .format(int(neg.sum()),int(np.flatnonzero(neg)[0])))
+    else:
+        off = np.abs(diag-1) > tolerance
+        if off.any():
+            ret.append('Diagonal is not 1 in {} rows, first in row {}'
+                       .format(int(off.sum()),int(np.flatnonzero(off)[0])))
+        out = np.abs(m) > 1+tolerance
+        if out.any():
+            ret.append('{} elements are outside [-1,1], first at {}'
+                       .format(int(out.sum()),cell(out)))
+
+    # eigvalsh assumes a symmetric matrix, so is only used on one
+    if not asym.any():
+        eig = np.linalg.eigvalsh(m)
+        if eig[0] < -tolerance*max(abs(eig[-1]),1.):
+            ret.append('Matrix is not positive semi-definite, smallest '
+                       'eigenvalue {:.3g}'.format(eig[0]))
+    return ret
+
+def cell(mask):
+    """Row and column of the first set element of a mask"""
+    i, j = np.unravel_index(np.argmax(mask),mask.shape)
+    return 'row {}, column {}'.format(int(i),int(j))
+
+# ====================================================================
+def yaml_bin(value):
+    """Format a bin label, a value or [low, high], as a YAML flow
+    mapping"""
+    if isinstance(value,(list,tuple)):
+        return '{{low: {}, high: {}}}'.format(scalar(value[0]),
+                                              scalar(value[1]))
+    return '{{value: {}}}'.format(scalar(value))
+
+def write_table(out,matrix,meta):
+    """Write a matrix as a HEPData data table, one row of the matrix at
+    a time
+
+    The result reads back as the table written by yaml.dump, with the
+    bins of the row and column as the independent variables.
+
+    :param out: Text stream to write to
+    :param matrix: Square matrix, e.g. a memory mapped sidecar
+    :param meta: Rest of the table (see the module documentation)
+    """
+    n       = len(matrix)
+    bins    = [yaml_bin(b) for b in meta['bins']]
+    headers = meta.get('headers') or [{'name': 'Bin'},{'name': 'Bin'}]
+    dep     = {'header': meta.get('header') or
+               {'name': 'Correlation coefficient'}}
+    if meta.get('qualifiers'):
+        dep['qualifiers'] = meta['qualifiers']
+
+    def elements():
+        for i in range(n):
+            for x in np.asarray(matrix[i],dtype=float).tolist():
+                yield '{value: '+floating(x)+'}'
+
+    out.write('dependent_variables:\n')
+    write_variable(out,dep,elements())
+    out.write('independent_variables:\n')
+    write_variable(out,{'header': headers[0]},
+                   (b for b in bins for j in range(n)))
+    write_variable(out,{'header': headers[1]},
+                   (b for i in range(n) for b in bins))
+
+# ====================================================================
+if __name__ == "__main__":
+    import argparse as ap
+    import sys
+
+    from yamlbackend import get_backend
+
+    parser = ap.ArgumentParser(description="Check and convert correlation "
+                               "and covariance matrices")
+    parser.add_argument('command',
+                        choices=['check','sidecar','yaml'],
+                        help='Check matrices, store a data table as a '
+                        'sidecar, or write a sidecar as a data table')
+    parser.add_argument('inputs',
+                        nargs='+',
+                        help='Sidecars (.npy) or data tables (check), or '
+                        'the input and output file (sidecar, yaml)')
+    parser.add_argument('--covariance',
+                        action='store_true',
+                        help='Check as covariance rather than correlation '
+                        'matrices')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=1e-6,
+                        help='Allowed difference from exact properties')
+    args = parser.parse_args()
+
+    def read(filename):
+        if filename.endswith('.npy'):
+            return load_matrix(filename)
+        with open(filename,'r') as inp:
+            return matrix_from_table(get_backend().load(inp))
+
+    if args.command == 'check':
+        failed = False
+        for filename in args.inputs:
+            try:
+                problems = check_matrix(read(filename)[0],args.covariance,
+                                        args.tolerance)
+            except ValueError as e:
+                problems = [str(e)]
+            print('{} is {}'.format(filename,'invalid' if problems else
+                                    'valid'))
+            for p in problems:
+                print('\t'+p)
+            failed = failed or bool(problems)
+        sys.exit(1 if failed else 0)
+
+    if len(args.inputs) != 2:
+        parser.error('{} needs an input and an output file'
+                     .format(args.command))
+    matrix, meta = read(args.inputs[0])
+    if args.command == 'sidecar':
+        save_matrix(args.inputs[1],matrix,meta)
+    else:
+        with open(args.inputs[1],'w') as out:
+            write_table(out,matrix,meta)
+
+# ====================================================================
+#
+# EOF
+#
@@ -0,0 +1,105 @@
+"""
+Timing of the phases of a validation.
+
+The Validator reports a span for each phase of the work on a file or
+document to its observers (see Validator.add_observer):
+
+  file       validating a submission or data file, all included
+  parse      reading the YAML documents of a file
+  schema     checking a document against its schema
+  resources  looking for the additional resources of a document
+  data       validating a data file referenced from a submission
+  stream     validating a data file from its YAML event stream
+  semantic   checking the numbers of a data table (see columnar.py)
+
+Spans nest: the data span of a file contains its parse and schema
+spans, for example.  An observer is any object with a method
+
+  span(phase,name,start,duration,pid)
+
+where start is a time.perf_counter value and duration is in seconds.
+Profile is an observer that collects the spans and writes them as JSON
+or as a Chrome trace (for chrome://tracing or https://ui.perfetto.dev).
+"""
+import json
+
+PHASES = ['file','parse','schema','resources','data','stream','semantic']
+
+# ====================================================================
+class Profile:
+    """Collects the spans of a validation"""
+
+    def __init__(self):
+        self._spans = []
+
+    def span(self,phase,name,start,duration,pid):
+        self._spans.append((phase,name,start,duration,pid))
+
+    def spans(self):
+        """List of spans as (phase, name, start, duration, pid)"""
+        return list(self._spans)
+
+    def clear(self):
+        self._spans = []
+
+    def summary(self):
+        """Total time and number of spans of each phase
+
+        :return: Dictionary from phase to dictionary of count and
+                 seconds, in the order of PHASES
+        """
+        ret = {}
+        for phase,name,start,duration,pid in self._spans:
+            s = ret.setdefault(phase,{'count': 0, 'seconds': 0.})
+            s['count']   += 1
+            s['seconds'] += duration
+        order = dict((p,i) for i,p in enumerate(PHASES))
+        return dict(sorted(ret.items(),
+                           key=lambda i: order.get(i[0],len(order))))
+
+    def to_json(self):
+        """The spans as a JSON serialisable dictionary, with start times
+        relative to the first span"""
+        t0 = min((s[2] for s in self._spans),default=0)
+        return {'spans':   [{'phase': phase, 'name': name,
+                             'start': start-t0, 'duration': duration,
+                             'pid': pid}
+                            for phase,name,start,duration,pid in
+                            sorted(self._spans,key=lambda s: s[2])],
+                'summary': self.summary()}
+
+    def to_trace(self):
+        """The spans in the Chrome trace event format"""
+        t0 = min((s[2] for s in self._spans),default=0)
+        return {'traceEvents': [{'name': name, 'cat': phase, 'ph': 'X',
+                                 'ts': (start-t0)*1e6,
+                                 'dur': duration*1e6,
+                                 'pid': pid, 'tid': pid,
+                                 'args': {'phase': phase}}
+                                for phase,name,start,duration,pid in
+                                self._spans],
+                'displayTimeUnit': 'ms'}
+
+    def write(self,basename):
+        """Write the spans to basename.json and the Chrome trace to
+        basename.trace.json
+
+        :return: List of the files written
+        """
+        ret = []
+        for filename,obj in ((basename+'.json',self.to_json()),
+                             (basename+'.trace.json',self.to_trace())):
+            with open(filename,'w') as out:
+                json.dump(obj,out,indent=1)
+            ret.append(filename)
+        return ret
+
+    def print_summary(self):
+        for phase,s in self.summary().items():
+            print('  {:12s} {:6d} spans {:10.3f}s'
+                  .format(phase+':',s['count'],s['seconds']))
+
+# ====================================================================
+#
+# EOF
+#
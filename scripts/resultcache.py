@@ -0,0 +1,189 @@
+"""
+Persistent cache of validation results.
+
+The messages of a validated file are stored on disk under a key made
+from the path and content of the file and a tag describing everything else the
+result depends on (the schemas, the version of the validator and its
+options).  When the same file is validated again, the messages are
+read back instead of parsing and checking the file.
+
+The cache is bounded in size: when it grows beyond its limit, the
+least recently used entries are removed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+# ====================================================================
+def default_cache_dir():
+    """Default location of the cache"""
+    top = (os.environ.get('XDG_CACHE_HOME') or
+           os.path.join(os.path.expanduser('~'),'.cache'))
+    return os.path.join(top,'hepdata-validate')
+
+# --------------------------------------------------------------------
+def file_digest(filename,chunk=1<<20):
+    """Hash the content of a file
+
+    :param filename: Path to the file
+    :return: Hex digest, or None if the file cannot be read
+    """
+    h = hashlib.sha256()
+    try:
+        with open(filename,'rb') as inp:
+            for block in iter(lambda: inp.read(chunk),b''):
+                h.update(block)
+    except (IOError,OSError):
+        return None
+    return h.hexdigest()
+
+# --------------------------------------------------------------------
+def make_tag(*parts):
+    """Hash everything a validation result depends on, besides the file
+
+    :param parts: JSON serialisable objects (schemas, versions, options)
+    :return: Hex digest
+    """
+    return hashlib.sha256(json.dumps(parts,sort_keys=True)
+                          .encode('utf-8')).hexdigest()
+
+# ====================================================================
+class ResultCache:
+    """On-disk cache of the messages of validated files"""
+
+    def __init__(self,directory=None,max_size=64<<20):
+        """Create the cache
+
+        :param directory: Where to store the cache (see default_cache_dir)
+        :param max_size: Largest total size of the cache in bytes
+        """
+        self._dir  = directory or default_cache_dir()
+        self._max  = max_size
+        self._size = None
+
+    @property
+    def directory(self):
+        """Where the cache is stored"""
+        return self._dir
+
+    def key(self,filename,tag,files=None):
+        """Get the key of a file
+
+        :param filename: Path to the file
+        :param tag: Tag of the validation (see make_tag)
+        :param files: Where to read the file from (see archive.py), or
+                      None for the local file system
+        :return: The key, or None if the file cannot be read
+        """
+        digest = (file_digest(filename) if files is None else
+                  files.digest(filename))
+        if digest is None:
+            return None
+        # Messages name the file, so they only apply to the same path
+        return hashlib.sha256('\0'.join([digest,tag,filename])
+                              .encode('utf-8')).hexdigest()
+
+    def path(self,key):
+        return os.path.join(self._dir,key[:2],key+'.json')
+
+    def get(self,key):
+        """Look up the messages of a key
+
+        :param key: Key from ResultCache.key
+        :return: List of (level, message), or None if not cached
+        """
+        path = self.path(key)
+        try:
+            with open(path,'r') as inp:
+                ret = [tuple(m) for m in json.load(inp)]
+            # Mark as recently used
+            os.utime(path,None)
+            return ret
+        except (IOError,OSError,ValueError):
+            return None
+
+    def put(self,key,messages):
+        """Store the messages of a key
+
+        :param key: Key from ResultCache.key
+        :param messages: List of (level, message)
+        """
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix='.tmp')
+        except (IOError,OSError):
+            # A cache that cannot be written is not an error
+            return
+        try:
+            with os.fdopen(fd,'w') as out:
+                json.dump(messages,out)
+            os.replace(tmp,path)
+        except (IOError,OSError,TypeError,ValueError):
+            # Neither are messages that cannot be stored
+            return
+        finally:
+            # Left behind only if not stored, on any error
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        self.grow(os.path.getsize(path))
+
+    def remember(self,key,messages):
+        """Take note of messages stored by another process with the same
+        cache, e.g. a worker validating in a process pool: as the cache
+        is on disk, there is nothing to do"""
+
+    def entries(self):
+        """List cached entries as (last use, size, path)"""
+        ret = []
+        if not os.path.isdir(self._dir):
+            return ret
+        for sub in os.scandir(self._dir):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if e.name.endswith('.json'):
+                    st = e.stat()
+                    ret.append((st.st_mtime,st.st_size,e.path))
+        return ret
+
+    def grow(self,size):
+        """Account for a new entry, and evict old ones if too large"""
+        if self._size is None:
+            self._size = sum(e[1] for e in self.entries())
+        else:
+            self._size += size
+
+        if self._size > self._max:
+            self.prune()
+
+    def prune(self):
+        """Remove the least recently used entries, down to 3/4 of the
+        limit so that pruning does not happen on every store"""
+        entries    = sorted(self.entries())
+        self._size = sum(e[1] for e in entries)
+        for mtime,size,path in entries:
+            if self._size <= self._max*3//4:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all entries"""
+        for mtime,size,path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
+
+# ====================================================================
+#
+# EOF
+#
@@ -0,0 +1,174 @@
+"""
+Writing data tables row by row, without holding them in memory.
+
+A data table lists all the values of one variable before those of the
+next, while tables are usually produced a row (bin) at a time.  The
+TableWriter keeps the rows of each variable in a temporary file, in
+their final YAML form (see emitter.py), and joins them when closed:
+
+  with TableWriter('data1.yaml',
+                   independent=[{'header': {'name': 'PT', 'units': 'GeV'}}],
+                   dependent=[{'header': {'name': 'SIG', 'units': 'pb'},
+                               'qualifiers': [{'name': 'SQRT(S)',
+                                               'units': 'GeV',
+                                               'value': 13000}]}]) as w:
+      for low, high, sig, stat in bins:
+          w.append_row({'low': low, 'high': high},
+                       {'value': sig,
+                        'errors': [{'symerror': stat, 'label': 'stat'}]})
+
+A value given as a number or string rather than a dictionary is taken
+as {'value': ...}.  Values can also be added to one variable at a time
+with append_value.  On close, all variables must have the same number
+of rows (and as many as given as rows, if any); otherwise a ValueError
+is raised and nothing is written (a member of a zip archive is then
+left empty).
+
+The table is written to a file name, to an open text stream, or to a
+member of a zip archive (see zip_member).  A stream is flushed when the
+table is written, and also closed if the writer owns it, as it should
+for a member of a zip archive, which must be closed before the archive:
+
+  with zipfile.ZipFile('submission.zip','w') as z:
+      with TableWriter(zip_member(z,'data1.yaml'),independent,dependent,
+                       owns=True) as w:
+          ...
+"""
+import io
+import tempfile
+
+from emitter import flow, write_variable
+
+# ====================================================================
+class TableWriter:
+    """Writes a data table a row at a time"""
+
+    def __init__(self,out,independent=(),dependent=(),rows=None,
+                 owns=False):
+        """Start a table
+
+        :param out: File name or text stream to write the table to
+        :param independent: Independent variables, with their header
+        :param dependent: Dependent variables, with their header and
+                          optionally qualifiers
+        :param rows: Number of rows the table must have, or None
+        :param owns: Close the stream when the table is closed or
+                     discarded
+        """
+        self._out       = out
+        self._owns      = owns and not isinstance(out,str)
+        self._variables = ([dict(v) for v in independent],
+                           [dict(v) for v in dependent])
+        self._spools    = [tempfile.TemporaryFile('w+',encoding='utf-8')
+                           for v in self._variables[0]+self._variables[1]]
+        self._counts    = [0]*len(self._spools)
+        self._rows      = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc,tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def counts(self):
+        """Number of values of each variable, independent first"""
+        return list(self._counts)
+
+    def append_value(self,index,value):
+        """Add a value to one variable
+
+        :param index: Index of the variable, counting the independent
+                      variables first
+        :param value: Value dictionary, or the value itself
+        """
+        if self._spools is None:
+            raise ValueError('Table is already closed')
+        if not isinstance(value,dict):
+            value = {'value': value}
+        self._spools[index].write(flow(value)+'\n')
+        self._counts[index] += 1
+
+    def append_row(self,*values):
+        """Add a row, one value per variable, independent first"""
+        if len(values) != len(self._counts):
+            raise ValueError('Row has {} values, but the table has {} '
+                             'variables'.format(len(values),
+                                                len(self._counts)))
+        for i,value in enumerate(values):
+            self.append_value(i,value)
+
+    def check(self):
+        """Check the number of rows of the variables
+
+        :raises ValueError: If variables have different numbers of rows,
+                            or not as many as given
+        """
+        counts = set(self._counts)
+        if len(counts) > 1:
+            raise ValueError('Variables have different numbers of rows: {}'
+                             .format(self._counts))
+        if self._rows is not None and counts and counts != {self._rows}:
+            raise ValueError('Table has {} rows, not {}'
+                             .format(counts.pop(),self._rows))
+
+    def close(self):
+        """Check the row counts, and write the table"""
+        if self._spools is None:
+            raise ValueError('Table is already closed')
+        try:
+            self.check()
+            if isinstance(self._out,str):
+                with open(self._out,'w') as out:
+                    self.write(out)
+            else:
+                self.write(self._out)
+                self._out.flush()
+        finally:
+            self.discard()
+
+    def write(self,out):
+        spools = iter(self._spools)
+        for key,variables in zip(('independent_variables',
+                                  'dependent_variables'),self._variables):
+            if not variables:
+                out.write(key+': []\n')
+                continue
+            out.write(key+':\n')
+            for var in variables:
+                spool = next(spools)
+                spool.seek(0)
+                write_variable(out,var,(line[:-1] for line in spool))
+
+    def discard(self):
+        """Drop the table without writing it (the rest of it, if it is
+        being written), closing the stream if the writer owns it"""
+        for spool in self._spools or []:
+            spool.close()
+        self._spools = None
+        if self._owns:
+            self._owns = False
+            self._out.close()
+
+# ====================================================================
+def zip_member(archive,name):
+    """Open a member of a zip archive for writing text
+
+    The member is compressed as it is written, so that the table need
+    not be held in memory or on disk as a whole.
+
+    :param archive: zipfile.ZipFile opened for writing
+    :param name: Name of the member
+    :return: Text stream, to close before the archive (e.g. by a
+             TableWriter owning it)
+    """
+    return io.TextIOWrapper(archive.open(name,'w',force_zip64=True),
+                            encoding='utf-8')
+
+# ====================================================================
+#
+# EOF
+#
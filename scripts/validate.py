@@ -16,10 +16,196 @@ Author: Christian Holm Christensen <cholm@nbi.dk>
 """
 import yaml
 import json
-import jsonschema
 import os
-import importlib
-from pprint import pprint,pformat
+import sys
+import time
+import errno
+import itertools
+from contextlib import contextmanager, nullcontext
+from yamlbackend import get_backend, available_backends
+from resultcache import ResultCache, make_tag, default_cache_dir
+from archive import LocalFiles, FileIndex, ArchiveError, open_source
+from datastream import json_path, preview
+
+# jsonschema, NumPy and the hepdata_validator package are only imported
+# when needed, as importing them takes longer than validating a small
+# submission (see "benchmark.py startup")
+
+# ====================================================================
+def format_checker(formats=None):
+    """Create a format checker for schema validation
+
+    Checking "format" keywords is the most expensive part of schema
+    validation and is switched off by default, as it is in
+    jsonschema.validate.
+
+    :param formats: None to disable format checks, 'all' to check
+                    every format known to jsonschema, or a list of
+                    format names to check
+    :return: A jsonschema.FormatChecker or None
+    """
+    if formats is None:
+        return None
+
+    import jsonschema
+    if formats == 'all':
+        return jsonschema.FormatChecker()
+    return jsonschema.FormatChecker(formats)
+
+# --------------------------------------------------------------------
+def schema_store(schemadir):
+    """Load all schemas in a directory, keyed by their identifier
+
+    The identifier is the "$id" of the schema, or the file URI if the
+    schema has none.  This allows references between schemas (e.g. to
+    additional_resources_schema.json) to be resolved without network
+    access.
+
+    :param schemadir: Directory containing JSON schema files
+    :return: Dictionary from identifier to schema
+    """
+    store = {}
+    for name in sorted(os.listdir(schemadir)):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.abspath(os.path.join(schemadir,name))
+        with open(path,'r') as inp:
+            schema = json.load(inp)
+        store[schema.get('$id','file://'+path)] = schema
+        store['file://'+path] = schema
+    return store
+
+# --------------------------------------------------------------------
+def compile_schema(schema,store,checker=None):
+    """Create a reusable validator for a schema
+
+    The schema itself is checked once here, rather than for every
+    document as jsonschema.validate does.
+
+    :param schema: The JSON schema
+    :param store: Schemas to resolve references against (see schema_store)
+    :param checker: Format checker (see format_checker)
+    :return: A jsonschema validator instance
+    """
+    import jsonschema
+    from jsonschema.validators import validator_for
+
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    try:
+        from referencing import Registry, Resource
+        from referencing.jsonschema import specification_with
+        spec     = specification_with(cls.META_SCHEMA['$schema'])
+        registry = Registry().with_resources(
+            [(uri,Resource.from_contents(s,default_specification=spec))
+             for uri,s in store.items()])
+        return cls(schema,registry=registry,format_checker=checker)
+    except ImportError:
+        # Older jsonschema without the referencing library
+        resolver = jsonschema.RefResolver.from_schema(schema,store=store)
+        return cls(schema,resolver=resolver,format_checker=checker)
+
+# --------------------------------------------------------------------
+def schema_location(directory=None):
+    """Find the newest schemas of the hepdata_validator package
+
+    The package is located without importing it.  The location can be
+    remembered in a directory for later runs, together with the
+    version and modification time of the package, so that it is looked
+    up again when the package is upgraded or replaced.
+
+    :param directory: Directory to remember the location in, e.g. that
+                      of the result cache, or None to not remember it
+    :return: Directory of the schemas, or None if not found
+    """
+    import importlib.util
+    spec = importlib.util.find_spec('hepdata_validator')
+    if spec is None or spec.origin is None:
+        return None
+    try:
+        mtime = os.stat(spec.origin).st_mtime_ns
+    except OSError:
+        return None
+    stamp = [spec.origin,mtime,package_version(os.path.dirname(spec.origin))]
+
+    record = None if directory is None else \
+        os.path.join(directory,'schema-location.json')
+    known  = {}
+    try:
+        if record is not None:
+            with open(record,'r') as inp:
+                known = json.load(inp)
+    except (IOError,OSError,ValueError):
+        pass
+
+    # Per interpreter, as each may have another hepdata_validator
+    entry = known.get(sys.executable)
+    if isinstance(entry,dict) and entry.get('package') == stamp:
+        ret = entry.get('schemas')
+        if ret and os.path.isfile(os.path.join(ret,'submission_schema.json')):
+            return ret
+
+    top = os.path.join(os.path.dirname(spec.origin),'schemas')
+    def version(name):
+        try:
+            return tuple(int(v) for v in name.split('.'))
+        except ValueError:
+            return ()
+    dirs = [top]+[os.path.join(top,d) for d in
+                  sorted(os.listdir(top) if os.path.isdir(top) else [],
+                         key=version)
+                  if version(d)]
+    dirs = [d for d in dirs
+            if os.path.isfile(os.path.join(d,'submission_schema.json'))]
+    if not dirs:
+        return None
+
+    ret = dirs[-1]
+    if record is None:
+        return ret
+    known[sys.executable] = {'package': stamp, 'schemas': ret}
+    try:
+        os.makedirs(os.path.dirname(record),exist_ok=True)
+        with open(record,'w') as out:
+            json.dump(known,out)
+    except (IOError,OSError):
+        pass
+    return ret
+
+def package_version(top):
+    """Version of the hepdata_validator package, read from its
+    version.py rather than by importing the package
+
+    :param top: Directory of the package
+    :return: The __version__ string, or None if not found
+    """
+    import re
+    try:
+        with open(os.path.join(top,'version.py'),'r') as inp:
+            m = re.search(r"""__version__\s*=\s*['"]([^'"]+)['"]""",
+                          inp.read())
+    except (IOError,OSError):
+        return None
+    return m.group(1) if m else None
+
+# --------------------------------------------------------------------
+# Modules whose code the messages of a validated file depend on
+VALIDATION_MODULES = ('validate.py','datastream.py','columnar.py',
+                      'archive.py','yamlbackend.py')
+
+def validator_version():
+    """Version of the validator, as a hash of the code checking files
+    (see VALIDATION_MODULES)
+
+    Used to invalidate cached results when the validator changes.
+    """
+    import hashlib
+    h    = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in VALIDATION_MODULES:
+        with open(os.path.join(here,name),'rb') as inp:
+            h.update(inp.read())
+    return h.hexdigest()
 
 # ====================================================================
 class Message:
@@ -27,13 +213,13 @@ class Message:
     ERROR = 2
     WARNING = 1
     INFO = 0
+    __slots__ = ('_file','_level','_message')
     
     def __init__(self,filename='',message='',level=None):
         """Create a message for a file and a specific severity level"""
         self._file    = filename
         self._level   = level
         self._message = message
-        self._tables  = {}
         if self._level is None:
             self._level = self.ERROR
 
@@ -50,65 +236,257 @@ class Message:
         return "{:10s} - {}".format(Message.levelStr(self._level),
                                     self._message)
 
+# --------------------------------------------------------------------
+class JsonLinesSink:
+    """Writes messages as JSON lines as soon as they are added (see the
+    sink argument of Validator)"""
+
+    def __init__(self,out,least=Message.INFO):
+        """Create sink
+
+        :param out: File to write to
+        :param least: Least level of messages to write
+        """
+        self._out   = out
+        self._least = least
+
+    def __call__(self,m):
+        if m._level < self._least:
+            return
+        self._out.write(json.dumps({'file':    m._file,
+                                    'level':   Message.levelStr(m._level),
+                                    'message': m._message})+'\n')
+        self._out.flush()
+
+# --------------------------------------------------------------------
+class SchemaErrors(Exception):
+    """A document does not match its schema, and the errors have been
+    reported"""
+    pass
+
 # ====================================================================
 class Validator:
     """Validates HepData files"""
 
-    def __init__(self,schemadir):
+    def __init__(self,schemadir,formats=None,jobs=1,stream=False,
+                 max_errors=10,backend=None,cache=None,files=None,
+                 semantic=True,sink=None,keep=True):
+        """Create validator
+
+        :param schemadir: Location of schema files, or None to use those
+                          of the hepdata_validator package
+        :param formats: Formats to check (see format_checker)
+        :param jobs: Number of processes used to validate data files
+        :param stream: Validate data files from the YAML event stream,
+                       without reading in the whole file
+        :param max_errors: Most schema errors reported per file
+        :param backend: Name of the YAML parser backend, or None for the
+                        fastest available (see yamlbackend)
+        :param cache: ResultCache to reuse the results of unchanged data
+                      files from, or None to always validate them
+        :param files: Where to read files from (see archive.py)
+        :param semantic: Check the numbers of data tables, if NumPy is
+                         available (see columnar.py)
+        :param sink: Callable given each Message as it is added, e.g.
+                     a JsonLinesSink
+        :param keep: Keep the messages to get or print them later.  If
+                     false, only the number of messages of each file and
+                     level is kept, and messages only go to the sink.
+        """
         if schemadir is None:
-            spec = importlib.util.find_spec('hepdata_validator')
-            pprint(spec)
-            schemadir = os.path.join(os.path.dirname(spec.origin), 'schemas')
-            print(schemadir)
-            
+            schemadir = schema_location(getattr(cache,'directory',None))
+            if schemadir is None:
+                raise RuntimeError('No schemas given, and the '
+                                   'hepdata_validator package was not found')
+
         sub_schema_file = os.path.join(schemadir,'submission_schema.json')
         dat_schema_file = os.path.join(schemadir,'data_schema.json')
         add_schema_file = os.path.join(schemadir,'additional_info_schema.json')
         
-        self._messages = {}
-        self._tables = {}
+        self._messages  = {}
+        self._counts    = {}
+        self._totals    = [0,0,0]
+        self._sink      = sink
+        self._keep      = keep
+        self._capture   = {}
+        self._stored    = None
+        self._tables    = {}
+        self._datafiles = {}
+        self._schemadir = schemadir
+        self._formats   = formats
+        self._jobs      = jobs
+        self._stream    = stream
+        self._maxerrors = max_errors
+        self._backend   = get_backend(backend)
+        self._cache     = cache
+        self._files     = files or LocalFiles()
+        self._deferred  = None
+        self._index     = None
+        self._used      = {}
+        self._errcount  = {}
+        self._semantic  = semantic and self.have_numpy()
+        self._checks    = None
+        self._pool      = None
+        self._pending   = None
+        self._observers = []
         try:
             self._sub_schema = json.load(open(sub_schema_file,'r'))
             self._dat_schema = json.load(open(dat_schema_file,'r'))
             self._add_schema = json.load(open(add_schema_file,'r'))
+
+            self._store = schema_store(schemadir)
         except Exception as e:
             raise RuntimeError('Failed to load one or more schemas: {}',e)
 
+        # The validators are built on first use, and then reused for
+        # all documents
+        self._compiled = {}
+
+        # Everything but the file itself that a result depends on
+        if self._cache is not None:
+            self._cachetag = make_tag(validator_version(),self._store,
+                                      formats,stream,max_errors,
+                                      bool(self._semantic),
+                                      self._backend.name)
+
+    def compiled(self,schema):
+        """Get the validator of a schema, building it on first use
+
+        :param schema: One of the loaded schemas
+        :return: The jsonschema validator
+        """
+        key = id(schema)
+        if key not in self._compiled:
+            try:
+                self._compiled[key] = compile_schema(schema,self._store,
+                                                     format_checker(
+                                                         self._formats))
+            except Exception as e:
+                raise RuntimeError('Failed to compile schema: {}'.format(e))
+        return self._compiled[key]
+
+    @property
+    def _sub_validator(self):
+        return self.compiled(self._sub_schema)
+
+    @property
+    def _dat_validator(self):
+        return self.compiled(self._dat_schema)
+
+    @property
+    def _add_validator(self):
+        return self.compiled(self._add_schema)
+
+    @staticmethod
+    def have_numpy():
+        """Check if NumPy is installed, without importing it"""
+        import importlib.util
+        return importlib.util.find_spec('numpy') is not None
+
+    def load_semantic(self):
+        """Get the semantic checks of data tables, importing NumPy on
+        first use
+
+        :return: The check function
+        """
+        if self._checks is None:
+            from columnar import semantic_checks
+            self._checks = semantic_checks
+        return self._checks
+
+    def add_observer(self,observer):
+        """Report the timing of each phase of the validation to an
+        observer (see profiling.py)
+
+        :param observer: Object with the method
+                         span(phase,name,start,duration,pid)
+        """
+        self._observers.append(observer)
+
+    @contextmanager
+    def span(self,phase,name):
+        """Time a phase of the validation for the observers
+
+        :param phase: Phase, e.g. 'parse' or 'schema'
+        :param name: What is worked on, e.g. the file name
+        """
+        if not self._observers:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            for o in self._observers:
+                o.span(phase,name,start,duration,os.getpid())
+
     def ensure_messages(self,filename):
-        if filename not in self._messages:
+        """Get the messages of a file, making a place for them
+
+        The order in which files get a place is the order in which they
+        are printed.
+        """
+        if filename not in self._counts:
             self._messages[filename] = []
+            self._counts[filename]   = [0,0,0]
 
         return self._messages[filename]
-        
-    def add_error(self,filename,message):
+
+    def add_message(self,filename,message,level):
         """Add a message to the output
 
         :param filename: Current filename
         :param message: Content of the message 
         :param level: Severity of the message 
         """
-        self.ensure_messages(filename)\
-            .append(Message(filename,message,Message.ERROR))
+        msgs = self.ensure_messages(filename)
+        self._counts[filename][level] += 1
+        self._totals[level]           += 1
 
-    def add_warning(self,filename,message):
-        """Add a message to the output
+        m = Message(filename,message,level)
+        if self._keep:
+            msgs.append(m)
+        if self._sink is not None:
+            self._sink(m)
+        if filename in self._capture:
+            self._capture[filename].append((level,message))
 
-        :param filename: Current filename
-        :param message: Content of the message 
-        :param level: Severity of the message 
-        """
-        self.ensure_messages(filename)\
-            .append(Message(filename,message,Message.WARNING))
+    def add_error(self,filename,message):
+        """Add an error to the output"""
+        self.add_message(filename,message,Message.ERROR)
+
+    def add_warning(self,filename,message):
+        """Add a warning to the output"""
+        self.add_message(filename,message,Message.WARNING)
         
     def add_info(self,filename,message):
-        """Add a message to the output
+        """Add an informational message to the output"""
+        self.add_message(filename,message,Message.INFO)
 
-        :param filename: Current filename
-        :param message: Content of the message 
-        :param level: Severity of the message 
+    def count_messages(self,filename=None,level=None):
+        """Count messages, without looking at them
+
+        :param filename: File to count for, or None for all
+        :param level: Level to count, or None for all
         """
-        self.ensure_messages(filename)\
-            .append(Message(filename,message,Message.INFO))
+        counts = self._totals if filename is None else \
+            self._counts.get(filename,[0,0,0])
+        return sum(counts) if level is None else counts[level]
+
+    def remove_messages(self,filename,keep_place=False):
+        """Forget the messages of a file
+
+        :param filename: The file
+        :param keep_place: Keep the place of the file in the order
+        """
+        counts = self._counts.pop(filename,[0,0,0])
+        for level,n in enumerate(counts):
+            self._totals[level] -= n
+        self._messages.pop(filename,None)
+        if keep_place:
+            self.ensure_messages(filename)
 
     def filter_messages(self,filename,least,exact=False):
         return [m for m in self.ensure_messages(filename)
@@ -137,26 +515,35 @@ class Validator:
     def clear_messages(self):
         """Reset messages"""
         self._messages = {}
+        self._counts   = {}
+        self._totals   = [0,0,0]
+
+    def reset(self,files=None):
+        """Forget the messages and tables found so far, to validate
+        another submission with the same schemas
+
+        :param files: Where to read the files of the next submission
+                      from (see archive.py), or None to keep reading
+                      them from where the last one was read
+        """
+        self.clear_messages()
+        self._tables    = {}
+        self._datafiles = {}
+        self._files     = files or self._files
 
     def has_errors(self,filename=None):
         """Check if a file has errors 
         
         :param filename: File to check for or all if None
         """
-        if filename is None:
-            for f in self._messages:
-                if self.has_errors(f):
-                    return True
-            return False
-        
-        return len(self.get_messages(filename,Message.ERROR,exact=True)) > 0
+        return self.count_messages(filename,Message.ERROR) > 0
 
-    def has_warnings(self,filename):
-        """Check if a file has errors 
+    def has_warnings(self,filename=None):
+        """Check if a file has warnings
         
-        :param filename: File to check for 
+        :param filename: File to check for or all if None
         """
-        return len(self.get_messages(filename,Message.WARNING,exact=True)) > 0
+        return self.count_messages(filename,Message.WARNING) > 0
 
     def print_messages(self,filename=None,least=Message.INFO):
         """Print all errors associated with a file 
@@ -182,7 +569,7 @@ class Validator:
         if least > Message.INFO:
             return
         
-        for f in self._messages:
+        for f in self._counts:
             print('{}'.format(f),end='')
 
             e = self.has_errors(f)
@@ -198,6 +585,220 @@ class Validator:
     def validate(self,**kwargs):
         """Validate a submission or data file 
 
+        If more than one job was requested, data files referenced from
+        the submission are validated in a process pool, and their
+        messages merged back in the order a serial run would give.
+
+        Data files in archives that can only be read sequentially are
+        validated after the submission, in one pass over the archive.
+
+        The directory of the file is listed once, and referenced files
+        are looked up in that listing.  Files of the directory that a
+        submission does not reference are reported.
+
+        :param file_path: Path to file to check 
+        :param data: YAML document already read
+        :return: True on success 
+        """
+        if self._deferred is not None:
+            # Validating a file referenced from the submission
+            return self.validate_file(**kwargs)
+
+        verb           = kwargs.get('verbose',False)
+        filename       = kwargs.get('file_path')
+        self._pending  = []
+        self._deferred = []
+        self._used     = {}
+        if filename is not None:
+            self._index = FileIndex(self._files,os.path.dirname(filename))
+        try:
+            with self.worker_pool() as pool:
+                self._pool = pool
+                ret = self.validate_file(**kwargs)
+                self.merge_pending()
+
+            self.scan_deferred(verb)
+            self.check_unreferenced(filename)
+        finally:
+            self._pool     = None
+            self._pending  = None
+            self._deferred = None
+            self._index    = None
+
+        return ret and not self.has_errors()
+
+    def worker_pool(self):
+        """Process pool to validate data files in, if more than one job
+        was requested and the files can be read in any order
+
+        :return: Context manager giving the pool, or None
+        """
+        if self._jobs <= 1 or self._files.sequential:
+            return nullcontext()
+
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=self._jobs,
+                                   initializer=_init_worker,
+                                   initargs=(self._schemadir,
+                                             self._formats,
+                                             self._stream,
+                                             self._maxerrors,
+                                             self._backend.name,
+                                             self._cache,
+                                             self._files,
+                                             bool(self._semantic),
+                                             bool(self._observers)))
+
+    def validate_again(self,filenames,verb=False):
+        """Validate data files of the validated submission again, e.g.
+        after they changed
+
+        The files are validated as in a run over the whole submission
+        (in one process pool, or in one pass over a sequential
+        archive), and their old messages replaced.
+
+        :param filenames: Paths of the data files
+        """
+        self._pending  = []
+        self._deferred = []
+        try:
+            with self.worker_pool() as pool:
+                self._pool = pool
+                for rdf in filenames:
+                    self.remove_messages(rdf,True)
+                    if self._files.sequential:
+                        self.ensure_messages(rdf)
+                        self._deferred.append(rdf)
+                    elif pool is not None:
+                        self.ensure_messages(rdf)
+                        self._pending.append((rdf,
+                                              pool.submit(_validate_worker,
+                                                          rdf)))
+                    else:
+                        self.validate_data(rdf,verb)
+                self.merge_pending()
+
+            self.scan_deferred(verb)
+        finally:
+            self._pool     = None
+            self._pending  = None
+            self._deferred = None
+
+    def isfile(self,path):
+        """Check if a referenced file exists, using the index of the
+        submission directory when validating a submission"""
+        if self._index is None:
+            return self._files.isfile(path)
+        return self._index.isfile(path)
+
+    def not_found(self,path):
+        """Explain a referenced file that does not exist
+
+        :return: Text to add to the message, naming a file that differs
+                 only in case if there is one
+        """
+        match = None if self._index is None else self._index.case_match(path)
+        if match is None:
+            return ''
+        return ', but {} differs only in case'.format(match)
+
+    def mark_referenced(self,filename,doc):
+        """Mark the files a document refers to as referenced, even if
+        the document turns out to be invalid"""
+        if self._index is None or not isinstance(doc,dict):
+            return
+        top  = os.path.dirname(filename)
+        refs = [doc.get('data_file')]
+        for resource in doc.get('additional_resources') or []:
+            if isinstance(resource,dict):
+                refs.append(resource.get('location'))
+        for ref in refs:
+            if isinstance(ref,str) and ref:
+                self._index.reference(os.path.join(top,ref))
+
+    def check_unreferenced(self,filename):
+        """Warn about files next to a submission.yaml that it does not
+        reference"""
+        if (self._index is None or filename is None or
+            os.path.basename(filename) != 'submission.yaml'):
+            return
+        for name in self._index.unreferenced([os.path.basename(filename)]):
+            if name.startswith('.'):
+                continue
+            self.add_warning(filename,'File {} is not referenced from the '
+                             'submission'.format(name))
+
+    def scan_deferred(self,verb):
+        """Validate the data files of a sequential archive in one pass
+
+        A slot in the messages was reserved for each data file when it
+        was deferred, so the order of files is the same as when reading
+        them one by one.  Each data file is deferred only once.
+        """
+        if not self._deferred:
+            return
+
+        left = set(self._deferred)
+        try:
+            for rdf,stream in self._files.scan(self._deferred):
+                if rdf in left:
+                    self.validate_data(rdf,verb,stream)
+                    left.discard(rdf)
+        except ArchiveError as e:
+            # The rest of the archive cannot be read
+            for rdf in self._deferred:
+                if rdf in left:
+                    self.add_error(rdf,str(e))
+            left = set()
+
+        # Not in the archive: report as when reading them one by one
+        for rdf in self._deferred:
+            if rdf in left:
+                self.validate_data(rdf,verb)
+
+        for rdf in self._deferred:
+            if rdf in self._counts and not self.count_messages(rdf):
+                self.remove_messages(rdf)
+
+        self._deferred = []
+
+    def merge_pending(self):
+        """Merge messages of data files validated in the process pool
+
+        The pending results are merged in submission order.  A slot in
+        the messages was reserved for each data file when it was
+        submitted, so the order of files is the same as in a serial run.
+        Results the workers stored in their copy of the cache are
+        remembered in this one, e.g. for the next round of watching.
+        """
+        for rdf,future in self._pending:
+            try:
+                messages, spans, stored = future.result()
+            except Exception as e:
+                self.add_error(rdf,str(e))
+                continue
+
+            for span in spans:
+                for o in self._observers:
+                    o.span(*span)
+
+            for key,msgs in stored:
+                self._cache.remember(key,msgs)
+
+            for f,msgs in messages.items():
+                self.ensure_messages(f)
+                for m in msgs:
+                    self.add_message(f,m._message,m._level)
+
+            if rdf in self._counts and not self.count_messages(rdf):
+                # Nothing to report, as in a serial run
+                self.remove_messages(rdf)
+
+        self._pending = []
+
+    def validate_file(self,**kwargs):
+        """Validate a submission or data file in this process
+
         :param file_path: Path to file to check 
         :param data: YAML document already read
         :return: True on success 
@@ -211,19 +812,71 @@ class Validator:
             raise LookupError('The file_path argument is mandatory')
 
         if verb:
-            print('Validating {}'.format(filename))
-                  
+            print('Validating {} using the {} YAML backend'
+                  .format(filename,self._backend))
+
+        if (self._stream and data is None and
+            os.path.basename(filename) != 'submission.yaml'):
+            # A data file given directly rather than from a submission
+            return self.validate_stream(filename,verb)
+
+        with self.span('file',filename):
+            ret = self.validate_documents(filename,data,verb)
+
+        self.more_errors(filename)
+        return ret
+
+    def more_errors(self,filename):
+        """Tell if errors of a file were not reported, as there were more
+        than the limit per file, and start counting anew"""
+        if self._errcount.pop(filename,0) > self._maxerrors:
+            self.add_error(filename,'More errors not shown')
+
+    def check_schema(self,validator,filename,doc):
+        """Check a document against a schema, reporting every error up
+        to the limit of errors per file
+
+        :param validator: Compiled validator of the schema
+        :param filename: File of the document
+        :param doc: The document
+        :raises SchemaErrors: If the document does not match the schema
+        """
+        # Stop at the first error beyond the limit: finding every error
+        # of a large table takes long, and they would not be shown
+        count = self._errcount.get(filename,0)
+        found = 0
+        for ve in itertools.islice(validator.iter_errors(doc),
+                                   max(self._maxerrors-count,0)+1):
+            found += 1
+            if count+found > self._maxerrors:
+                break
+            self.add_error(filename,'{} at {} in\n{}'
+                           .format(ve.message,
+                                   json_path('',ve.absolute_path) or
+                                   '<document>',
+                                   preview(ve.instance)))
+        self._errcount[filename] = count+found
+        if found:
+            raise SchemaErrors('Schema errors in {}'.format(filename))
+
+    def validate_documents(self,filename,data,verb):
+        """Validate the documents of a file
+
+        :param filename: Path to the file
+        :param data: YAML documents already read, or None to read them
+        :return: True on success
+        """
         try:
             # Check if we have data 
             if data is None:
                 if verb:
                     print('Reading in {}'.format(filename))
 
-                data = yaml.load_all(open(filename,'r'),
-                                     Loader=yaml.SafeLoader)
+                data = self._backend.load_all(self._files.open(filename))
 
-            # Make a list of this 
-            data = list(data)
+            # Make a list of this, which parses the file if not done
+            with self.span('parse',filename):
+                data = list(data)
 
             # Loop over documents in data to extract tables.
             # We build a dictionary from table name to data table document
@@ -253,47 +906,139 @@ class Validator:
                 if doc is None:
                     continue
 
+                self.validate_document(filename,doc,verb)
+
+            return not self.has_errors()
+
+        except yaml.scanner.ScannerError as e:
+            if verb:
+                print('Scanning error: {}'.format(e))
+            self.add_error(filename,
+                             'Problem parsing file.\n'
+                             + str(e))
+
+        except Exception as e:
+            if verb:
+                print('General exception: {}'.format(e))
+            self.add_error(filename, str(e))
+
+        return False
+
+    def validate_document(self,filename,doc,verb):
+        """Validate one document of a file, by what it contains
+
+        :param filename: Path to the file
+        :param doc: The document
+        """
+        if verb:
+            print('Check a document')
+
+        self.mark_referenced(filename,doc)
+        try:
+            # If the document has the field 'data_file', it is
+            # a submission (table meta data) entry
+            #
+            # If the document has the field
+            # 'independent_variables', then it is a data table
+            # entry.
+            # If the same document also has a 'description' field,
+            # then it comes from a single YAML file.
+            #
+            # If neither of those fields are found, we assume
+            # that we have additional information in the
+            # document
+            #
+            if 'data_file' in doc:
+                self.validate_sub(filename,doc,verb)
+            elif 'independent_variables' in doc:
+                if 'description' in doc:  # check for single-YAML-file format
+                    doc_dat = {
+                        'independent_variables': doc.pop('independent_variables', None),
+                        'dependent_variables': doc.pop('dependent_variables', None)
+                    }
+                    self.validate_dat(filename, doc_dat, verb)
+                    doc['data_file'] = ''  # since schema requires a data_file
+                    self.validate_sub(filename, doc, verb)
+                else:  # usual YAML data file
+                    self.validate_dat(filename,doc,verb)
+            else:
+                self.validate_add(filename,doc,verb)
+
+        except SchemaErrors as se:
+            # The errors have been reported already
+            if verb:
+                print(se)
+
+    def validate_data(self,filename,verb,stream=None):
+        """Validate a data file referenced from a submission
+
+        If a result cache is used, the messages of a data file that
+        was validated before with the same content are reused.
+
+        :param filename: Path to the data file
+        :param stream: Open stream of the file, or None to open it
+        :return: True on success
+        """
+        with self.span('data',filename):
+            return self.validate_data_file(filename,verb,stream)
+
+    def validate_data_file(self,filename,verb,stream=None):
+        """Validate a data file, see validate_data"""
+        key = None
+        if self._cache is not None and stream is None:
+            key    = self._cache.key(filename,self._cachetag,self._files)
+            cached = None if key is None else self._cache.get(key)
+            if cached is not None:
                 if verb:
-                    print('Check a document')
-                    
-                try:
-                    # If the document has the field 'data_file', it is
-                    # a submission (table meta data) entry
-                    #
-                    # If the document has the field
-                    # 'independent_variables', then it is a data table
-                    # entry.
-                    # If the same document also has a 'description' field,
-                    # then it comes from a single YAML file.
-                    #
-                    # If neither of those fields are found, we assume
-                    # that we have additional information in the
-                    # document
-                    #
-                    if 'data_file' in doc:
-                        self.validate_sub(filename,doc,verb)
-                    elif 'independent_variables' in doc:
-                        if 'description' in doc:  # check for single-YAML-file format
-                            doc_dat = {
-                                'independent_variables': doc.pop('independent_variables', None),
-                                'dependent_variables': doc.pop('dependent_variables', None)
-                            }
-                            self.validate_dat(filename, doc_dat, verb)
-                            doc['data_file'] = ''  # since schema requires a data_file
-                            self.validate_sub(filename, doc, verb)
-                        else:  # usual YAML data file
-                            self.validate_dat(filename,doc,verb)
-                    else:
-                        self.validate_add(filename,doc,verb)
+                    print('Using cached result for {}'.format(filename))
+                self.ensure_messages(filename)
+                for level,message in cached:
+                    self.add_message(filename,message,level)
+                return not any(level == Message.ERROR
+                               for level,message in cached)
 
-                except jsonschema.ValidationError as ve:
-                    if verb:
-                        print(ve)
-                    self.add_error(filename,
-                                   ve.message+' in\n'+
-                                   pformat(ve.instance,compact=True))
+        if key is not None:
+            # Collect the messages of the file to store them
+            self._capture[filename] = []
+        if self._stream:
+            ret = self.validate_stream(filename,verb,stream)
+        elif stream is not None:
+            ret = self.validate(file_path=filename,
+                                data=self._backend.load_all(stream),verb=verb)
+        else:
+            ret = self.validate(file_path=filename,data=None,verb=verb)
 
-            return not self.has_errors()
+        if key is not None:
+            messages = self._capture.pop(filename)
+            self._cache.put(key,messages)
+            if self._stored is not None:
+                # Validated in a worker process, for the parent's cache
+                self._stored.append((key,messages))
+        return ret
+
+    def validate_stream(self,filename,verb,stream=None):
+        """Validate a data file from its YAML event stream
+
+        Only the current entry of the values of a variable is kept in
+        memory, and the numbers of the entries for the semantic checks,
+        so the file may be much larger than memory.  Files ending in
+        .gz are decompressed on the fly.
+
+        :param filename: Path to the data file
+        :param stream: Open stream of the file, or None to open it
+        :return: True on success
+        """
+        from datastream import DataStream
+
+        if verb:
+            print('Streaming {} using the {} YAML backend'
+                  .format(filename,self._backend.event_loader().__name__))
+
+        try:
+            with stream or self._files.open(filename) as inp, \
+                 self.span('stream',filename):
+                return DataStream(self,filename,verb)\
+                    .validate(inp,self._backend.event_loader())
 
         except yaml.scanner.ScannerError as e:
             if verb:
@@ -307,6 +1052,9 @@ class Validator:
                 print('General exception: {}'.format(e))
             self.add_error(filename, str(e))
 
+        finally:
+            self.more_errors(filename)
+
         return False
 
     def validate_res(self,filename,doc,verb):
@@ -318,24 +1066,25 @@ class Validator:
         if verb:
             print('Validating additional resources')
             
-        for resource in doc.get('additional_resources',[]):
-            location = resource.get('location','')
-            if verb:
-                print(' additional resource: {}'.format(location))
+        with self.span('resources',filename):
+            for resource in doc.get('additional_resources',[]):
+                location = resource.get('location','')
+                if verb:
+                    print(' additional resource: {}'.format(location))
 
-            if location.startswith('http'):
-                # Do not check external resources
-                continue
+                if location.startswith('http'):
+                    # Do not check external resources
+                    continue
+
+                location = os.path.join(os.path.dirname(filename),location)
+                if not self.isfile(location):
+                      self.add_warning(filename,'Resource {} not found{}'
+                                       .format(location,
+                                               self.not_found(location)))
+                if '/' in resource.get('location',''):
+                      self.add_warning(filename,'Resource {} should not contain "/"'
+                                       .format(location))
 
-            location = os.path.join(os.path.dirname(filename),location)
-            if not os.path.isfile(location):
-                  self.add_warning(filename,'Resource {} not found'
-                                   .format(location))
-            if '/' in resource.get('location',''):
-                  self.add_warning(filename,'Resource {} should not contain "/"'
-                                   .format(location))
-            
-                            
     def validate_sub(self,filename,doc,verb):
         """Validates a submission file entry (table meta data)
 
@@ -347,7 +1096,8 @@ class Validator:
                   .format(doc.get('name','')))
             
         # This throws in case of errors - handled one level up 
-        jsonschema.validate(doc,self._sub_schema)
+        with self.span('schema',doc.get('name','')):
+            self.check_schema(self._sub_validator,filename,doc)
 
         # Validate additional resources in the document
         self.validate_res(filename,doc,verb)
@@ -359,12 +1109,42 @@ class Validator:
 
             # Check sanity of file path
             if '/' in df:
-                self.add_warning(Message(filename,
-                                         'Data file names should not contain "/": {}'
-                                         .format(df)))
+                self.add_warning(filename,
+                                 'Data file names should not contain "/": {}'
+                                 .format(df))
 
-            rdf = os.path.join(os.path.dirname(filename),df)
-            ret = self.validate(file_path=rdf,data=None,verb=verb)
+            rdf  = os.path.join(os.path.dirname(filename),df)
+            real = os.path.realpath(rdf)
+            self._datafiles[rdf] = filename
+            if real in self._used:
+                # Validated once in this run, under the first reference
+                self.add_warning(filename,'Data file {} of {} is also used '
+                                 'by {}'.format(df,doc['name'],
+                                                self._used[real]))
+            elif not self.isfile(rdf):
+                # Report as opening the file would, without trying
+                self.add_error(rdf,str(IOError(errno.ENOENT,
+                                               os.strerror(errno.ENOENT),
+                                               rdf)))
+                hint = self.not_found(rdf)
+                if hint:
+                    self.add_warning(filename,'Data file {} not found{}'
+                                     .format(rdf,hint))
+            elif self._files.sequential:
+                # Reserve the place of the data file messages, and
+                # validate it when scanning the archive
+                self.ensure_messages(rdf)
+                self._deferred.append(rdf)
+            elif self._pool is not None:
+                # Reserve the place of the data file messages, and
+                # validate it in the process pool
+                self.ensure_messages(rdf)
+                self._pending.append((rdf,
+                                      self._pool.submit(_validate_worker,
+                                                        rdf)))
+            else:
+                ret = self.validate_data(rdf,verb)
+            self._used.setdefault(real,doc['name'])
 
         self.add_info(filename,"Contains the valid submission {}".format(doc['name']))
 
@@ -380,7 +1160,8 @@ class Validator:
                   .format(doc.get('name','')))
             
         # This raises in case of problems - handled one level up
-        jsonschema.validate(doc,self._dat_schema)
+        with self.span('schema',doc.get('name',filename)):
+            self.check_schema(self._dat_validator,filename,doc)
 
         len_indep = [len(i['values']) for i in doc['independent_variables']]
         len_dep   = [len(d['values']) for d in doc['dependent_variables']]
@@ -390,6 +1171,12 @@ class Validator:
             self.add_warning(filename,"Inconsistent lengths of independent "
                         "variables {} and dependent variables {}"
                         .format(str(len_indep),str(len_dep)))
+        elif self._semantic:
+            # Bins, errors and numbers, checked column by column
+            with self.span('semantic',doc.get('name',filename)):
+                problems = self.load_semantic()(doc)
+            for problem in problems:
+                self.add_warning(filename,problem)
 
         self.add_info(filename,"Contains a valid data table {}"
                       .format(doc.get('name','')))
@@ -404,27 +1191,219 @@ class Validator:
             print('Validating header entry')
             
         # This raises in case of problems - handled one level up
-        jsonschema.validate(doc,self._add_schema)
+        with self.span('schema','additional information'):
+            self.check_schema(self._add_validator,filename,doc)
         
         # Validate additional resources in the document
         self.validate_res(filename,doc,verb)
         
         self.add_info(filename,"Contains valid additional information")
-            
-if __name__ == "__main__":
+
+# ====================================================================
+def report(v,lvl):
+    """Print the outcome of a validation
+
+    :param v: The Validator
+    :param lvl: Least level of messages to summarize
+    :return: True if there were errors
+    """
+    v.summarize(lvl)
+    e = v.has_errors(None)
+    if e or v.has_warnings(None):
+        v.print_messages(None,Message.WARNING)
+        if e:
+            print('There was a problem')
+    return e
+
+# --------------------------------------------------------------------
+def watch(v,filename,lvl,verb=False,interval=1.0,polling=False):
+    """Validate a submission again whenever its files change
+
+    The validator, and its compiled schemas, stay in memory between
+    rounds.  If only data files changed, only those are validated
+    again.  Otherwise the submission file is validated again, but
+    unchanged data files are not (provided the validator has a cache,
+    e.g. a watch.StatCache).  Stops on keyboard interrupt.
+
+    :param v: The Validator, which has already validated the submission
+    :param filename: The submission file
+    :param lvl: Least level of messages to summarize
+    :param interval: Seconds between polls, if polling
+    :param polling: Poll the directory instead of using inotify
+    """
+    from watch import make_watcher
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    while not os.path.isdir(directory):
+        # A file in an archive: watch the directory of the archive
+        directory = os.path.dirname(directory)
+    watcher   = make_watcher(directory,interval,polling)
+    if verb:
+        print('Watching {} using {}'.format(directory,
+                                            type(watcher).__name__))
+    try:
+        while True:
+            changed = watcher.wait()
+            data    = dict((os.path.abspath(f),f) for f in v._datafiles)
+            others  = [f for f in changed if f not in data and
+                       not os.path.basename(f).startswith('.') and
+                       not f.endswith('~')]
+            if not others and not any(f in data for f in changed):
+                continue
+
+            print('--- {} changed: {}'
+                  .format(time.strftime('%H:%M:%S'),
+                          ', '.join(sorted(os.path.basename(f)
+                                           for f in changed))))
+            if others:
+                # The submission or its resources changed
+                v.reset()
+                v.validate(file_path=filename,data=None,verbose=verb)
+            else:
+                v.validate_again([data[f] for f in sorted(changed)
+                                  if f in data],verb)
+
+            e = report(v,lvl)
+            if not e and not v.has_warnings():
+                print('No problems found')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+# ====================================================================
+def validator_arguments(parser):
+    """Add the options of the Validator to a command line parser"""
     import argparse as ap
-    import sys
-    
+
     def check_dir(val):
         if not os.path.isdir(val):
             raise ap.ArgumentTypeError('{} is not a directory'
                                        .format(val))
         return val
 
+    parser.add_argument('-s',
+                        '--schema',
+                        type=check_dir,
+                        help='Location of schema files')
+    parser.add_argument('-f',
+                        '--format',
+                        dest='formats',
+                        action='append',
+                        metavar='FORMAT',
+                        help='Check this "format" of strings (may be '
+                        'repeated, or "all" for all known formats)')
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Stream data files instead of reading them in')
+    parser.add_argument('--max-errors',
+                        type=int,
+                        default=10,
+                        help='Most schema errors reported per file')
+    parser.add_argument('--no-semantic',
+                        dest='semantic',
+                        action='store_false',
+                        help='Do not check bins, errors and numbers of '
+                        'data tables (checked if NumPy is installed)')
+    parser.add_argument('-y',
+                        '--yaml-backend',
+                        help='YAML parser to use, one of {} or '
+                        'module:function (default: fastest available)'
+                        .format(', '.join(available_backends())))
+    parser.add_argument('--no-cache',
+                        dest='cache',
+                        action='store_false',
+                        help='Do not reuse results of unchanged data files')
+    parser.add_argument('--cache-dir',
+                        help='Location of the result cache (default: {})'
+                        .format(default_cache_dir()))
+    parser.add_argument('--cache-size',
+                        type=float,
+                        default=64,
+                        help='Largest size of the result cache in MB')
+
+def validator_options(args):
+    """Get the arguments of Validator from parsed command line options
+
+    :param args: Options added by validator_arguments
+    :return: Dictionary of keyword arguments
+    """
+    formats = args.formats
+    if formats is not None and 'all' in formats:
+        formats = 'all'
+
+    cache = None
+    if args.cache:
+        cache = ResultCache(args.cache_dir,int(args.cache_size*(1<<20)))
+
+    return dict(schemadir=args.schema,formats=formats,stream=args.stream,
+                max_errors=args.max_errors,backend=args.yaml_backend,
+                cache=cache,semantic=args.semantic)
+
+def validator_settings(args):
+    """Get the options of the Validator in a form that can be compared
+    between processes, e.g. those of a client and a server
+
+    :param args: Options added by validator_arguments
+    :return: Dictionary of JSON values
+    """
+    formats = args.formats
+    if formats is not None:
+        formats = 'all' if 'all' in formats else sorted(set(formats))
+    cache = None
+    if args.cache:
+        cache = [os.path.abspath(args.cache_dir or default_cache_dir()),
+                 args.cache_size]
+
+    return {'schema':     args.schema and os.path.abspath(args.schema),
+            'formats':    formats,
+            'stream':     args.stream,
+            'max_errors': args.max_errors,
+            'backend':    get_backend(args.yaml_backend).name,
+            'semantic':   args.semantic,
+            'cache':      cache}
+
+# ====================================================================
+# Validator of each worker process, when validating in a process pool
+_worker = None
+
+def _init_worker(schemadir,formats,stream,max_errors,backend,cache,files,
+                 semantic,profile):
+    """Create the validator of a worker process"""
+    global _worker
+    _worker = Validator(schemadir,formats,stream=stream,
+                        max_errors=max_errors,backend=backend,cache=cache,
+                        files=files,semantic=semantic)
+    if profile:
+        from profiling import Profile
+        _worker.add_observer(Profile())
+
+def _validate_worker(filename):
+    """Validate a data file in a worker process
+
+    :param filename: Data file to validate
+    :return: The messages of the validation, the spans timed (see
+             profiling.py), and the results stored in the cache as
+             (key, messages)
+    """
+    _worker.clear_messages()
+    _worker._tables = {}
+    _worker._stored = []
+    for o in _worker._observers:
+        o.clear()
+    _worker.validate_data(filename,False)
+    return (_worker.get_messages(),
+            [s for o in _worker._observers for s in o.spans()],
+            _worker._stored)
+
+# ====================================================================
+if __name__ == "__main__":
+    import argparse as ap
+
     parser = ap.ArgumentParser(description="Validates HepData files")
     parser.add_argument('input',
-                        type=ap.FileType('r'),
-                        help='File to parse',
+                        help='File, directory or archive (.zip, .tar, '
+                        '.tar.gz, .tgz) to parse',
                         default='submission.yaml')
     parser.add_argument('-v',
                         '--verbose',
@@ -441,28 +1420,84 @@ if __name__ == "__main__":
                         default='WARNING',
                         choices=['INFO','WARNING','ERROR'],
                         help='Level of output')
-    parser.add_argument('-s',
-                        '--schema',
-                        type=check_dir,
-                        help='Location of schema files')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of processes to validate data files')
+    validator_arguments(parser)
+    parser.add_argument('-o',
+                        '--output',
+                        help='Write messages to this file as JSON lines as '
+                        'soon as they are found, rather than keeping them '
+                        'to print at the end')
+    parser.add_argument('--profile',
+                        metavar='BASENAME',
+                        help='Write the timing of each phase to '
+                        'BASENAME.json, and as a Chrome trace to '
+                        'BASENAME.trace.json')
+    parser.add_argument('-w',
+                        '--watch',
+                        action='store_true',
+                        help='Validate again whenever files change')
+    parser.add_argument('--poll',
+                        type=float,
+                        metavar='SECONDS',
+                        help='Poll for changes at this interval, rather '
+                        'than use inotify (with --watch)')
     parser.set_defaults(verbose=False)
     
     args = parser.parse_args()
 
     lvl = getattr(Message, args.level)
 
-    v = Validator(args.schema)
+    options = validator_options(args)
+    if args.watch:
+        from watch import StatCache
+        options['cache'] = StatCache(options['cache'])
+
+    try:
+        files, filename = open_source(args.input)
+    except ArchiveError as e:
+        # Reported below like any other error of the submission
+        files, filename, broken = LocalFiles(), None, e
+    else:
+        broken = None
+        if filename is None:
+            print('No submission.yaml found in {}'.format(args.input))
+            sys.exit(1)
+
+    sink = None
+    if args.output:
+        sink = JsonLinesSink(open(args.output,'w'),lvl)
+
+    v = Validator(jobs=args.jobs,files=files,sink=sink,keep=sink is None,
+                  **options)
+    if args.profile:
+        from profiling import Profile
+        profile = Profile()
+        v.add_observer(profile)
 
-    v.validate(file_path=args.input.name,
+    if broken is not None:
+        v.add_error(args.input,str(broken))
+        report(v,lvl)
+        sys.exit(1)
+
+    v.validate(file_path=filename,
                data=None,
                verbose=args.verbose)
-    v.summarize(lvl)
-    e = v.has_errors(None)
-    if e or v.has_warnings(None):
-        v.print_messages(None,Message.WARNING)
-        if e:
-            print('There was a problem')
-            sys.exit(1)
+    e = report(v,lvl)
+
+    if args.profile:
+        print('Profile written to {}'.format(' and '
+                                             .join(profile.write(args.profile))))
+        profile.print_summary()
+
+    if args.watch:
+        watch(v,filename,lvl,args.verbose,
+              args.poll or 1.0,args.poll is not None)
+    elif e:
+        sys.exit(1)
 
 # ====================================================================
 #
@@ -0,0 +1,210 @@
+"""
+Watch a submission directory for changed files.
+
+On Linux the directory is watched with inotify (through ctypes, so no
+extra packages are needed).  Elsewhere, or if inotify cannot be used,
+the directory is polled for changed modification times and sizes.
+
+Used by the --watch mode of validate.py.
+"""
+import os
+import select
+import struct
+import time
+
+# ====================================================================
+class PollingWatcher:
+    """Finds changed files by polling a directory"""
+
+    def __init__(self,directory,interval=1.0):
+        """Create watcher
+
+        :param directory: Directory to watch
+        :param interval: Seconds between polls
+        """
+        self._dir      = directory
+        self._interval = interval
+        self._state    = self.snapshot()
+
+    def snapshot(self):
+        """Modification time and size of each file in the directory"""
+        ret = {}
+        for e in os.scandir(self._dir):
+            if e.is_file():
+                st = e.stat()
+                ret[e.path] = (st.st_mtime_ns,st.st_size)
+        return ret
+
+    def wait(self):
+        """Wait for files to change
+
+        :return: Set of paths of changed, created or removed files
+        """
+        while True:
+            time.sleep(self._interval)
+            state = self.snapshot()
+            changed = set(p for p in set(state)|set(self._state)
+                          if state.get(p) != self._state.get(p))
+            self._state = state
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+# ====================================================================
+class InotifyWatcher:
+    """Finds changed files with the Linux inotify interface"""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_CLOEXEC     = 0o2000000
+    EVENT          = struct.Struct('iIII')
+
+    def __init__(self,directory,settle=0.1):
+        """Create watcher
+
+        :param directory: Directory to watch
+        :param settle: Seconds to wait for more events after the first,
+                       as editors often write a file in several steps
+        """
+        import ctypes
+        import ctypes.util
+
+        self._dir    = directory
+        self._settle = settle
+        self._libc   = ctypes.CDLL(ctypes.util.find_library('c'),
+                                   use_errno=True)
+        self._fd     = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(),'inotify_init1 failed')
+
+        mask = (self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO |
+                self.IN_CREATE | self.IN_DELETE)
+        wd   = self._libc.inotify_add_watch(self._fd,
+                                            os.fsencode(directory),mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err,'inotify_add_watch failed on {}'
+                          .format(directory))
+
+    def read(self,timeout):
+        """Read the names in pending events
+
+        :param timeout: Seconds to wait for events, or None for ever
+        :return: Set of paths
+        """
+        ret = set()
+        r, w, x = select.select([self._fd],[],[],timeout)
+        if not r:
+            return ret
+
+        buf = os.read(self._fd,65536)
+        pos = 0
+        while pos < len(buf):
+            wd, mask, cookie, length = self.EVENT.unpack_from(buf,pos)
+            pos += self.EVENT.size
+            name = buf[pos:pos+length].rstrip(b'\0')
+            pos += length
+            if name:
+                ret.add(os.path.join(self._dir,os.fsdecode(name)))
+        return ret
+
+    def wait(self):
+        """Wait for files to change
+
+        :return: Set of paths of changed, created or removed files
+        """
+        changed = self.read(None)
+        while True:
+            more = self.read(self._settle)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        os.close(self._fd)
+
+# ====================================================================
+def make_watcher(directory,interval=1.0,polling=False):
+    """Create the best available watcher for a directory
+
+    :param directory: Directory to watch
+    :param interval: Seconds between polls, if polling
+    :param polling: Always poll, rather than use inotify
+    :return: A watcher with the methods wait and close
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError,AttributeError,TypeError):
+            # No inotify on this system, or no watches left
+            pass
+    return PollingWatcher(directory,interval)
+
+# ====================================================================
+class StatCache:
+    """In-memory cache of validation results, for a watch session
+
+    Has the same interface as resultcache.ResultCache, but the key is
+    the path, modification time and size of the file (of the archive,
+    for a file in an archive), so unchanged files are not even read.
+    Misses are passed on to another cache if given, with the path as
+    given, so that its entries are shared with runs without watching.
+    """
+
+    def __init__(self,inner=None):
+        """Create the cache
+
+        :param inner: Cache to fall back on, e.g. a ResultCache
+        """
+        self._inner   = inner
+        self._files   = None
+        self._results = {}
+
+    @property
+    def directory(self):
+        """Where the cache fallen back on is stored, or None"""
+        return getattr(self._inner,'directory',None)
+
+    def key(self,filename,tag,files=None):
+        from archive import LocalFiles
+
+        self._files = files
+        st = (files or LocalFiles()).stat(filename)
+        if st is None:
+            return None
+        return (filename,)+st+(tag,)
+
+    def get(self,key):
+        if key in self._results:
+            return self._results[key]
+        if self._inner is None:
+            return None
+
+        inner = self._inner.key(key[0],key[3],self._files)
+        ret   = None if inner is None else self._inner.get(inner)
+        if ret is not None:
+            self._results[key] = ret
+        return ret
+
+    def put(self,key,messages):
+        self._results[key] = messages
+        if self._inner is not None:
+            inner = self._inner.key(key[0],key[3],self._files)
+            if inner is not None:
+                self._inner.put(inner,messages)
+
+    def remember(self,key,messages):
+        """Keep the messages of a key stored by a worker process, which
+        has its own copy of the cache (and has stored them in the cache
+        fallen back on already)"""
+        self._results[key] = messages
+
+# ====================================================================
+#
+# EOF
+#
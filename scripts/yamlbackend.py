@@ -0,0 +1,136 @@
+"""
+YAML parser backends shared by check.py and validate.py.
+
+By default the fastest available backend is used: the libyaml based
+loader of PyYAML if PyYAML was built with it, and the pure Python
+loader otherwise.  A backend can be chosen by name, either explicitly
+or with the HEPDATA_YAML_BACKEND environment variable, e.g.
+
+  HEPDATA_YAML_BACKEND=python ./check.py
+
+Other (faster) parsers can be plugged in with register_backend, or by
+giving "module:function" as the backend name, where function takes an
+open stream and returns an iterable over its documents.
+"""
+import importlib
+import os
+import yaml
+
+# ====================================================================
+class Backend:
+    """A way of parsing YAML documents"""
+
+    def __init__(self,name,load_all,loader=None):
+        """Create a backend
+
+        :param name: Name of the backend
+        :param load_all: Function from stream to iterable over documents
+        :param loader: PyYAML loader class, if the backend is one
+        """
+        self.name      = name
+        self.loader    = loader
+        self._load_all = load_all
+
+    def load_all(self,stream):
+        """Parse all documents of a stream
+
+        :param stream: Open file or string
+        :return: Iterable over documents
+        """
+        return self._load_all(stream)
+
+    def load(self,stream):
+        """Parse the single document of a stream
+
+        :param stream: Open file or string
+        :return: The document
+        """
+        if self.loader is not None:
+            return yaml.load(stream,Loader=self.loader)
+
+        docs = list(self._load_all(stream))
+        if len(docs) > 1:
+            raise ValueError('expected a single document in the stream')
+        return docs[0] if docs else None
+
+    def event_loader(self):
+        """Get a PyYAML loader for event based (streaming) parsing
+
+        :return: The loader of this backend, or the best PyYAML loader
+                 if this backend is not based on PyYAML
+        """
+        if self.loader is not None:
+            return self.loader
+        for backend in _backends.values():
+            if backend.loader is not None:
+                return backend.loader
+        return yaml.SafeLoader
+
+    def __str__(self):
+        return self.name
+
+# ====================================================================
+# Registered backends, in order of preference
+_backends = {}
+
+def register_backend(backend,first=False):
+    """Register a backend
+
+    :param backend: The Backend
+    :param first: Prefer this over the already registered backends
+    """
+    global _backends
+    if first:
+        _backends = dict([(backend.name,backend)] +
+                         [(n,b) for n,b in _backends.items()
+                          if n != backend.name])
+    else:
+        _backends[backend.name] = backend
+
+def pyyaml_backend(name,loader):
+    """Make a backend from a PyYAML loader class"""
+    return Backend(name,lambda s: yaml.load_all(s,Loader=loader),loader)
+
+if getattr(yaml,'__with_libyaml__',False):
+    register_backend(pyyaml_backend('libyaml',yaml.CSafeLoader))
+register_backend(pyyaml_backend('python',yaml.SafeLoader))
+
+# --------------------------------------------------------------------
+def available_backends():
+    """Names of the registered backends, most preferred first"""
+    return list(_backends)
+
+# --------------------------------------------------------------------
+def get_backend(name=None):
+    """Get a backend by name
+
+    :param name: Name of a registered backend, "module:function" for a
+                 plugin, or None for HEPDATA_YAML_BACKEND or else the
+                 most preferred backend
+    :return: The Backend
+    """
+    if name is None:
+        name = os.environ.get('HEPDATA_YAML_BACKEND') or None
+    if name is None:
+        return next(iter(_backends.values()))
+    if name in _backends:
+        return _backends[name]
+
+    if ':' in name:
+        module, func = name.split(':',1)
+        backend = Backend(name,getattr(importlib.import_module(module),func))
+        register_backend(backend)
+        return backend
+
+    raise ValueError('Unknown YAML backend {}, choose one of {}'
+                     .format(name,', '.join(_backends)))
+
+# --------------------------------------------------------------------
+def safe_dumper():
+    """The fastest available safe PyYAML dumper class"""
+    return getattr(yaml,'CSafeDumper',yaml.SafeDumper)
+
+# ====================================================================
+#
+# EOF
+#